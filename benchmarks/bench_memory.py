@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# See the COPYING file for license information.
+#
+# Copyright (c) 2012 peo3 <peo314159265@gmail.com>
+#
+# Usage: python benchmarks/bench_memory.py [N_NODES ...]
+#
+# It reports memory of cgroups with the __slots__ layout of CGroup and
+# with a dict-backed copy of the class, i.e., the layout before it.
+
+import sys
+import shutil
+import tempfile
+import tracemalloc
+
+import synthetic
+from cgutils import cgroup
+
+
+DEFAULT_SIZES = [10000, 100000]
+
+
+def _dict_backed(cls):
+    """
+    It returns a copy of the class whose instances keep attributes in
+    a __dict__, i.e., the layout of CGroup before __slots__.
+    """
+    slots = set(cls.__slots__) | set(['__slots__', '__dict__', '__weakref__'])
+    namespace = dict((name, value) for name, value in vars(cls).items()
+                     if name not in slots)
+    return type('Dict' + cls.__name__, cls.__bases__, namespace)
+
+
+def bench(n_nodes, cgroup_class):
+    root = tempfile.mkdtemp(prefix='cgutils-bench-')
+    saved = cgroup.CGroup
+    # Cgroups are made by scan_cgroups through the module global
+    cgroup.CGroup = cgroup_class
+    try:
+        status = synthetic.build(root, n_nodes)
+        # Probe the hierarchy before measuring; the schema is shared
+        cgroup.scan_cgroups('memory', status=status)
+
+        tracemalloc.start()
+        bef = tracemalloc.get_traced_memory()[0]
+        root_cgroup = cgroup.scan_cgroups('memory', filters=['usage_in_bytes'], status=status)
+        cgroups = []
+        cgroup.walk_cgroups(root_cgroup, lambda cg, store: store.append(cg), cgroups)
+        for cg in cgroups:
+            cg.n_procs
+        aft = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        # Exclude the list holding the cgroups
+        return aft - bef - sys.getsizeof(cgroups)
+    finally:
+        cgroup.CGroup = saved
+        shutil.rmtree(root)
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or DEFAULT_SIZES
+
+    layouts = [('__dict__', _dict_backed(cgroup.CGroup)),
+               ('__slots__', cgroup.CGroup)]
+    for n_nodes in sizes:
+        for label, cgroup_class in layouts:
+            used = bench(n_nodes, cgroup_class)
+            print("%6d cgroups, %-9s: %8.1f KiB (%.0f bytes/cgroup)" %
+                  (n_nodes, label, used / 1024.0, float(used) / n_nodes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# See the COPYING file for license information.
+#
+# Copyright (c) 2012 peo3 <peo314159265@gmail.com>
+#
+# Usage: python benchmarks/bench_parse.py [N_CGROUPS]
+#
+# It shows the time to parse the stat files which top reads for
+# N_CGROUPS cgroups in a tick, with and without key filters.
+
+import sys
+import time
+
+import synthetic
+from cgutils import cgroup
+
+
+BLKIO_STAT = ''.join('8:%d %s %d\n' % (minor, op, 1024 * minor)
+                     for minor in range(16)
+                     for op in ('Read', 'Write', 'Sync', 'Async', 'Total')) + 'Total 0\n'
+
+CASES = [
+    ('memory.stat', cgroup.SimpleStat, synthetic.MEMORY_STAT, ['rss']),
+    ('blkio.throttle.io_service_bytes', cgroup.BlkioStat, BLKIO_STAT, ['Read', 'Write']),
+]
+
+
+def bench(parse, content, n, *args):
+    bef = time.time()
+    for _ in range(n):
+        parse(content, *args)
+    return time.time() - bef
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for name, cls, content, keys in CASES:
+        full = bench(cls.parse, content, n)
+        keyed = bench(cls.parse, content, n, frozenset(keys))
+        print("%s x %d: %.1f msec for all keys, %.1f msec for %s" %
+              (name, n, full * 1000, keyed * 1000, ','.join(keys)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# See the COPYING file for license information.
+#
+# Copyright (c) 2013 peo3 <peo314159265@gmail.com>
+#
+# Usage: python benchmarks/bench_pids.py [N_PIDS ...]
+#
+# Compares reading pids of groups for a tick of top: cgroup.procs
+# of the three hierarchies read twice each and merged, as top used to,
+# against a single read of one hierarchy. The three hierarchies are
+# simulated by reading the same synthetic groups.
+
+import sys
+import time
+import shutil
+import tempfile
+
+import synthetic
+from cgutils import cgroup
+
+
+N_CGROUPS = 200
+N_HIERARCHIES = 3
+DEFAULT_SIZES = [10, 1000, 5000]
+
+
+def bench(n_pids):
+    root = tempfile.mkdtemp(prefix='cgutils-bench-')
+    try:
+        procs = ''.join('%d\n' % (1000 + i) for i in range(n_pids))
+        status = synthetic.build(root, N_CGROUPS, files={'cgroup.procs': procs})
+        cgroups = list(cgroup.iter_cgroups('memory', status=status))
+
+        bef = time.time()
+        for cg in cgroups:
+            pids = []
+            for i in range(N_HIERARCHIES):
+                # Once in update() and once in get_cgroup_stats()
+                cg.update()
+                cg.update()
+                pids += cg.pids
+            len(set(pids))
+        mid = time.time()
+        for cg in cgroups:
+            cg.update()
+            len(set(cg.pids))
+        aft = time.time()
+        return mid - bef, aft - mid
+    finally:
+        shutil.rmtree(root)
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or DEFAULT_SIZES
+
+    for n_pids in sizes:
+        before, after = bench(n_pids)
+        print("%5d pids x %d cgroups: %8.1f msec per hierarchy x2, %8.1f msec once (%.1fx)" %
+              (n_pids, N_CGROUPS, before * 1000, after * 1000, before / after))
+
+
+if __name__ == '__main__':
+    main()
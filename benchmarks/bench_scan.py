@@ -0,0 +1,72 @@
+#!/usr/bin/python
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# See the COPYING file for license information.
+#
+# Copyright (c) 2012 peo3 <peo314159265@gmail.com>
+#
+# Usage: python benchmarks/bench_scan.py [N_NODES ...]
+
+import sys
+import time
+import shutil
+import tempfile
+
+import synthetic
+from cgutils import cgroup
+
+
+DEFAULT_SIZES = [1000, 10000, 50000]
+
+
+WORKERS = [1, 8]
+
+
+def bench(n_nodes):
+    root = tempfile.mkdtemp(prefix='cgutils-bench-')
+    try:
+        status = synthetic.build(root, n_nodes)
+
+        results = []
+        for workers in WORKERS:
+            bef = time.time()
+            root_cgroup = cgroup.scan_cgroups('memory', status=status, workers=workers)
+            cgroups = []
+            cgroup.walk_cgroups(root_cgroup, lambda cg, store: store.append(cg), cgroups)
+            cgroup.map_cgroups(lambda cg: cg.get_stats(), cgroups, workers)
+            aft = time.time()
+            results.append((workers, aft - bef))
+        return results
+    finally:
+        shutil.rmtree(root)
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or DEFAULT_SIZES
+
+    bef = time.time()
+    cgroup.SubsystemStatus()
+    aft = time.time()
+    print("%.3f msec to parse /proc/cgroups and /proc/mounts once" % ((aft - bef) * 1000))
+
+    for n_nodes in sizes:
+        for workers, elapsed in bench(n_nodes):
+            print("%6d cgroups, %d workers: %8.1f msec to scan and read stats (%.1f usec/cgroup)" %
+                  (n_nodes, workers, elapsed * 1000, elapsed * 1000 * 1000 / n_nodes))
+
+
+if __name__ == '__main__':
+    main()
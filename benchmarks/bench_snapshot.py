@@ -0,0 +1,75 @@
+#!/usr/bin/python
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# See the COPYING file for license information.
+#
+# Copyright (c) 2013 peo3 <peo314159265@gmail.com>
+#
+# Usage: python benchmarks/bench_snapshot.py [N_CGROUPS ...]
+
+import sys
+import time
+
+import synthetic
+from cgutils import cgroup
+from cgutils import snapshot
+
+
+DEFAULT_SIZES = [10000, 50000]
+
+
+def make_records(layout, n_cgroups, tick):
+    # Like samples of top's memory filters
+    return [layout.make_record({
+        'usage_in_bytes': 4096 * (i + tick),
+        'memsw.usage_in_bytes': 8192 * (i + tick),
+        'stat': {'rss': 1024 * (i + tick)},
+    }) for i in range(n_cgroups)]
+
+
+def bench(n_cgroups, backend):
+    layout = cgroup.StatLayout()
+    keys = ['group%d.scope' % i for i in range(n_cgroups)]
+    prev = snapshot.Snapshot.from_records(keys, make_records(layout, n_cgroups, 0), 0.0, backend)
+    records = make_records(layout, n_cgroups, 1)
+
+    bef = time.time()
+    cur = snapshot.Snapshot.from_records(keys, records, 1.0, backend)
+    mid = time.time()
+    delta = cur - prev
+    total = delta.column(('usage_in_bytes',))
+    swap = delta.subtract(delta.column(('memsw.usage_in_bytes',)), total)
+    delta.rate(('stat', 'rss'))
+    delta.tolist(swap)
+    aft = time.time()
+    return mid - bef, aft - mid
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or DEFAULT_SIZES
+
+    backends = ['array']
+    if snapshot.numpy is not None:
+        backends.append('numpy')
+    for n_cgroups in sizes:
+        for name in backends:
+            build, compute = bench(n_cgroups, snapshot.get_backend(name))
+            print("%6d cgroups, %-5s: %7.1f msec to build, %7.1f msec for deltas and rates" %
+                  (n_cgroups, name, build * 1000, compute * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# See the COPYING file for license information.
+#
+# Copyright (c) 2012 peo3 <peo314159265@gmail.com>
+#
+# Builds a fake cgroup hierarchy on a normal filesystem so that
+# benchmarks can be run without creating real cgroups.
+
+import os
+import os.path
+import sys
+
+# Import cgutils of this checkout rather than an installed one
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cgutils import cgroup  # noqa: E402
+
+
+MEMORY_STAT = """cache 69750784
+rss 3584000
+rss_huge 0
+shmem 9265152
+mapped_file 6696960
+dirty 139264
+writeback 0
+swap 0
+pgpgin 76011
+pgpgout 61563
+pgfault 119414
+pgmajfault 1
+inactive_anon 2568192
+active_anon 10240000
+inactive_file 39628800
+active_file 20856832
+unevictable 0
+hierarchical_memory_limit 9223372036854771712
+hierarchical_memsw_limit 9223372036854771712
+total_cache 69750784
+total_rss 3584000
+total_rss_huge 0
+total_shmem 9265152
+total_mapped_file 6696960
+total_dirty 139264
+total_writeback 0
+total_swap 0
+total_pgpgin 76011
+total_pgpgout 61563
+total_pgfault 119414
+total_pgmajfault 1
+total_inactive_anon 2568192
+total_active_anon 10240000
+total_inactive_file 39628800
+total_active_file 20856832
+total_unevictable 0
+"""
+
+FILES = {
+    'cgroup.procs': '1000\n1001\n1002\n1003\n',
+    'tasks': '1000\n1001\n1002\n1003\n',
+    'notify_on_release': '0\n',
+    'cgroup.clone_children': '0\n',
+    'memory.usage_in_bytes': '868950016\n',
+    'memory.max_usage_in_bytes': '868950016\n',
+    'memory.limit_in_bytes': '9223372036854771712\n',
+    'memory.swappiness': '60\n',
+    'memory.stat': MEMORY_STAT,
+}
+
+
+def _populate(path, files):
+    os.mkdir(path)
+    for name, content in files.items():
+        with open(os.path.join(path, name), 'w') as f:
+            f.write(content)
+
+
+def build(root, n_nodes, fanout=32, files=None):
+    """
+    It builds a memory hierarchy of n_nodes cgroups under root and
+    returns a SubsystemStatus pointing at it. files overrides some of
+    FILES, e.g., cgroup.procs of many processes.
+    """
+    files = dict(FILES, **(files or {}))
+    proc = os.path.join(root, 'proc')
+    mount_point = os.path.join(root, 'memory')
+    os.mkdir(proc)
+    with open(os.path.join(proc, 'cgroups'), 'w') as f:
+        f.write('#subsys_name\thierarchy\tnum_cgroups\tenabled\n')
+        f.write('memory\t1\t%d\t1\n' % n_nodes)
+    with open(os.path.join(proc, 'mounts'), 'w') as f:
+        f.write('cgroup %s cgroup rw,relatime,memory 0 0\n' % mount_point)
+
+    _populate(mount_point, files)
+    queue = [mount_point]
+    n = 1
+    while n < n_nodes:
+        parent = queue.pop(0)
+        for i in range(min(fanout, n_nodes - n)):
+            path = os.path.join(parent, 'group%d.scope' % i)
+            _populate(path, files)
+            queue.append(path)
+            n += 1
+
+    return cgroup.SubsystemStatus(os.path.join(proc, 'cgroups'),
+                                  os.path.join(proc, 'mounts'))
@@ -21,6 +21,11 @@ import os.path
 import re
 import struct
 import errno
+import select
+import time
+import array
+import collections
+import threading
 
 from cgutils import host
 from cgutils import process
@@ -35,9 +40,16 @@ class SubsystemStatus(dict):
     __RE = '^(?P<name>\w+)\s+(?P<hier>\d+)\s+(?P<n>\d+)\s+(?P<enabled>[01])'
     _RE_CGROUPS = re.compile(__RE)
 
-    def __init__(self):
+    PROC_CGROUPS = '/proc/cgroups'
+    PROC_MOUNTS = '/proc/mounts'
+
+    def __init__(self, proc_cgroups=PROC_CGROUPS, proc_mounts=PROC_MOUNTS):
         dict.__init__(self)
+        self.proc_cgroups = proc_cgroups
+        self.proc_mounts = proc_mounts
         self.paths = {}
+        self.schemas = {}
+        self.registry = None
         self.update()
 
     def _parse_proc_cgroups(self):
@@ -54,7 +66,14 @@ class SubsystemStatus(dict):
         freezer	0	1	1
         net_cls	0	1	1
         """
-        for line in fileops.readlines('/proc/cgroups'):
+        try:
+            lines = fileops.readlines(self.proc_cgroups)
+        except IOError as e:
+            # Kernels without cgroup v1 may not have it; cgroup2 doesn't need it
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        for line in lines:
             m = self._RE_CGROUPS.match(line)
             if m is None:
                 continue
@@ -81,9 +100,10 @@ class SubsystemStatus(dict):
         cgroup /cgroup/memory cgroup rw,relatime,memory 0 0
         cgroup /cgroup/blkio cgroup rw,relatime,blkio 0 0
         cgroup /cgroup/freezer cgroup rw,relatime,freezer 0 0
+        cgroup2 /sys/fs/cgroup/unified cgroup2 rw,nosuid,nodev,noexec,relatime 0 0
         """
 
-        for line in fileops.readlines('/proc/mounts'):
+        for line in fileops.readlines(self.proc_mounts):
             if 'cgroup' not in line:
                 continue
 
@@ -91,6 +111,17 @@ class SubsystemStatus(dict):
             path = items[1]
             opts = items[3].split(',')
 
+            if items[2] == 'cgroup2':
+                # The unified hierarchy has no subsystem in its options
+                name = SubsystemUnified.NAME
+                self.paths[name] = path
+                self[name] = {}
+                self[name]['name'] = name
+                self[name]['enabled'] = True
+                self[name]['hierarchy'] = 0
+                self[name]['num_cgroups'] = 0
+                continue
+
             name = None
             for opt in opts:
                 if opt in self:
@@ -116,6 +147,9 @@ class SubsystemStatus(dict):
 
     def update(self):
         self.clear()
+        self.paths.clear()
+        self.schemas.clear()
+        self.registry = None
         self._update()
 
     def get_all(self):
@@ -131,6 +165,83 @@ class SubsystemStatus(dict):
     def get_path(self, subsys):
         return self.paths[subsys]
 
+    def get_release_agent(self, subsys):
+        """
+        It returns the release_agent of the hierarchy of the subsys,
+        or None if it isn't set.
+        """
+        path = self.paths.get(subsys)
+        for name, _path in self.paths.items():
+            if _path == path and self[name].get('release_agent'):
+                return self[name]['release_agent']
+        return None
+
+    def get_schema(self, subsystem):
+        """It returns the HierarchySchema of the subsystem, probing it once."""
+        name = subsystem.name
+        if name not in self.schemas:
+            self.schemas[name] = HierarchySchema(subsystem, self.get_path(name))
+        return self.schemas[name]
+
+    def get_registry(self):
+        """It returns the CGroupRegistry of the mounted hierarchies."""
+        if self.registry is None:
+            self.registry = CGroupRegistry(self)
+        return self.registry
+
+
+class MountWatcher(object):
+    """
+    It watches the mount table of the process. The kernel raises
+    POLLPRI on /proc/self/mountinfo when a mount or umount happens,
+    so changed() costs just a poll syscall.
+    """
+    PROC_MOUNTINFO = '/proc/self/mountinfo'
+
+    def __init__(self, path=PROC_MOUNTINFO):
+        self._poll = None
+        try:
+            self._file = open(path)
+        except IOError:
+            # No way to watch; treat the table as always changed
+            return
+        self._poll = select.poll()
+        self._poll.register(self._file.fileno(), select.POLLPRI | select.POLLERR)
+
+    def changed(self):
+        """It returns True if the mount table has changed since the last call."""
+        if self._poll is None:
+            return True
+        for fd, event in self._poll.poll(0):
+            if event & (select.POLLPRI | select.POLLERR):
+                return True
+        return False
+
+    def close(self):
+        if self._poll is not None:
+            self._poll.unregister(self._file.fileno())
+            self._file.close()
+            self._poll = None
+
+
+_subsystem_status = None
+_mount_watcher = None
+
+
+def get_subsystem_status():
+    """
+    It returns the SubsystemStatus shared in the process. /proc/cgroups
+    and /proc/mounts are parsed once and parsed again only when
+    the mount table has changed.
+    """
+    global _subsystem_status, _mount_watcher
+
+    if _mount_watcher is None:
+        _mount_watcher = MountWatcher()
+    if _mount_watcher.changed() or _subsystem_status is None:
+        _subsystem_status = SubsystemStatus()
+    return _subsystem_status
+
 
 class SimpleList(list):
     @staticmethod
@@ -143,32 +254,79 @@ class SimpleList(list):
 
 class SimpleStat(dict):
     @staticmethod
-    def parse(content):
+    def parse(content, keys=None):
+        """
+        If keys is given, only the keys are parsed and parsing stops
+        once all of them are found.
+        """
         ret = {}
+        if keys is None:
+            for line in content.split('\n')[:-1]:
+                name, val = line.split(' ')
+                ret[name] = long(val)
+            return ret
+
+        n_keys = len(keys)
         for line in content.split('\n')[:-1]:
-            name, val = line.split(' ')
-            ret[name] = long(val)
+            name, _, val = line.partition(' ')
+            if name in keys:
+                ret[name] = long(val)
+                if len(ret) == n_keys:
+                    break
         return ret
 
 
 class BlkioStat(dict):
     @staticmethod
-    def parse(content):
+    def parse(content, keys=None):
+        """
+        If keys is given, only the lines of the operation types in the keys,
+        e.g., Read and Write, are parsed.
+        """
         ret = {}
         for line in content.split('\n')[:-1]:
             if line.count(' ') == 2:
                 dev, type, val = line.split(' ')
+                if keys is not None and type not in keys:
+                    continue
                 if dev not in ret:
                     ret[dev] = {}
                 ret[dev][type] = long(val)
             elif line.count(' ') == 1:
                 type, val = line.split(' ')
+                if keys is not None and type not in keys:
+                    continue
                 ret[type] = long(val)
             else:
                 raise EnvironmentError(line)
         return ret
 
 
+class IoStat(dict):
+    @staticmethod
+    def parse(content, keys=None):
+        """ Parse io.stat of cgroup2
+
+        If keys is given, only the keys, e.g., rbytes and wbytes, are parsed.
+
+        >>> IoStat.parse("8:0 rbytes=4096 wbytes=0 rios=1 wios=0 dbytes=0 dios=0\\n", ['rbytes'])
+        {'8:0': {'rbytes': 4096}}
+        """
+        ret = {}
+        for line in content.split('\n'):
+            items = line.split(' ')
+            if len(items) < 2:
+                continue
+            dev = {}
+            for item in items[1:]:
+                name, _, val = item.partition('=')
+                if keys is not None and name not in keys:
+                    continue
+                dev[name] = long(val)
+            ret[items[0]] = dev
+        return ret
+
+
 class DevicesStat(list):
     @staticmethod
     def parse(content):
@@ -177,10 +335,16 @@ class DevicesStat(list):
 
 class NumaStat(dict):
     @staticmethod
-    def parse(content):
+    def parse(content, keys=None):
+        """
+        If keys is given, only the keys are parsed and parsing stops
+        once all of them are found.
+        """
         ret = {}
         lines = content.split('\n')[:-1]
         for line in lines:
+            if keys is not None and line[:line.index('=')] not in keys:
+                continue
             item = {}
             entries = line.split(' ')
             name, value = entries[0].split('=')
@@ -189,6 +353,8 @@ class NumaStat(dict):
                 node, value = entry.split('=')
                 item[node] = long(value)
             ret[name] = item
+            if keys is not None and len(ret) == len(keys):
+                break
         return ret
 
 
@@ -335,6 +501,143 @@ class RdmaStat(dict):
         return ret
 
 
+class StatLayout(object):
+    """
+    It assigns an index to each integer field of stats. A field is
+    named by a tuple of the keys leading to it from the stats, e.g.,
+    ('stat', 'rss') or ('throttle.io_service_bytes', '8:0', 'Read').
+    A layout is shared by records of a hierarchy and only grows,
+    so indices of fields never change.
+    """
+    def __init__(self):
+        self.names = []
+        self.index = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        """It returns the index of the name, adding the name if new."""
+        i = self.index.get(name)
+        if i is None:
+            with self._lock:
+                i = self.index.get(name)
+                if i is None:
+                    i = len(self.names)
+                    self.names.append(name)
+                    self.index[name] = i
+        return i
+
+    def make_record(self, stats):
+        """It converts stats returned by CGroup.get_stats to a StatRecord."""
+        fields = []
+        others = {}
+
+        def flatten(prefix, stats):
+            for key, value in stats.items():
+                name = prefix + (key,)
+                if isinstance(value, dict):
+                    flatten(name, value)
+                elif isinstance(value, long) and not isinstance(value, bool):
+                    fields.append((self.add(name), value))
+                else:
+                    others[name] = value
+        flatten((), stats)
+
+        values = array.array('q', [StatRecord.MISSING]) * len(self.names)
+        for i, value in fields:
+            values[i] = value
+        return StatRecord(self, values, others or None)
+
+
+class StatRecord(object):
+    """
+    It holds integer fields of stats in an array('q') indexed by
+    a shared StatLayout, instead of dicts repeating the same keys for
+    every cgroup and every sample. A field is accessed by its name,
+    e.g., record['stat', 'rss'] or record['usage_in_bytes']. Subtracting
+    a record from another gives a record of element-wise deltas.
+    Other values such as lists are kept in others as they are.
+    """
+    __slots__ = ('layout', 'values', 'others')
+
+    # A field which a record doesn't have
+    MISSING = -(2 ** 63)
+
+    def __init__(self, layout, values, others=None):
+        self.layout = layout
+        self.values = values
+        self.others = others
+
+    def _index(self, name):
+        if not isinstance(name, tuple):
+            name = (name,)
+        i = self.layout.index.get(name)
+        if i is None or i >= len(self.values) or self.values[i] == self.MISSING:
+            return None
+        return i
+
+    def __getitem__(self, name):
+        i = self._index(name)
+        if i is None:
+            raise KeyError(name)
+        return self.values[i]
+
+    def __contains__(self, name):
+        return self._index(name) is not None
+
+    def get(self, name, default=None):
+        i = self._index(name)
+        if i is None:
+            return default
+        return self.values[i]
+
+    def items(self):
+        """It returns name and value pairs of the integer fields."""
+        names = self.layout.names
+        return [(names[i], value) for i, value in enumerate(self.values)
+                if value != self.MISSING]
+
+    def __sub__(self, other):
+        MISSING = self.MISSING
+        values = array.array('q', [a - b if a != MISSING and b != MISSING else MISSING
+                                   for a, b in zip(self.values, other.values)])
+        return StatRecord(self.layout, values)
+
+    def to_dict(self):
+        """It converts the record back to nested dicts like CGroup.get_stats."""
+        ret = {}
+        items = self.items()
+        if self.others:
+            items += list(self.others.items())
+        for name, value in items:
+            d = ret
+            for key in name[:-1]:
+                d = d.setdefault(key, {})
+            d[name[-1]] = value
+        return ret
+
+
+class lazy_class_attribute(object):
+    """
+    A decorator to define a class attribute whose value is computed by
+    the decorated function on first access and then memoized. It is used
+    for default tables that require reading /proc or /sys, so importing
+    this module doesn't read them.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        value = self.func()
+        # Replace the descriptor with the value
+        setattr(cls, self.func.__name__, value)
+        return value
+
+
 #
 # The base class of subsystems
 #
@@ -347,6 +650,10 @@ class Subsystem(object):
     def __init__(self):
         self.name = self.NAME
 
+    def get_filename(self, name):
+        """It returns the name of the control file of the name."""
+        return self.name + '.' + name
+
     def get_init_parameters(self, parent_configs):
         return {}
 
@@ -361,14 +668,17 @@ class SubsystemCpu(Subsystem):
     STATS = {
         'stat': SimpleStat,
     }
-    CONFIGS = {
-        'shares':        1024,
-        # Are the default values correct?
-        'rt_period_us':  long(fileops.read(_path_rt_period)),
-        'rt_runtime_us': long(fileops.read(_path_rt_runtime)),
-        'cfs_period_us': 100000,
-        'cfs_quota_us': -1,
-    }
+
+    @lazy_class_attribute
+    def CONFIGS():
+        return {
+            'shares':        1024,
+            # Are the default values correct?
+            'rt_period_us':  long(fileops.read(SubsystemCpu._path_rt_period)),
+            'rt_runtime_us': long(fileops.read(SubsystemCpu._path_rt_runtime)),
+            'cfs_period_us': 100000,
+            'cfs_quota_us': -1,
+        }
 
 
 class SubsystemCpuacct(Subsystem):
@@ -393,21 +703,24 @@ class SubsystemCpuset(Subsystem):
         'effective_mems': str,
         'memory_pressure': long,
     }
-    CONFIGS = {
-        'cpu_exclusive': 0,
-        # same as 'effective_*' ones
-        'cpus': host.CPUInfo().get_online(),
-        'mem_exclusive': 0,
-        'mem_hardwall': 0,
-        'memory_migrate': 0,
-        'memory_pressure_enabled': 0,
-        'memory_spread_page': 0,
-        'memory_spread_slab': 0,
-        # same as 'cpus'
-        'mems': host.MemInfo().get_online(),
-        'sched_load_balance': 1,
-        'sched_relax_domain_level': -1,
-    }
+
+    @lazy_class_attribute
+    def CONFIGS():
+        return {
+            'cpu_exclusive': 0,
+            # same as 'effective_*' ones
+            'cpus': host.CPUInfo().get_online(),
+            'mem_exclusive': 0,
+            'mem_hardwall': 0,
+            'memory_migrate': 0,
+            'memory_pressure_enabled': 0,
+            'memory_spread_page': 0,
+            'memory_spread_slab': 0,
+            # same as 'cpus'
+            'mems': host.MemInfo().get_online(),
+            'sched_load_balance': 1,
+            'sched_relax_domain_level': -1,
+        }
 
     def get_init_parameters(self, parent_configs):
         params = {}
@@ -531,30 +844,38 @@ class SubsystemNetPrio(Subsystem):
     STATS = {
         'prioidx': long,
     }
-    __ifs = os.listdir('/sys/class/net')
-    CONFIGS = {
-        'ifpriomap': SimpleStat(list(zip(__ifs, [0] * len(__ifs)))),
-    }
+
+    @lazy_class_attribute
+    def CONFIGS():
+        ifs = os.listdir('/sys/class/net')
+        return {
+            'ifpriomap': SimpleStat(list(zip(ifs, [0] * len(ifs)))),
+        }
 
 
 class SubsystemHugetlb(Subsystem):
     NAME = 'hugetlb'
     MAX_ULONGLONG = 2 ** 63 - 1
-    # FIXME: this is x86 specific and we have to treat
-    # different size of HugeTLB on other architectures.
-    __stats = {}
-    __configs = {}
-    for __size in ('2MB', '1GB'):
-        __stats.update({
-            __size + '.failcnt': long,
-            __size + '.max_usage_in_bytes': long,
-            __size + '.usage_in_bytes': long,
-        })
-        __configs.update({
-            __size + '.limit_in_bytes': MAX_ULONGLONG,
-        })
-    STATS = __stats
-    CONFIGS = __configs
+    # Page sizes differ between architectures, e.g., 2MB and 1GB on x86
+    # and 64KB, 2MB, 32MB and 1GB on arm64.
+
+    @lazy_class_attribute
+    def STATS():
+        stats = {}
+        for size in host.HugePageInfo().get_sizes():
+            stats.update({
+                size + '.failcnt': long,
+                size + '.max_usage_in_bytes': long,
+                size + '.usage_in_bytes': long,
+            })
+        return stats
+
+    @lazy_class_attribute
+    def CONFIGS():
+        configs = {}
+        for size in host.HugePageInfo().get_sizes():
+            configs[size + '.limit_in_bytes'] = SubsystemHugetlb.MAX_ULONGLONG
+        return configs
 
 
 class SubsystemPids(Subsystem):
@@ -578,6 +899,48 @@ class SubsystemRdma(Subsystem):
     }
 
 
+class SubsystemUnified(Subsystem):
+    """
+    The cgroup2 unified hierarchy. Every controller enabled on a cgroup
+    puts its files in the same directory, so names of the tables are
+    names of the control files themselves, e.g., memory.current.
+    """
+    NAME = 'unified'
+    STATS = {
+        'cgroup.events': SimpleStat,
+        'cgroup.stat': SimpleStat,
+        'cgroup.threads': SimpleList,
+        'cpu.stat': SimpleStat,
+        'memory.current': long,
+        'memory.swap.current': long,
+        'memory.stat': SimpleStat,
+        'memory.events': SimpleStat,
+        'io.stat': IoStat,
+        'pids.current': long,
+        'pids.events': SimpleStat,
+    }
+    CONFIGS = {
+        'cgroup.subtree_control': '',
+        'cgroup.max.depth': 'max',
+        'cgroup.max.descendants': 'max',
+        'cpu.weight': 100,
+        'cpu.max': 'max 100000',
+        # Strings as 'max' is allowed too
+        'memory.min': '0',
+        'memory.low': '0',
+        'memory.high': 'max',
+        'memory.max': 'max',
+        'memory.swap.max': 'max',
+        'pids.max': 'max',
+    }
+    CONTROLS = {
+        'cgroup.kill': None,
+    }
+
+    def get_filename(self, name):
+        return name
+
+
 class SubsystemName(Subsystem):
     NAME = 'name'
 
@@ -599,6 +962,7 @@ _subsystem_name2class = {
     'hugetlb': SubsystemHugetlb,
     'pids': SubsystemPids,
     'rdma': SubsystemRdma,
+    'unified': SubsystemUnified,
 }
 
 
@@ -612,10 +976,183 @@ class NoSuchControlFileError(Exception):
     pass
 
 
+class VanishedCGroupError(IOError):
+    """
+    It is raised when the directory of a cgroup has been removed, e.g.,
+    by an exited container, while reading the cgroup.
+    """
+    pass
+
+
+# errnos of a removed cgroup directory; kernfs returns ENODEV on files
+# kept open across the removal.
+_VANISHED_ERRNOS = (errno.ENOENT, errno.ENODEV)
+
+
+def _is_vanished(err):
+    return getattr(err, 'errno', None) in _VANISHED_ERRNOS
+
+
+def _is_dir_removed(dir_fd, path):
+    """
+    It returns True if the directory of the descriptor is no longer at
+    the path. Files of a removed cgroup fail with ENOENT on kernfs as
+    ones which don't exist in the cgroup do.
+    """
+    try:
+        st = os.stat(path)
+    except EnvironmentError as e:
+        if _is_vanished(e):
+            return True
+        raise
+    fst = os.fstat(dir_fd)
+    return (st.st_dev, st.st_ino) != (fst.st_dev, fst.st_ino)
+
+
 class IsRootGroupError(Exception):
     pass
 
 
+class HierarchySchema(object):
+    """
+    It holds control files which exist in a hierarchy. The files are
+    probed once by listing the root cgroup directory and the first
+    non-root cgroup directory, because some files, e.g., freezer.state,
+    don't appear in the root. CGroups of the hierarchy share the tables
+    instead of checking existence of each file on every read.
+    """
+
+    DEFAULT_RETRY_INTERVAL = 60.0
+
+    def __init__(self, subsystem, mount_point):
+        self.subsystem = subsystem
+        self.mount_point = mount_point
+
+        # Every file name of the subsystem known by us
+        self.all_filenames = {}
+        for file in list(CGroup._STATS.keys()) + list(CGroup._CONFIGS.keys()) + list(CGroup._CONTROLS.keys()):
+            self.all_filenames[file] = file
+        for file in list(subsystem.STATS.keys()) + list(subsystem.CONFIGS.keys()) + list(subsystem.CONTROLS.keys()):
+            self.all_filenames[file] = subsystem.get_filename(file)
+
+        self._files = set()
+        self.child_probed = False
+        self._probe(mount_point)
+
+        # Files which failed with EOPNOTSUPP, e.g., memory.memsw.* if
+        # swap accounting is disabled. They are skipped until
+        # retry_interval seconds pass (never retried if None).
+        self.unsupported = {}
+        self.retry_interval = self.DEFAULT_RETRY_INTERVAL
+
+        # StatLayouts by stats tables, i.e., by filters; see get_layout
+        self._layouts = {}
+
+        # Number of cgroups which vanished while being scanned or read
+        self.vanished = 0
+        self._vanished_lock = threading.Lock()
+
+    def _probe(self, path):
+        self._files.update(os.listdir(path))
+
+        self.filenames = {}
+        for name, filename in self.all_filenames.items():
+            if filename in self._files:
+                self.filenames[name] = filename
+
+        self.configs = {}
+        for configs in (CGroup._CONFIGS, self.subsystem.CONFIGS):
+            for name, default in configs.items():
+                if name in self.filenames:
+                    self.configs[name] = default
+        self.stats = {}
+        for stats in (CGroup._STATS, self.subsystem.STATS):
+            for name, cls in stats.items():
+                if name in self.filenames:
+                    self.stats[name] = cls
+
+        self._filtered = {}
+
+    def probe_child(self, fullpath):
+        """It adds files which appear only in non-root cgroups."""
+        if not self.child_probed:
+            self.child_probed = True
+            try:
+                self._probe(fullpath)
+            except EnvironmentError:
+                # The cgroup may have vanished; probe the next one
+                self.child_probed = False
+                raise
+
+    def mark_vanished(self, fullpath):
+        """It counts a cgroup which has vanished under our feet."""
+        with self._vanished_lock:
+            self.vanished += 1
+
+    def mark_unsupported(self, name, err):
+        self.unsupported[name] = (err, time.time())
+
+    def mark_supported(self, name):
+        self.unsupported.pop(name, None)
+
+    def is_skipped(self, name):
+        """It returns True if the file should not be read this time."""
+        # Another thread may drop the entry meanwhile
+        entry = self.unsupported.get(name)
+        if entry is None:
+            return False
+        if self.retry_interval is None:
+            return True
+        err, since = entry
+        return time.time() - since < self.retry_interval
+
+    def reset_unsupported(self):
+        """It forgets the unsupported files to try them again."""
+        self.unsupported.clear()
+
+    def get_unsupported(self):
+        """It returns a list of file names which are being skipped."""
+        return sorted(self.all_filenames[name] for name in self.unsupported)
+
+    def filter(self, filters):
+        """
+        It returns configs, stats and keys tables reduced by the filters.
+        The result is memoized so that CGroups with the same filters
+        share it. See CGroup.apply_filters for the format of filters.
+        """
+        key = tuple(filters)
+        if key not in self._filtered:
+            configs = {}
+            stats = {}
+            keys = {}
+            for f in filters:
+                if ':' in f:
+                    f, _keys = f.split(':', 1)
+                    keys[f] = frozenset(_keys.split(','))
+                if f not in self.all_filenames:
+                    raise NoSuchControlFileError("%s for %s" % (f, self.subsystem.name))
+                # Files which don't exist on this system are just ignored
+                if f in self.configs:
+                    configs[f] = self.configs[f]
+                elif f in self.stats:
+                    stats[f] = self.stats[f]
+            self._filtered[key] = (configs, stats, keys)
+        return self._filtered[key]
+
+    def get_layout(self, stats):
+        """
+        It returns the StatLayout for records of the stats table.
+        CGroups with the same filters share the table, thus the layout,
+        and records don't have room for fields of other filters.
+        """
+        # The tables live as long as the schema, so their ids are stable
+        layout = self._layouts.get(id(stats))
+        if layout is None:
+            # setdefault keeps one layout even if threads race here
+            layout = self._layouts.setdefault(id(stats), StatLayout())
+        return layout
+
+
 class CGroup:
     """
     This class represents a control group in a cgroup hierarchy.
@@ -652,6 +1189,7 @@ class CGroup:
         SimpleList: SimpleList.parse,
         SimpleStat: SimpleStat.parse,
         BlkioStat: BlkioStat.parse,
+        IoStat: IoStat.parse,
         DevicesStat: DevicesStat.parse,
         NumaStat: NumaStat.parse,
         PercpuStat: PercpuStat.parse,
@@ -660,59 +1198,90 @@ class CGroup:
         PidsEventsStat: PidsEventsStat.parse,
         RdmaStat: RdmaStat.parse,
     }
+    # Parsers which can parse only specified keys
+    _KEYED_PARSERS = {
+        SimpleStat: SimpleStat.parse,
+        BlkioStat: BlkioStat.parse,
+        IoStat: IoStat.parse,
+        NumaStat: NumaStat.parse,
+    }
+
+    # A hierarchy may have 100k cgroups, so instances keep just a few
+    # references; tables are shared in the hierarchy via the schema
+    # and path, fullname and childs are derived or created on demand.
+    __slots__ = ('subsystem', 'fullpath', 'parent', 'filters', 'status',
+                 'depth', 'name', 'schema', 'configs', 'stats', 'keys',
+                 '_childs', '_pids', 'fdcache')
+
+    _NO_KEYS = {}
+    _NO_CHILDS = ()
 
     def _calc_depth(self, path):
-        def rec(path):
-            rest = os.path.split(path)[0]
-            if rest == '/':
-                return 1
-            else:
-                return rec(rest) + 1
-        return rec(path)
+        # path is something like '/a/b' which is at depth 2
+        return path.rstrip('/').count('/')
 
-    def __init__(self, subsystem, fullpath, parent=None, filters=list()):
+    def __init__(self, subsystem, fullpath, parent=None, filters=list(), status=None):
         self.subsystem = subsystem
         self.fullpath = fullpath
         self.parent = parent
         self.filters = filters
 
-        status = SubsystemStatus()
-        mount_point = status.get_path(subsystem.name)
-        path = fullpath.replace(mount_point, '')
-        self.path = '/' if path == '' else path
+        if status is None:
+            status = get_subsystem_status()
+        self.status = status
+        # Tables of existing control files shared in the hierarchy
+        self.schema = status.get_schema(subsystem)
 
-        if self.path == '/':
+        path = self.path
+        if path == '/':
             self.depth = 0
-            self.fullname = self.name = '/'
+            self.name = '/'
         else:
-            self.depth = self._calc_depth(self.path)
-            self.name = os.path.basename(self.path)
-            self.fullname = self.path[1:]
+            self.depth = self._calc_depth(path)
+            self.name = os.path.basename(path)
 
         if self.parent is None and self.depth != 0:
             # XXX: We should do out of the class?
-            self.parent = get_cgroup(os.path.dirname(self.fullpath))
-
-        self.paths = {}
-        for file in list(self._STATS.keys()) + list(self._CONFIGS.keys()) + list(self._CONTROLS.keys()):
-            self.paths[file] = os.path.join(self.fullpath, file)
-        for file in list(subsystem.STATS.keys()) + list(subsystem.CONFIGS.keys()) + list(subsystem.CONTROLS.keys()):
-            self.paths[file] = os.path.join(self.fullpath, subsystem.name + '.' + file)
-
-        self.configs = {}
-        self.configs.update(self._CONFIGS)
-        self.configs.update(subsystem.CONFIGS)
-        self.stats = {}
-        self.stats.update(self._STATS)
-        self.stats.update(subsystem.STATS)
+            self.parent = status.get_registry().get(os.path.dirname(self.fullpath))
+
+        if self.depth != 0:
+            self.schema.probe_child(self.fullpath)
+        self.configs = self.schema.configs
+        self.stats = self.schema.stats
+        # Keys of stat files to be parsed; see apply_filters
+        self.keys = self._NO_KEYS
         if self.filters:
             self.apply_filters(filters)
 
-        self.childs = []
-        self.pids = []
-        self.n_procs = 0
+        # Most cgroups are leaves; a list is created when childs are found
+        self._childs = None
+        # pids are read on demand; see update()
+        self._pids = None
+        # Set a fileops.FileCache to keep control files open
+        self.fdcache = None
+
+    @property
+    def path(self):
+        """The path of the cgroup from the mount point, e.g., '/a/b'"""
+        path = self.fullpath[len(self.schema.mount_point):]
+        return '/' if path == '' else path
+
+    @property
+    def fullname(self):
+        """The path without the leading '/', e.g., 'a/b', or '/' for the root"""
+        if self.depth == 0:
+            return '/'
+        return self.fullpath[len(self.schema.mount_point) + 1:]
+
+    @property
+    def childs(self):
+        if self._childs is None:
+            return self._NO_CHILDS
+        return self._childs
 
-        self.update()
+    @childs.setter
+    def childs(self, childs):
+        self._childs = childs
 
     def __str__(self):
         return "<CGroup: %s (%s)>" % (self.fullname, self.subsystem.name)
@@ -723,43 +1292,111 @@ class CGroup:
     def __eq__(self, obj):
         return self.fullname == obj.fullname and self.subsystem.name == obj.subsystem.name
 
+    @property
+    def paths(self):
+        """Full paths of the control files of the cgroup"""
+        return dict((name, os.path.join(self.fullpath, filename))
+                    for name, filename in self.schema.all_filenames.items())
+
     def apply_filters(self, filters):
         """
         It applies a specified filters. The filters are used to reduce the control groups
         which are accessed by get_confgs, get_stats, and get_defaults methods.
+        Filtered files which don't exist on the system are silently ignored.
+
+        A filter can limit keys of a stat file in the form of 'file:key1,key2',
+        e.g., 'stat:rss,cache'. Parsers of SimpleStat, BlkioStat and NumaStat
+        files then parse only the keys.
         """
-        _configs = self.configs
-        _stats = self.stats
-        self.configs = {}
-        self.stats = {}
-        for f in filters:
-            if f in _configs:
-                self.configs[f] = _configs[f]
-            elif f in _stats:
-                self.stats[f] = _stats[f]
-            else:
-                raise NoSuchControlFileError("%s for %s" % (f, self.subsystem.name))
+        self.configs, self.stats, self.keys = self.schema.filter(filters)
+
+    def read_many(self, names, ignore_errors=()):
+        """
+        It reads control files of the names in one pass and returns
+        a name and a raw content pairs. The files are opened relative to
+        a descriptor of the cgroup directory, so the kernel doesn't walk
+        the whole path from / for each file. Files which don't exist or
+        fail with an errno in ignore_errors are omitted from the result.
+        A file which failed with EOPNOTSUPP is remembered in the schema
+        of the hierarchy and skipped for a while by all cgroups of the
+        hierarchy. Other errors, e.g., EIO, depend on each cgroup.
+        """
+        contents = {}
+        schema = self.schema
+        filenames = schema.filenames
+        # The directory descriptor is held only during the batch to not
+        # consume a descriptor per cgroup on large hierarchies.
+        dir_fd = None
+        # Checked on the first ENOENT of the batch
+        dir_removed = None
+        try:
+            for name in names:
+                filename = filenames.get(name)
+                if filename is None:
+                    # It doesn't exist in the hierarchy
+                    continue
+                if schema.unsupported and schema.is_skipped(name):
+                    continue
+                try:
+                    if self.fdcache is not None:
+                        path = self.fullpath + '/' + filename
+                        if path in self.fdcache:
+                            contents[name] = self.fdcache.read(path)
+                            continue
+                    if dir_fd is None:
+                        try:
+                            dir_fd = fileops.open_dir(self.fullpath)
+                        except EnvironmentError as e:
+                            if _is_vanished(e):
+                                self._raise_vanished(e)
+                            raise
+                    if self.fdcache is not None:
+                        contents[name] = self.fdcache.read(path, dir_fd, filename)
+                    else:
+                        contents[name] = fileops.read_at(dir_fd, filename)
+                except IOError as e:
+                    if isinstance(e, VanishedCGroupError):
+                        raise
+                    if e.errno == errno.ENOENT and dir_fd is not None:
+                        if dir_removed is None:
+                            dir_removed = _is_dir_removed(dir_fd, self.fullpath)
+                        if dir_removed:
+                            self._raise_vanished(e)
+                        # The file doesn't exist in this cgroup, e.g.,
+                        # release_agent which exists only in the root
+                        continue
+                    if e.errno == errno.ENODEV:
+                        # A kept open file of a removed cgroup
+                        self._raise_vanished(e)
+                    if e.errno in ignore_errors:
+                        if e.errno == errno.EOPNOTSUPP:
+                            schema.mark_unsupported(name, e.errno)
+                        continue
+                    raise
+                if schema.unsupported:
+                    schema.mark_supported(name)
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+        return contents
+
+    def _raise_vanished(self, err):
+        self.schema.mark_vanished(self.fullpath)
+        raise VanishedCGroupError(err.errno, err.strerror, self.fullpath)
 
     def get_configs(self):
         """
         It returns a name and a current value pairs of control files
         which are categorised in the configs group.
         """
+        # Since 3.5 memory.memsw.* are always created even if disabled.
+        # If disabled we will get EOPNOTSUPP when read or write them.
+        # See commit af36f906c0f4c2ffa0482ecdf856a33dc88ae8c5 of the kernel.
+        contents = self.read_many(self.configs.keys(), (errno.EOPNOTSUPP,))
         configs = {}
-        for name, default in self.configs.items():
-            cls = default.__class__
-            path = self.paths[name]
-            if os.path.exists(path):
-                try:
-                    configs[name] = self._PARSERS[cls](fileops.read(path))
-                except IOError as e:
-                    if e.errno == errno.EOPNOTSUPP:
-                        # Since 3.5 memory.memsw.* are always created even if disabled.
-                        # If disabled we will get EOPNOTSUPP when read or write them.
-                        # See commit af36f906c0f4c2ffa0482ecdf856a33dc88ae8c5 of the kernel.
-                        pass
-                    else:
-                        raise
+        for name, content in contents.items():
+            cls = self.configs[name].__class__
+            configs[name] = self._PARSERS[cls](content)
         return configs
 
     def get_default_configs(self):
@@ -774,40 +1411,78 @@ class CGroup:
         It returns a name and a value pairs of control files
         which are categorised in the stats group.
         """
+        # XXX: we have to distinguish unexpected errors from the expected ones
+        # EOPNOTSUPP: memory.memsw.* when disabled (see get_configs)
+        # EIO: memory.kmem.slabinfo throws EIO until limit_in_bytes is set.
+        contents = self.read_many(self.stats.keys(), (errno.EOPNOTSUPP, errno.EIO))
         stats = {}
-        for name, cls in self.stats.items():
-            path = self.paths[name]
-            if os.path.exists(path):
-                try:
-                    stats[name] = self._PARSERS[cls](fileops.read(path))
-                except IOError as e:
-                    # XXX: we have to distinguish unexpected errors from the expected ones
-                    if e.errno == errno.EOPNOTSUPP:
-                        # Since 3.5 memory.memsw.* are always created even if disabled.
-                        # If disabled we will get EOPNOTSUPP when read or write them.
-                        # See commit af36f906c0f4c2ffa0482ecdf856a33dc88ae8c5 of the kernel.
-                        pass
-                    if e.errno == errno.EIO:
-                        # memory.kmem.slabinfo throws EIO until limit_in_bytes is set.
-                        pass
-                    else:
-                        raise
+        for name, content in contents.items():
+            cls = self.stats[name]
+            if name in self.keys and cls in self._KEYED_PARSERS:
+                stats[name] = self._KEYED_PARSERS[cls](content, self.keys[name])
+            else:
+                stats[name] = self._PARSERS[cls](content)
         return stats
 
+    def get_stat_record(self):
+        """
+        It returns the stats as a StatRecord whose layout is shared
+        in the hierarchy. See get_stats.
+        """
+        return self.schema.get_layout(self.stats).make_record(self.get_stats())
+
     def update(self):
-        """It updates process information of the cgroup."""
-        pids = fileops.readlines(self.paths['cgroup.procs'])
-        self.pids = [int(pid) for pid in pids if pid != '']
-        self.n_procs = len(pids)
+        """
+        It updates process information of the cgroup. Until the first
+        call, the information is read on the first access to pids or
+        n_procs.
+        """
+        path = os.path.join(self.fullpath, 'cgroup.procs')
+        try:
+            if self.fdcache is not None:
+                content = self.fdcache.read(path)
+            else:
+                content = fileops.read(path)
+        except EnvironmentError as e:
+            # Every cgroup has cgroup.procs
+            if _is_vanished(e):
+                self._raise_vanished(e)
+            raise
+        self._pids = array.array('i', [int(pid) for pid in content.split()])
+
+    @property
+    def pids(self):
+        """PIDs in the cgroup as an array('i')"""
+        if self._pids is None:
+            self.update()
+        return self._pids
+
+    @property
+    def n_procs(self):
+        return len(self.pids)
+
+    def is_empty(self, populated=None):
+        """
+        It returns True if the cgroup has no process. If a PopulatedIndex
+        is given and tells that the cgroup is not populated, pids are
+        not read at all.
+        """
+        if populated is not None and populated.is_populated(self) is False:
+            return True
+        return self.n_procs == 0
 
     def set_config(self, name, value):
-        path = os.path.join(self.fullpath, self.subsystem.name + '.' + name)
+        # Files common to all subsystems, e.g., release_agent, have no prefix
+        filename = self.schema.all_filenames.get(name)
+        if filename is None:
+            filename = self.subsystem.get_filename(name)
+        path = os.path.join(self.fullpath, filename)
         fileops.write(path, str(value))
 
     def mkdir(self, name, set_initparams=True):
         new_path = os.path.join(self.fullpath, name)
         fileops.mkdir(new_path)
-        new = get_cgroup(new_path)
+        new = get_cgroup(new_path, self.status)
         if set_initparams:
             params = self.subsystem.get_init_parameters(self.get_configs())
             for filename, value in params.items():
@@ -829,12 +1504,18 @@ class CGroup:
         for pid in self.pids:
             target.attach(pid)
         fileops.rmdir(self.fullpath)
+        self.status.get_registry().forget(self.fullpath)
 
     def attach(self, pid):
         if not process.exists(pid):
             raise EnvironmentError("Process %d not exists" % pid)
 
-        fileops.write(self.paths['tasks'], str(pid))
+        # cgroup2 has no tasks file
+        if 'tasks' in self.schema.filenames:
+            filename = 'tasks'
+        else:
+            filename = 'cgroup.procs'
+        fileops.write(os.path.join(self.fullpath, filename), str(pid))
 
 
 class EventListener:
@@ -897,18 +1578,509 @@ class EventListener:
         return struct.unpack('Q', ret)
 
 
-def _scan_cgroups_recursive(subsystem, fullpath, mount_point, filters):
-    cgroup = CGroup(subsystem, fullpath=fullpath, filters=filters)
+class ReleaseListener(object):
+    """
+    It receives release notifications of cgroup v1 hierarchies whose
+    release_agent is cgutil-release-agent; see set_release_agent.
+
+    The kernel runs the agent with the path of a cgroup from the mount
+    point, e.g., '/a/b', when the cgroup becomes empty, i.e., it has no
+    task and no child, if notify_on_release of the cgroup is enabled.
+    It is when cgroups are usually removed by their owners. The agent
+    sends the path to every listener through a unix datagram socket in
+    SOCKET_DIR. Note that the agent cannot tell which hierarchy the
+    cgroup belongs to.
+    """
+    AGENT = 'cgutil-release-agent'
+    SOCKET_DIR = '/run/cgutils/release'
+    SUFFIX = '.sock'
+    # The kernel limits a path of a cgroup to PATH_MAX
+    _BUFSIZE = 4096
+
+    def __init__(self, socket_dir=SOCKET_DIR):
+        import socket
+
+        if not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir, 0o700)
+        self.path = os.path.join(socket_dir, '%d%s' % (os.getpid(), self.SUFFIX))
+        if os.path.exists(self.path):
+            # Left by a dead process of the same pid
+            os.unlink(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read_events(self):
+        """It returns a list of paths of released cgroups. It doesn't block."""
+        paths = []
+        while True:
+            try:
+                data = self.sock.recv(self._BUFSIZE)
+            except EnvironmentError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return paths
+                raise
+            paths.append(data.decode())
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def notify_release(path, socket_dir=ReleaseListener.SOCKET_DIR):
+    """
+    It sends the path of a released cgroup to all ReleaseListeners.
+    Sockets of dead listeners are removed.
+    """
+    import socket
+
+    try:
+        names = os.listdir(socket_dir)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            # Nobody listens
+            return
+        raise
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    try:
+        for name in names:
+            if not name.endswith(ReleaseListener.SUFFIX):
+                continue
+            sock_path = os.path.join(socket_dir, name)
+            try:
+                sock.sendto(path.encode(), sock_path)
+            except EnvironmentError as e:
+                if e.errno == errno.ECONNREFUSED:
+                    try:
+                        os.unlink(sock_path)
+                    except OSError:
+                        pass
+                # Drop the notification if the listener is too busy
+    finally:
+        sock.close()
+
 
-    _childs = []
-    for _file in os.listdir(fullpath):
-        child_fullpath = os.path.join(fullpath, _file)
-        if os.path.isdir(child_fullpath):
-            child = _scan_cgroups_recursive(subsystem, child_fullpath,
-                                            mount_point, filters)
-            _childs.append(child)
-    cgroup.childs.extend(_childs)
-    return cgroup
+class PopulatedIndex(object):
+    """
+    It tells whether cgroups of the cgroup2 hierarchy have processes
+    from the populated flag of cgroup.events, which is much cheaper than
+    reading cgroup.procs of a group with thousands of threads. The flag
+    counts descendants too, so only an unpopulated group is known to be
+    empty; a populated one still has to be checked by reading its pids.
+
+    If watch is True, up to max_watches cgroup.events are kept open and
+    polled for POLLPRI, which the kernel raises when the flag changes,
+    and update() reads only the changed ones again. Otherwise the file
+    is read on every query.
+    """
+    DEFAULT_MAX_WATCHES = 1024
+
+    def __init__(self, watch=False, max_watches=DEFAULT_MAX_WATCHES):
+        self.watch = watch
+        self.max_watches = max_watches
+        # fullpath -> populated of watched cgroups
+        self._states = {}
+        # fullpath -> fd and fd -> fullpath of watched cgroups
+        self._fds = {}
+        self._paths = {}
+        self._poll = select.poll()
+        # Cgroups may be queried from threads; see map_cgroups
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._fds)
+
+    def _read(self, fd):
+        content = os.pread(fd, 4096, 0).decode()
+        return SimpleStat.parse(content, frozenset(['populated'])).get('populated') == 1
+
+    def is_populated(self, cgroup):
+        """
+        It returns True or False, or None if the hierarchy of the cgroup
+        has no cgroup.events, e.g., cgroup v1.
+        """
+        if 'cgroup.events' not in cgroup.schema.filenames:
+            return None
+        fullpath = cgroup.fullpath
+        with self._lock:
+            populated = self._states.get(fullpath)
+        if populated is not None:
+            return populated
+
+        try:
+            fd = os.open(os.path.join(fullpath, 'cgroup.events'), os.O_RDONLY | os.O_CLOEXEC)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        try:
+            populated = self._read(fd)
+        except Exception:
+            os.close(fd)
+            raise
+        with self._lock:
+            if not self.watch or len(self._fds) >= self.max_watches or fullpath in self._fds:
+                os.close(fd)
+                return populated
+
+            self._fds[fullpath] = fd
+            self._paths[fd] = fullpath
+            self._states[fullpath] = populated
+            self._poll.register(fd, select.POLLPRI | select.POLLERR)
+        return populated
+
+    def update(self):
+        """It applies changes notified since the last call."""
+        if not self._fds:
+            return
+        with self._lock:
+            for fd, event in self._poll.poll(0):
+                fullpath = self._paths.get(fd)
+                if fullpath is None:
+                    continue
+                try:
+                    self._states[fullpath] = self._read(fd)
+                except EnvironmentError:
+                    # The cgroup has been removed
+                    self._discard(fullpath)
+
+    def _discard(self, fullpath):
+        # Called with the lock held
+        self._states.pop(fullpath, None)
+        fd = self._fds.pop(fullpath, None)
+        if fd is not None:
+            del self._paths[fd]
+            self._poll.unregister(fd)
+            os.close(fd)
+
+    def discard(self, fullpath):
+        """It stops watching the cgroup of the fullpath."""
+        with self._lock:
+            self._discard(fullpath)
+
+    def prune(self, fullpaths):
+        """It stops watching cgroups which are not in the fullpaths."""
+        with self._lock:
+            for fullpath in list(self._fds.keys()):
+                if fullpath not in fullpaths:
+                    self._discard(fullpath)
+
+    def close(self):
+        with self._lock:
+            for fullpath in list(self._fds.keys()):
+                self._discard(fullpath)
+
+
+class HierarchyWatcher(object):
+    """
+    It watches directories of cgroup hierarchies with inotify and tells
+    which cgroups have been created or removed since the last call of
+    read_events(), so a scanned hierarchy can be kept up to date without
+    scanning it again. The kernel queues events up to
+    /proc/sys/fs/inotify/max_queued_events; if the queue overflows,
+    events are lost and read_events() returns an OVERFLOW event, then
+    the caller has to scan the hierarchy again.
+
+    Each directory needs a watch, which is limited by
+    /proc/sys/fs/inotify/max_user_watches; watch() raises an OSError
+    of ENOSPC if it runs out.
+    """
+    CREATED = 'created'
+    REMOVED = 'removed'
+    OVERFLOW = 'overflow'
+
+    # struct inotify_event without the trailing name
+    _EVENT = struct.Struct('iIII')
+    _BUFSIZE = 64 * 1024
+
+    def __init__(self):
+        # ImportError if the extension isn't built
+        from cgutils import linux
+
+        self._linux = linux
+        self._mask = (linux.IN_CREATE | linux.IN_DELETE | linux.IN_MOVED_FROM |
+                      linux.IN_MOVED_TO | linux.IN_ONLYDIR)
+        self.fd = linux.inotify_init1(linux.IN_NONBLOCK | linux.IN_CLOEXEC)
+        # wd -> fullpath and fullpath -> wd of watched directories
+        self._paths = {}
+        self._wds = {}
+        # Directories may be watched from threads; see scan_cgroups
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._wds)
+
+    def fileno(self):
+        return self.fd
+
+    def watch(self, fullpath):
+        """It starts watching the cgroup directory of the fullpath."""
+        with self._lock:
+            if self.fd is None:
+                return
+            wd = self._linux.inotify_add_watch(self.fd, fullpath, self._mask)
+            self._paths[wd] = fullpath
+            self._wds[fullpath] = wd
+
+    def unwatch(self, fullpath):
+        """It stops watching the fullpath and its descendants."""
+        prefix = fullpath + '/'
+        with self._lock:
+            for path in list(self._wds.keys()):
+                if path != fullpath and not path.startswith(prefix):
+                    continue
+                wd = self._wds.pop(path)
+                self._paths.pop(wd, None)
+                try:
+                    self._linux.inotify_rm_watch(self.fd, wd)
+                except OSError as e:
+                    # The kernel has already dropped the watch
+                    if e.errno != errno.EINVAL:
+                        raise
+
+    def _read(self):
+        try:
+            return os.read(self.fd, self._BUFSIZE)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return b''
+            raise
+
+    def read_events(self):
+        """
+        It returns a list of pairs of an event, CREATED, REMOVED or
+        OVERFLOW, and the fullpath of the cgroup (None for OVERFLOW)
+        in order of occurrence. It doesn't block. A moved directory
+        is reported as removed and created.
+        """
+        linux = self._linux
+        events = []
+        if self.fd is None:
+            return events
+        while True:
+            buf = self._read()
+            if not buf:
+                return events
+            offset = 0
+            while offset < len(buf):
+                wd, mask, cookie, length = self._EVENT.unpack_from(buf, offset)
+                offset += self._EVENT.size
+                name = buf[offset:offset + length].rstrip(b'\0').decode()
+                offset += length
+
+                if mask & linux.IN_Q_OVERFLOW:
+                    events.append((self.OVERFLOW, None))
+                    continue
+                with self._lock:
+                    parent = self._paths.get(wd)
+                    if mask & linux.IN_IGNORED:
+                        # Removed directory, whose watch the kernel has dropped
+                        if parent is not None:
+                            del self._paths[wd]
+                            if self._wds.get(parent) == wd:
+                                del self._wds[parent]
+                        continue
+                if parent is None or not mask & linux.IN_ISDIR:
+                    continue
+                fullpath = os.path.join(parent, name)
+                if mask & (linux.IN_CREATE | linux.IN_MOVED_TO):
+                    events.append((self.CREATED, fullpath))
+                elif mask & (linux.IN_DELETE | linux.IN_MOVED_FROM):
+                    events.append((self.REMOVED, fullpath))
+
+    def close(self):
+        with self._lock:
+            if self.fd is None:
+                return
+            os.close(self.fd)
+            self.fd = None
+            self._paths.clear()
+            self._wds.clear()
+
+
+def _drop_vanished(cgroup):
+    """It removes a vanished cgroup from its parent and counts it."""
+    cgroup.schema.mark_vanished(cgroup.fullpath)
+    parent = cgroup.parent
+    if parent is not None and parent._childs:
+        try:
+            parent._childs.remove(cgroup)
+        except ValueError:
+            pass
+
+
+def _scan_childs(cgroup, filters, visit=None):
+    """
+    It creates CGroups of the child directories of the cgroup.
+    os.scandir gives us d_type of each entry, so the control files
+    are skipped without a stat syscall.
+
+    A cgroup can be removed at any time, e.g., by an exited container.
+    If the directory of the cgroup has vanished, the cgroup is dropped
+    from its parent and None is returned. Vanished childs are skipped.
+    """
+    childs = []
+    try:
+        if visit is not None:
+            visit(cgroup)
+        for entry in os.scandir(cgroup.fullpath):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            try:
+                childs.append(CGroup(cgroup.subsystem, fullpath=entry.path, parent=cgroup,
+                                     filters=filters, status=cgroup.status))
+            except EnvironmentError as e:
+                if not _is_vanished(e):
+                    raise
+                cgroup.schema.mark_vanished(entry.path)
+    except EnvironmentError as e:
+        if not _is_vanished(e):
+            raise
+        _drop_vanished(cgroup)
+        return None
+    if childs:
+        if cgroup._childs is None:
+            cgroup._childs = childs
+        else:
+            cgroup._childs.extend(childs)
+    return childs
+
+
+def _iter_scan(root, filters, visit=None):
+    """
+    It scans the hierarchy under the root cgroup with an explicit stack
+    instead of recursion and yields cgroups in pre-order. Each cgroup
+    is yielded after its childs have been collected.
+    """
+    stack = [root]
+    while stack:
+        cgroup = stack.pop()
+        childs = _scan_childs(cgroup, filters, visit)
+        if childs is None:
+            # Vanished with its subtree
+            continue
+        yield cgroup
+        stack.extend(reversed(childs))
+
+
+def _drain(iterator):
+    for _ in iterator:
+        pass
+
+
+def _scan_parallel(root, filters, workers, visit=None):
+    """
+    It scans the hierarchy under the root cgroup on a thread pool.
+    The top of the hierarchy is expanded until there are enough
+    subtrees to keep the workers busy, then each subtree is scanned
+    by a worker. Every cgroup keeps its childs in directory order,
+    so the result is the same as a sequential scan.
+    """
+    frontier = [root]
+    while frontier and len(frontier) < workers * 4:
+        next_frontier = []
+        for cgroup in frontier:
+            next_frontier.extend(_scan_childs(cgroup, filters, visit) or [])
+        frontier = next_frontier
+
+    # Imported here to keep importing this module fast
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        _drain(executor.map(lambda cg: _drain(_iter_scan(cg, filters, visit)), frontier))
+
+
+class CGroupRegistry(object):
+    """
+    It resolves a path to the CGroup pointed by the path. Mount points
+    are kept in a trie of path components, so finding the hierarchy
+    of a path costs its depth and overlapping mount paths, e.g.,
+    /cgroup/cpu and /cgroup/cpuacct, are told apart. Resolved CGroups
+    are memoized and a path shares its ancestors with others. At most
+    max_cgroups of them are kept; the least recently resolved one is
+    dropped first. The registry belongs to a SubsystemStatus and is
+    discarded with it.
+    """
+    # A key of trie nodes which cannot be a path component
+    _MOUNT = None
+
+    DEFAULT_MAX_CGROUPS = 1024
+
+    def __init__(self, status, max_cgroups=DEFAULT_MAX_CGROUPS):
+        self.status = status
+        self.max_cgroups = max_cgroups
+        self._trie = {}
+        self._cgroups = collections.OrderedDict()
+        for name, path in status.paths.items():
+            node = self._trie
+            for component in self._split(path):
+                node = node.setdefault(component, {})
+            # Subsystems mounted together share a node; take the first
+            node.setdefault(self._MOUNT, (name, path))
+
+    def _split(self, path):
+        return [c for c in path.split('/') if c != '']
+
+    def lookup(self, fullpath):
+        """
+        It returns a tuple of the subsystem name and the mount point
+        of the hierarchy which the fullpath belongs to.
+        """
+        node = self._trie
+        found = node.get(self._MOUNT)
+        for component in self._split(fullpath):
+            node = node.get(component)
+            if node is None:
+                break
+            found = node.get(self._MOUNT, found)
+        if found is None:
+            raise Exception('Invalid path: ' + fullpath)
+        return found
+
+    def get(self, fullpath):
+        """
+        It returns the CGroup pointed by the fullpath. The fullpath
+        must be canonicalized. Processes of a memoized CGroup are read
+        again on the next access to its pids.
+        """
+        cgroup = self._cgroups.get(fullpath)
+        if cgroup is not None:
+            self._cgroups.move_to_end(fullpath)
+            cgroup._pids = None
+            return cgroup
+
+        name, mount_point = self.lookup(fullpath)
+        # Find the nearest resolved ancestor, then create the rest downward
+        missing = [fullpath]
+        parent = None
+        while fullpath != mount_point:
+            fullpath = os.path.dirname(fullpath)
+            parent = self._cgroups.get(fullpath)
+            if parent is not None:
+                break
+            missing.append(fullpath)
+
+        subsystem = _get_subsystem(name)
+        for path in reversed(missing):
+            parent = CGroup(subsystem, path, parent=parent, status=self.status)
+            self._cgroups[path] = parent
+        while len(self._cgroups) > self.max_cgroups:
+            self._cgroups.popitem(last=False)
+        return parent
+
+    def forget(self, fullpath):
+        """It drops the CGroups of the fullpath and its descendants."""
+        prefix = fullpath + '/'
+        for path in list(self._cgroups.keys()):
+            if path == fullpath or path.startswith(prefix):
+                del self._cgroups[path]
 
 
 #
@@ -918,13 +2090,9 @@ class NoSuchSubsystemError(Exception):
     pass
 
 
-def scan_cgroups(subsys_name, filters=list()):
-    """
-    It returns a control group hierarchy which belong to the subsys_name.
-    When collecting cgroups, filters are applied to the cgroups. See pydoc
-    of apply_filters method of CGroup for more information about the filters.
-    """
-    status = SubsystemStatus()
+def _get_root_cgroup(subsys_name, filters, status):
+    if status is None:
+        status = get_subsystem_status()
     if subsys_name not in status.get_all():
         raise NoSuchSubsystemError("No such subsystem found: " + subsys_name)
 
@@ -936,7 +2104,82 @@ def scan_cgroups(subsys_name, filters=list()):
 
     subsystem = _get_subsystem(subsys_name)
     mount_point = status.get_path(subsys_name)
-    return _scan_cgroups_recursive(subsystem, mount_point, mount_point, filters)
+    return CGroup(subsystem, mount_point, filters=filters, status=status)
+
+
+def scan_cgroups(subsys_name, filters=list(), status=None, workers=None, visit=None):
+    """
+    It returns a control group hierarchy which belong to the subsys_name.
+    When collecting cgroups, filters are applied to the cgroups. See pydoc
+    of apply_filters method of CGroup for more information about the filters.
+    The shared SubsystemStatus is used unless status is given. If workers
+    is more than 1, subtrees are scanned in parallel by the threads.
+    If visit is given, it is called with each cgroup just before its
+    directory is read, e.g., to start watching the directory, possibly
+    from the threads. Subtrees which vanish during the scan are dropped
+    and counted in the vanished of the schema of the hierarchy.
+    """
+    root = _get_root_cgroup(subsys_name, filters, status)
+    if workers and workers > 1:
+        _scan_parallel(root, filters, workers, visit)
+    else:
+        _drain(_iter_scan(root, filters, visit))
+    return root
+
+
+def scan_subtree(parent, fullpath, filters=list(), visit=None):
+    """
+    It scans a directory which has appeared under the parent cgroup
+    after the hierarchy was scanned, and adds the new CGroup to childs
+    of the parent. It returns the new CGroup with its descendants, or
+    None if the directory has already vanished.
+    """
+    try:
+        cgroup = CGroup(parent.subsystem, fullpath, parent=parent,
+                        filters=filters, status=parent.status)
+    except EnvironmentError as e:
+        if not _is_vanished(e):
+            raise
+        parent.schema.mark_vanished(fullpath)
+        return None
+    childs = _scan_childs(cgroup, filters, visit)
+    if childs is None:
+        return None
+    for child in list(childs):
+        _drain(_iter_scan(child, filters, visit))
+    parent.childs = list(parent.childs) + [cgroup]
+    return cgroup
+
+
+def iter_cgroups(subsys_name, filters=list(), status=None):
+    """
+    It is an iterator version of scan_cgroups. It yields control groups
+    of the subsys_name hierarchy in the same order as walk_cgroups while
+    scanning the hierarchy. A yielded cgroup already has its childs.
+    """
+    root = _get_root_cgroup(subsys_name, filters, status)
+    return _iter_scan(root, filters)
+
+
+def set_release_agent(subsys_name, agent, status=None, recursive=False):
+    """
+    It sets the release_agent of the hierarchy of the subsys_name and
+    enables notify_on_release of the root cgroup, which new cgroups
+    inherit. If recursive is True, it is enabled in existing cgroups
+    as well.
+    """
+    if status is None:
+        status = get_subsystem_status()
+    root = _get_root_cgroup(subsys_name, list(), status)
+    root.set_config('release_agent', agent)
+    if recursive:
+        cgroups = iter_cgroups(subsys_name, status=status)
+    else:
+        cgroups = [root]
+    for cgroup in cgroups:
+        cgroup.set_config('notify_on_release', 1)
+    # Let status know the new release_agent
+    status.update()
 
 
 def walk_cgroups(cgroup, action, opaque):
@@ -944,25 +2187,75 @@ def walk_cgroups(cgroup, action, opaque):
     The function applies the action function with the opaque object
     to each control group under the cgroup recursively.
     """
-    action(cgroup, opaque)
-    for child in cgroup.childs:
-        walk_cgroups(child, action, opaque)
+    stack = [cgroup]
+    while stack:
+        cgroup = stack.pop()
+        action(cgroup, opaque)
+        stack.extend(reversed(cgroup.childs))
 
 
-def get_cgroup(fullpath):
+def map_cgroups(func, cgroups, workers=None):
+    """
+    It applies the func to each of the cgroups and returns a list of
+    the results in the same order as the cgroups. If workers is more
+    than 1, the func is called on a pool of the threads.
+    """
+    if not workers or workers <= 1:
+        return [func(cgroup) for cgroup in cgroups]
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(func, cgroups))
+
+
+class Budget(object):
+    """
+    It bounds the work of a collection by the number of cgroups read
+    and the seconds elapsed since it was made; None means no limit.
+    Callers take reads from it before reading cgroups and leave the
+    rest for the next collection once it runs out. A take larger than
+    max_reads is allowed as the first one, so that it doesn't wait
+    forever. It is thread-safe.
+    """
+    def __init__(self, max_reads=None, max_seconds=None):
+        self.max_reads = max_reads
+        self.max_seconds = max_seconds
+        self.start = time.time()
+        self.reads = 0
+        self.exhausted = False
+        self._lock = threading.Lock()
+
+    def is_limited(self):
+        return self.max_reads is not None or self.max_seconds is not None
+
+    def take(self, n=1):
+        """It returns True and counts n reads if they are within the budget."""
+        if self.exhausted:
+            return False
+        with self._lock:
+            if self.max_seconds is not None and time.time() - self.start >= self.max_seconds:
+                self.exhausted = True
+                return False
+            if self.max_reads is not None:
+                if self.reads >= self.max_reads:
+                    self.exhausted = True
+                    return False
+                if self.reads + n > self.max_reads and self.reads > 0:
+                    # Smaller ones may fit in the rest
+                    return False
+            self.reads += n
+            return True
+
+
+def get_cgroup(fullpath, status=None):
     """
     It returns a CGroup object which is pointed by the fullpath.
+    The object and its ancestors are shared by later calls with
+    the same status until the hierarchy is updated, but its pids are
+    read again. See CGroupRegistry.
     """
     # Canonicalize symbolic links
     fullpath = os.path.realpath(fullpath)
 
-    status = SubsystemStatus()
-    name = None
-    for name, path in status.paths.items():
-        if path in fullpath:
-            break
-    else:
-        raise Exception('Invalid path: ' + fullpath)
-    subsys = _get_subsystem(name)
-
-    return CGroup(subsys, fullpath)
+    if status is None:
+        status = get_subsystem_status()
+    return status.get_registry().get(fullpath)
@@ -30,9 +30,34 @@ class Command():
     def __init__(self):
         self.args = self.parser.parse_args()
 
-    @staticmethod
-    def add_subparser(subparsers):
-        raise NotImplementedError
-
     def run(self):
         raise NotImplementedError
+
+
+class CommandSpec(object):
+    """
+    It declares a subcommand, i.e., its name, help and arguments,
+    without importing its implementation. The implementation module
+    cgutils.commands.<name> is imported only by load().
+    """
+    def __init__(self, name, help, arguments=()):
+        self.name = name
+        self.help = help
+        self.arguments = arguments
+
+    def add_subparser(self, subparsers):
+        parser = subparsers.add_parser(self.name, help=self.help)
+        for args, kwargs in self.arguments:
+            parser.add_argument(*args, **kwargs)
+        return parser
+
+    def load(self):
+        mod = __import__('cgutils.commands' + '.' + self.name, fromlist=[self.name, ])
+        return mod.Command
+
+
+def arg(*args, **kwargs):
+    """
+    It packs arguments of ArgumentParser.add_argument for CommandSpec.
+    """
+    return (args, kwargs)
@@ -1,3 +1,24 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# See the COPYING file for license information.
+#
+# Copyright (c) 2012,2013 peo3 <peo314159265@gmail.com>
+
+from cgutils.command import CommandSpec, arg
+from cgutils.fileops import DEFAULT_MAX_FDS
+
 __all__ = [
     'configs',
     'event',
@@ -8,3 +29,129 @@ __all__ = [
     'top',
     'tree',
 ]
+
+DEFAULT_SUBSYSTEM = 'cpu'
+
+# Subcommands are declared here rather than in their modules so that
+# bin/cgutil can build the parser without importing all of them.
+SPECS = dict((spec.name, spec) for spec in [
+    CommandSpec('configs', 'Show values of configurable cgroup files', [
+        arg('-o', dest='target_subsystem', default=DEFAULT_SUBSYSTEM,
+            help='Specify a subsystem [%(default)s]'),
+        arg('-d', '--show-default', action='store_true',
+            help='Show every parameters including default values'),
+        arg('-r', '--show-rate', action='store_true',
+            help='Show rate value to default/current values'),
+        arg('-e', '--hide-empty', action='store_true',
+            help='Hide empty groups'),
+        arg('-j', '--json', action='store_true',
+            help='Dump as JSON'),
+        arg('--jobs', type=int, default=1, metavar='N',
+            help='Number of threads to scan cgroups and read files [%(default)s]'),
+    ]),
+    CommandSpec('event', 'Wait for an event', [
+        arg('-t', '--timeout', type=float, dest='timeout_seconds',
+            help='Timeout in SEC [%(default)s seconds]',
+            metavar='SEC', default=0.0),
+        arg('target_file', metavar='TARGET_FILE',
+            help='Target cgroup file to wait for an event'),
+        arg('threshold', nargs='?', metavar='THRESHOLD',
+            help='Threshold for memory.usage_in_bytes and memory.memsw.usage_in_bytes'),
+    ]),
+    CommandSpec('mkdir', 'Make directories of cgroups', [
+        arg('-a', '--apply-all', action='store_true',
+            help='Make directories for each subsystem'),
+        arg('-p', '--parents', action='store_true',
+            help='Make parent directories if not exist'),
+        arg('target_dir', metavar='TARGET_DIRECTORY',
+            help='Target directory path'),
+    ]),
+    CommandSpec('pgrep', 'Search and show processes with cgroup like pgrep command', [
+        arg('-o', action='store',
+            dest='target_subsystem', default=DEFAULT_SUBSYSTEM,
+            help='Specify a subsystem [%(default)s]'),
+        arg('-f', '--cmdline', action='store_true',
+            help='Compare with entire cmdline of process'),
+        arg('-l', '--show-name', action='store_true',
+            help='Show name of process'),
+        arg('-i', '--ignore-case', action='store_true',
+            help='Ignore case'),
+        arg('procname', metavar='PROCNAME', help='Process name'),
+    ]),
+    CommandSpec('rmdir', 'Remove directores of cgroups', [
+        arg('-a', '--apply-all', action='store_true',
+            help='Remove directories for each subsystem'),
+        arg('target_dir', metavar='TARGET_DIRECTORY',
+            help='Target directory path'),
+    ]),
+    CommandSpec('stats', 'Show stats of cgroups', [
+        arg('-o', action='store',
+            dest='target_subsystem', default=DEFAULT_SUBSYSTEM,
+            help='Specify a subsystem [%(default)s]'),
+        arg('-e', '--hide-empty', action='store_true',
+            help='Hide empty groups'),
+        arg('-z', '--show-zero', action='store_true',
+            help='Show zero values'),
+        arg('-j', '--json', action='store_true',
+            help='Dump as JSON'),
+        arg('--jobs', type=int, default=1, metavar='N',
+            help='Number of threads to scan cgroups and read files [%(default)s]'),
+        arg('--max-reads', type=int, metavar='N',
+            help='Read at most N cgroups [unlimited]'),
+        arg('--max-collect-ms', type=float, metavar='MSEC',
+            help='Stop reading cgroups after MSEC [unlimited]'),
+    ]),
+    CommandSpec('top', 'Show cgroup activities like top command', [
+        arg('-i', '--show-inactive', action='store_true',
+            help='Show inactive groups'),
+        arg('-z', '--show-zero', action='store_true',
+            help='Show zero numbers'),
+        arg('-e', '--show-empty', action='store_true',
+            help='Hide empty groups'),
+        arg('-r', '--hide-root', action='store_true',
+            help='Hide the root group'),
+        arg('-b', '--batch', action='store_true',
+            help='non-interactive mode'),
+        arg('-n', '--iter', type=int, dest='iterations', metavar='NUM',
+            help='Number of iterations before ending [infinite]'),
+        arg('--limit', type=int, metavar='N',
+            help='Show only top N groups [all in batch mode, fit to the screen otherwise]'),
+        arg('-d', '--delay', type=float, dest='delay_seconds',
+            help='Delay between iterations [%(default)s seconds]',
+            metavar='SEC', default=3.0),
+        arg('--tail-interval', type=float,
+            help='Sample groups not shown in every this interval, or all groups in every iteration if 0 [%(default)s seconds]',
+            metavar='SEC', default=15.0),
+        arg('-u', '--update-cgroups-interval', type=float,
+            help='Rescan cgroups in every this interval if inotify is unavailable [%(default)s seconds]',
+            metavar='SEC', default=10.0),
+        arg('--jobs', type=int, default=1, metavar='N',
+            help='Number of threads to scan cgroups and read files [%(default)s]'),
+        arg('--max-fds', type=int, default=DEFAULT_MAX_FDS, metavar='N',
+            help='Number of control files kept open, a quarter of which for watches of cgroup2 cgroup.events, or none if 0 [%(default)s]'),
+        arg('--max-reads-per-tick', type=int, metavar='N',
+            help='Read at most N cgroups in an iteration and the rest in the next ones [unlimited]'),
+        arg('--max-collect-ms', type=float, metavar='MSEC',
+            help='Stop reading cgroups after MSEC in an iteration and read the rest in the next ones [unlimited]'),
+        arg('--cgroup2', action='store_true',
+            help='Use the cgroup2 unified hierarchy even if cgroup v1 is mounted'),
+    ]),
+    CommandSpec('tree', 'Show cgroups hierarchy like tree command', [
+        arg('-o', dest='target_subsystem', default=DEFAULT_SUBSYSTEM,
+            help='Specify a subsystem [%(default)s]'),
+        arg('-e', '--hide-empty', action='store_true',
+            help='Hide empty groups [%(default)s]'),
+        arg('-k', '--show-kthread', action='store_true',
+            help='Show kernel threads [%(default)s]'),
+        arg('-c', '--color', action='store_true',
+            help='Coloring [%(default)s]'),
+        arg('-i', '--show-pid', action='store_true',
+            help='Show PID [%(default)s]'),
+        arg('-n', '--show-nprocs', action='store_true',
+            help='Show # of processes in each cgroup [%(default)s]'),
+        arg('-p', '--show-procs', action='store_true',
+            help='Show processes in each cgroup [%(default)s]'),
+        arg('-a', '--show-autogroup', action='store_true',
+            help='Show groups by autogroup feature [%(default)s]'),
+    ]),
+])
@@ -25,25 +25,6 @@ from cgutils import host
 
 
 class Command(command.Command):
-    NAME = 'configs'
-    DEFAULT_SUBSYSTEM = 'cpu'
-    HELP = 'Show values of configurable cgroup files'
-
-    @staticmethod
-    def add_subparser(subparsers):
-        parser = subparsers.add_parser(Command.NAME, help=Command.HELP)
-        parser.add_argument('-o', dest='target_subsystem',
-                            default=Command.DEFAULT_SUBSYSTEM,
-                            help='Specify a subsystem [%(default)s]')
-        parser.add_argument('-d', '--show-default', action='store_true',
-                            help='Show every parameters including default values')
-        parser.add_argument('-r', '--show-rate', action='store_true',
-                            help='Show rate value to default/current values')
-        parser.add_argument('-e', '--hide-empty', action='store_true',
-                            help='Hide empty groups')
-        parser.add_argument('-j', '--json', action='store_true',
-                            help='Dump as JSON')
-
     def calc_memory_rate(val):
         meminfo = host.MemInfo()
         meminfo.update()
@@ -90,31 +71,52 @@ class Command(command.Command):
         return ret
 
     def run(self):
-        root_cgroup = cgroup.scan_cgroups(self.args.target_subsystem)
+        root_cgroup = cgroup.scan_cgroups(self.args.target_subsystem,
+                                          workers=self.args.jobs)
+        # Tell empty groups without reading pids where possible
+        populated = cgroup.PopulatedIndex()
 
-        def collect_configs(_cgroup, store):
-            if self.args.debug:
-                print(_cgroup)
-
-            if self.args.hide_empty and _cgroup.n_procs == 0:
-                return
+        def _collect_configs(_cgroup):
+            if self.args.hide_empty and _cgroup.is_empty(populated):
+                return None
             if self.args.show_default:
                 if self.args.json:
-                    store[_cgroup.path] = _cgroup.get_configs()
+                    return _cgroup.get_configs()
                 else:
                     # To calculate rates, default values are required
-                    store[_cgroup.path] = (_cgroup.get_configs(), _cgroup.get_default_configs())
-                return
+                    return (_cgroup.get_configs(), _cgroup.get_default_configs())
             configs = self._collect_changed_configs(_cgroup)
             if configs:
                 if self.args.json:
-                    store[_cgroup.path] = configs
+                    return configs
                 else:
                     # To calculate rates, default values are required
-                    store[_cgroup.path] = (configs, _cgroup.get_default_configs())
+                    return (configs, _cgroup.get_default_configs())
+            return None
+
+        def collect_configs(_cgroup):
+            if self.args.debug:
+                print(_cgroup)
+            try:
+                return _collect_configs(_cgroup)
+            except cgroup.VanishedCGroupError:
+                # Removed after the scan
+                return None
+
+        _cgroups = []
+        cgroup.walk_cgroups(root_cgroup, lambda cg, store: store.append(cg), _cgroups)
+        results = cgroup.map_cgroups(collect_configs, _cgroups, self.args.jobs)
 
         cgroups = {}
-        cgroup.walk_cgroups(root_cgroup, collect_configs, cgroups)
+        for _cgroup, configs in zip(_cgroups, results):
+            if configs is not None:
+                cgroups[_cgroup.path] = configs
+
+        if self.args.debug:
+            print('Skipped unsupported files: %s' %
+                  ', '.join(root_cgroup.schema.get_unsupported()))
+            print('Skipped vanished cgroups: %d' % root_cgroup.schema.vanished)
+
         if self.args.json:
             import json
             json.dump(cgroups, sys.stdout, indent=4)
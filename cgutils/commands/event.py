@@ -36,19 +36,6 @@ if sys.version_info.major == 3:
 
 
 class Command(command.Command):
-    NAME = 'event'
-    HELP = 'Wait for an event'
-
-    @staticmethod
-    def add_subparser(subparsers):
-        parser = subparsers.add_parser(Command.NAME, help=Command.HELP)
-        parser.add_argument('-t', '--timeout', type=float, dest='timeout_seconds',
-                            help='Timeout in SEC [%(default)s seconds]',
-                            metavar='SEC', default=0.0)
-        parser.add_argument('target_file', metavar='TARGET_FILE', help='Target cgroup file to wait for an event')
-        parser.add_argument('threshold', nargs='?', metavar='THRESHOLD',
-                            help='Threshold for memory.usage_in_bytes and memory.memsw.usage_in_bytes')
-
     def _parse_value(self, val):
         if val[-1] == 'K':
             return long(val.replace('M', '')) * 1024
@@ -22,19 +22,6 @@ from cgutils import command
 
 
 class Command(command.Command):
-    NAME = 'mkdir'
-    HELP = 'Make directories of cgroups'
-
-    @staticmethod
-    def add_subparser(subparsers):
-        parser = subparsers.add_parser(Command.NAME, help=Command.HELP)
-        parser.add_argument('-a', '--apply-all', action='store_true',
-                            help='Make directories for each subsystem')
-        parser.add_argument('-p', '--parents', action='store_true',
-                            help='Make parent directories if not exist')
-        parser.add_argument('target_dir', metavar='TARGET_DIRECTORY',
-                            help='Target directory path')
-
     def run(self):
         if self.args.debug:
             print(args)
@@ -49,9 +36,15 @@ class Command(command.Command):
         if not self.args.apply_all:
             parent.mkdir(new)
         else:
-            status = cgroup.SubsystemStatus()
+            status = cgroup.get_subsystem_status()
             enabled = status.get_enabled()
             enabled = [s for s in enabled if not (s == 'perf_event' or s == 'debug')]
+            # cgroup2 isn't one of the v1 hierarchies which mirror each other
+            unified = cgroup.SubsystemUnified.NAME
+            if parent.subsystem.name == unified:
+                enabled = [unified]
+            else:
+                enabled = [s for s in enabled if s != unified]
 
             parents = []
             for name in enabled:
@@ -25,31 +25,16 @@ from cgutils import process
 
 
 class Command(command.Command):
-    NAME = 'pgrep'
-    HELP = 'Search and show processes with cgroup like pgrep command'
-    DEFAULT_SUBSYSTEM = 'cpu'
-
-    @staticmethod
-    def add_subparser(subparsers):
-        parser = subparsers.add_parser(Command.NAME, help=Command.HELP)
-        parser.add_argument('-o', action='store',
-                            dest='target_subsystem', default=Command.DEFAULT_SUBSYSTEM,
-                            help='Specify a subsystem [%(default)s]')
-        parser.add_argument('-f', '--cmdline', action='store_true',
-                            help='Compare with entire cmdline of process')
-        parser.add_argument('-l', '--show-name', action='store_true',
-                            help='Show name of process')
-        parser.add_argument('-i', '--ignore-case', action='store_true',
-                            help='Ignore case')
-        parser.add_argument('procname', metavar='PROCNAME', help='Process name')
-
     def run(self):
         root_cgroup = cgroup.scan_cgroups(self.args.target_subsystem)
 
         def print_matched(cg, dummy):
             mypid = os.getpid()
-            cg.update()
-            for pid in cg.pids:
+            try:
+                pids = cg.pids
+            except cgroup.VanishedCGroupError:
+                return
+            for pid in pids:
                 if pid == mypid:
                     continue
                 proc = process.Process(pid)
@@ -24,17 +24,6 @@ from cgutils import command
 
 
 class Command(command.Command):
-    NAME = 'rmdir'
-    HELP = 'Remove directores of cgroups'
-
-    @staticmethod
-    def add_subparser(subparsers):
-        parser = subparsers.add_parser(Command.NAME, help=Command.HELP)
-        parser.add_argument('-a', '--apply-all', action='store_true',
-                            help='Remove directories for each subsystem')
-        parser.add_argument('target_dir', metavar='TARGET_DIRECTORY',
-                            help='Target directory path')
-
     def run(self):
         target_dir = self.args.target_dir
 
@@ -57,9 +46,15 @@ class Command(command.Command):
         else:
             target = cgroup.get_cgroup(target_dir)
 
-            status = cgroup.SubsystemStatus()
+            status = cgroup.get_subsystem_status()
             enabled = status.get_enabled()
             enabled = [s for s in enabled if not (s == 'perf_event' or s == 'debug')]
+            # cgroup2 isn't one of the v1 hierarchies which mirror each other
+            unified = cgroup.SubsystemUnified.NAME
+            if target.subsystem.name == unified:
+                enabled = [unified]
+            else:
+                enabled = [s for s in enabled if s != unified]
 
             targets = []
             for name in enabled:
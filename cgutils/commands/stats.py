@@ -25,23 +25,6 @@ if sys.version_info.major == 3:
 
 
 class Command(command.Command):
-    NAME = 'stats'
-    HELP = 'Show stats of cgroups'
-    DEFAULT_SUBSYSTEM = 'cpu'
-
-    @staticmethod
-    def add_subparser(subparsers):
-        parser = subparsers.add_parser(Command.NAME, help=Command.HELP)
-        parser.add_argument('-o', action='store',
-                            dest='target_subsystem', default=Command.DEFAULT_SUBSYSTEM,
-                            help='Specify a subsystem [%(default)s]')
-        parser.add_argument('-e', '--hide-empty', action='store_true',
-                            help='Hide empty groups')
-        parser.add_argument('-z', '--show-zero', action='store_true',
-                            help='Show zero values')
-        parser.add_argument('-j', '--json', action='store_true',
-                            help='Dump as JSON')
-
     _INDENT = ' ' * 4
 
     def _print_stats(self, cgname, stats):
@@ -69,22 +52,54 @@ class Command(command.Command):
             sys.stdout.write(ret)
 
     def run(self):
-        root_cgroup = cgroup.scan_cgroups(self.args.target_subsystem)
+        root_cgroup = cgroup.scan_cgroups(self.args.target_subsystem,
+                                          workers=self.args.jobs)
+        # Tell empty groups without reading pids where possible
+        populated = cgroup.PopulatedIndex()
+        max_seconds = self.args.max_collect_ms
+        if max_seconds is not None:
+            max_seconds /= 1000.0
+        # Cgroups are read from the top of the hierarchy
+        budget = cgroup.Budget(self.args.max_reads, max_seconds)
+        skipped = []
 
-        def collect_configs(_cgroup, store):
+        def collect_stats(_cgroup):
+            if not budget.take():
+                skipped.append(_cgroup)
+                return None
             if self.args.debug:
                 print(_cgroup)
-            if self.args.hide_empty and _cgroup.n_procs == 0:
-                pass
-            else:
-                store[_cgroup.path] = _cgroup.get_stats()
+            try:
+                if self.args.hide_empty and _cgroup.is_empty(populated):
+                    return None
+                return _cgroup.get_stat_record()
+            except cgroup.VanishedCGroupError:
+                # Removed after the scan
+                return None
 
+        _cgroups = []
+        cgroup.walk_cgroups(root_cgroup, lambda cg, store: store.append(cg), _cgroups)
+        results = cgroup.map_cgroups(collect_stats, _cgroups, self.args.jobs)
+
+        # Records share keys in the hierarchy; dicts are built on output
         cgroups = {}
-        cgroup.walk_cgroups(root_cgroup, collect_configs, cgroups)
+        for _cgroup, record in zip(_cgroups, results):
+            if record is not None:
+                cgroups[_cgroup.path] = record
+
+        if self.args.debug:
+            print('Skipped unsupported files: %s' %
+                  ', '.join(root_cgroup.schema.get_unsupported()))
+            print('Skipped vanished cgroups: %d' % root_cgroup.schema.vanished)
+        if skipped:
+            # Keep the output, e.g., JSON, intact
+            sys.stderr.write("Read %d of %d cgroups within the budget\n" %
+                             (len(_cgroups) - len(skipped), len(_cgroups)))
 
         if self.args.json:
             import json
-            json.dump(cgroups, sys.stdout, indent=4)
+            json.dump(dict((cgname, record.to_dict()) for cgname, record in cgroups.items()),
+                      sys.stdout, indent=4)
         else:
-            for cgname, stats in cgroups.items():
-                self._print_stats(cgname, stats)
+            for cgname, record in cgroups.items():
+                self._print_stats(cgname, record.to_dict())
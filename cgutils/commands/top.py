@@ -18,16 +18,22 @@
 #
 # This code is based on ui.py of iotop 0.4
 # Copyright (c) 2007 Guillaume Chazarain <guichaz@gmail.com>
+import os
 import sys
 import curses
 import select
 import time
 import errno
+import heapq
+import math
+import collections
 
 from cgutils import cgroup
 from cgutils import command
+from cgutils import fileops
 from cgutils import host
 from cgutils import formatter
+from cgutils import snapshot
 
 
 if sys.version_info.major == 3:
@@ -37,38 +43,170 @@ if sys.version_info.major == 3:
 class CGTopStats:
     SUBSYSTEMS = ['cpuacct', 'blkio', 'memory']
     FILTERS = {
-        'cpuacct': ['stat'],
-        'blkio':   ['throttle.io_service_bytes'],
-        'memory':  ['usage_in_bytes', 'memsw.usage_in_bytes', 'stat'],
+        'cpuacct': ['stat:user,system'],
+        'blkio':   ['throttle.io_service_bytes:Read,Write'],
+        'memory':  ['usage_in_bytes', 'memsw.usage_in_bytes', 'stat:rss'],
+        # All of the above are in one directory of cgroup2
+        'unified': ['cpu.stat:user_usec,system_usec', 'io.stat:rbytes,wbytes',
+                    'memory.current', 'memory.swap.current', 'memory.stat:anon'],
     }
+    # Share of the budget of an update kept for overdue groups; see _reserve
+    RESERVED_SHARE = 0.25
+    # Share of --max-fds for watches of cgroup.events; see split_max_fds
+    WATCHES_SHARE = 0.25
 
     def __init__(self, options):
         self.options = options
 
         self.hostcpuinfo = host.CPUInfo()
-
-        self.deltas = {}
-        self.prevs = {}
-
-        self.deltas['cpu'] = 0
-        self.deltas['time'] = 0
+        # Host CPU usage is in ticks while cgroup2 cpu.stat is in usec
+        self.clk_tck = os.sysconf('SC_CLK_TCK')
+
+        # Processes of each group name in its last sample, read from
+        # one hierarchy per name; see _get_pids_cgroup
+        self.pids = {}
+        # The last sample of each group name: the time, host CPU usage
+        # and a dict of hierarchy names to StatRecords
+        self.samples = {}
+        # Metrics of each group name between its last two samples
+        self.metrics = {}
+        # Names of groups shown and their neighbours in the order, which
+        # are sampled in every update; None means all groups. See set_hot
+        self.hot = None
+        # All groups in the order to be sampled, a share per update
+        self.tail = collections.OrderedDict()
+        # Names of groups which have no metrics yet
+        self.unsampled = set()
+        # Names of groups left unread by the budget of the last update,
+        # which are read first in the next update
+        self.pending = []
+        self.last_update = None
+        # Seconds spent to read pids and stats in the last update
+        self.timings = {'pids': 0.0, 'stats': 0.0}
+        # Number of groups sampled in the last update
+        self.n_sampled = 0
+
+        # --max-fds is shared by both
+        max_files, max_watches = self.split_max_fds(options.max_fds)
+        # Keep control files open between samples
+        self.fdcache = fileops.FileCache(max_files)
+        # Watch cgroup.events of cgroup2 to skip reading pids of empty groups
+        self.populated = cgroup.PopulatedIndex(watch=True, max_watches=max_watches)
 
         self.cgroups = {}
+        # fullpath -> CGroup of all scanned cgroups including the root
+        self.cgroups_by_path = {}
+        # Numbers of cgroups created, removed and vanished while being
+        # read in the last update; see get_churn
+        self.churn = self._new_churn()
+        self.vanished = 0
         self.nosubsys_warning_showed = {}
+        self.hierarchies = self._get_hierarchies()
+        # Apply creations and removals of cgroups instead of rescanning
+        self.watcher = self._get_watcher()
+        # Notifications from cgutil-release-agent of v1 hierarchies
+        self.release_listener = self._get_release_listener()
+        # Names of released cgroups, which are likely to be removed soon
+        self.released = set()
         self._update_cgroups()
+        self._count_vanished()
         self.last_update_cgroups = time.time()
 
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.close()
+        if self.release_listener is not None:
+            self.release_listener.close()
+        self.populated.close()
+        self.fdcache.clear()
+
+    def _new_churn(self):
+        return {'created': 0, 'removed': 0, 'vanished': 0}
+
+    def get_churn(self):
+        """
+        It returns numbers of cgroups created and removed in the last
+        update, and of removed ones which vanished while being read.
+        """
+        return self.churn
+
+    def _count_vanished(self):
+        # Vanished cgroups are counted by schemas of the hierarchies
+        schemas = cgroup.get_subsystem_status().schemas
+        vanished = sum(schema.vanished for schema in schemas.values())
+        self.churn['vanished'] += vanished - self.vanished
+        self.vanished = vanished
+
+    def _get_watcher(self):
+        """
+        It returns a HierarchyWatcher, or None if inotify isn't available,
+        then the hierarchies are rescanned every update_cgroups_interval.
+        """
+        try:
+            return cgroup.HierarchyWatcher()
+        except (ImportError, EnvironmentError):
+            return None
+
+    def _get_release_listener(self):
+        """
+        It returns a ReleaseListener if cgutil-release-agent is the
+        release_agent of any of the hierarchies, otherwise None.
+        """
+        status = cgroup.get_subsystem_status()
+        for name in self.hierarchies:
+            agent = status.get_release_agent(name)
+            if agent is None or os.path.basename(agent) != cgroup.ReleaseListener.AGENT:
+                continue
+            try:
+                return cgroup.ReleaseListener()
+            except EnvironmentError:
+                return None
+        return None
+
+    def _watch(self, cg):
+        watcher = self.watcher
+        if watcher is None:
+            return
+        try:
+            watcher.watch(cg.fullpath)
+        except EnvironmentError as e:
+            if e.errno == errno.ENOENT:
+                # Removed meanwhile; the parent tells us
+                return
+            # Out of watches (ENOSPC); fall back to periodic rescans
+            self.watcher = None
+            watcher.close()
+
+    def _get_hierarchies(self):
+        """
+        It returns names of hierarchies to be scanned. If no v1 subsystem
+        of SUBSYSTEMS is mounted, e.g., on a cgroup2 only host, the unified
+        hierarchy is walked once and all files are read from one directory.
+        """
+        if self.options.cgroup2:
+            return ['unified']
+        enabled = cgroup.get_subsystem_status().get_enabled()
+        if 'unified' in enabled and not any(name in enabled for name in self.SUBSYSTEMS):
+            return ['unified']
+        return self.SUBSYSTEMS
+
     def _update_cgroups(self):
         def collect_by_name(cg, store):
+            cg.fdcache = self.fdcache
             if cg.fullname not in store:
                 store[cg.fullname] = []
             store[cg.fullname].append(cg)
+            self.cgroups_by_path[cg.fullpath] = cg
 
         # Collect cgroups by group name (path)
         cgroups = {}
-        for name in self.SUBSYSTEMS:
+        old_paths = set(self.cgroups_by_path)
+        self.cgroups_by_path = {}
+        for name in self.hierarchies:
             try:
-                root_cgroup = cgroup.scan_cgroups(name, self.FILTERS[name])
+                root_cgroup = cgroup.scan_cgroups(name, self.FILTERS[name],
+                                                  workers=self.options.jobs,
+                                                  visit=self._watch)
                 cgroup.walk_cgroups(root_cgroup, collect_by_name, cgroups)
             except EnvironmentError as e:
                 # Don't annoy users by showing error messages
@@ -81,10 +219,95 @@ class CGTopStats:
                     time.sleep(1)
                     self.nosubsys_warning_showed[name] = True
         self.cgroups = cgroups
+        new_paths = set(self.cgroups_by_path)
+        self.churn['created'] += len(new_paths - old_paths)
+        self.churn['removed'] += len(old_paths - new_paths)
+        self.populated.prune(new_paths)
 
         if self.options.hide_root:
             del self.cgroups['/']
 
+        for name in [name for name in self.tail if name not in self.cgroups]:
+            self._forget(name)
+        for name in self.cgroups:
+            if name not in self.tail:
+                self.tail[name] = None
+                self.unsampled.add(name)
+
+    def _forget(self, name):
+        """It forgets the samples of the group name which has gone."""
+        self.samples.pop(name, None)
+        self.metrics.pop(name, None)
+        self.pids.pop(name, None)
+        self.tail.pop(name, None)
+        self.unsampled.discard(name)
+
+    def _add_cgroup(self, fullpath):
+        parent = self.cgroups_by_path.get(os.path.dirname(fullpath))
+        if parent is None or fullpath in self.cgroups_by_path:
+            return
+        try:
+            cg = cgroup.scan_subtree(parent, fullpath, self.FILTERS[parent.subsystem.name],
+                                     visit=self._watch)
+        except EnvironmentError:
+            return
+        if cg is None:
+            # Removed meanwhile
+            return
+
+        def collect_by_name(cg, store):
+            cg.fdcache = self.fdcache
+            if cg.fullname not in store:
+                self.tail[cg.fullname] = None
+                self.unsampled.add(cg.fullname)
+            store.setdefault(cg.fullname, []).append(cg)
+            self.cgroups_by_path[cg.fullpath] = cg
+            self.churn['created'] += 1
+        cgroup.walk_cgroups(cg, collect_by_name, self.cgroups)
+
+    def _remove_cgroup(self, fullpath):
+        cg = self.cgroups_by_path.get(fullpath)
+        if cg is None:
+            return
+        if cg.parent is not None:
+            cg.parent.childs = [c for c in cg.parent.childs if c is not cg]
+
+        def forget(cg, opaque):
+            if self.cgroups_by_path.pop(cg.fullpath, None) is not None:
+                self.churn['removed'] += 1
+            cgroup_list = self.cgroups.get(cg.fullname, [])
+            if cg in cgroup_list:
+                cgroup_list.remove(cg)
+                if not cgroup_list:
+                    del self.cgroups[cg.fullname]
+                    self._forget(cg.fullname)
+                elif cg.fullname in self.samples:
+                    # Don't compare a recreated cgroup with the removed one
+                    self.samples[cg.fullname][2].pop(cg.subsystem.name, None)
+            self.populated.discard(cg.fullpath)
+            for filename in cg.schema.filenames.values():
+                self.fdcache.forget(cg.fullpath + '/' + filename)
+        cgroup.walk_cgroups(cg, forget, None)
+        if self.watcher is not None:
+            self.watcher.unwatch(fullpath)
+
+    def _apply_cgroup_events(self):
+        """
+        It applies creations and removals of cgroups notified by the
+        watcher. If some events have been lost, the hierarchies are
+        scanned again.
+        """
+        watcher = self.watcher
+        events = watcher.read_events()
+        if (watcher.OVERFLOW, None) in events:
+            self._update_cgroups()
+            return
+        for event, fullpath in events:
+            if event == watcher.CREATED:
+                self._add_cgroup(fullpath)
+            else:
+                self._remove_cgroup(fullpath)
+
     def _get_skelton_stats(self, name, n_procs):
         return {
             'name': name,
@@ -96,149 +319,381 @@ class CGTopStats:
             'mem.total': 0,
             'mem.rss': 0,
             'mem.swap':  0,
+            'age': 0.0,
         }
 
     def get_cgroup_stats(self):
         cgroup_stats = []
-        for cgroup_list in list(self.cgroups.values()):
-            cpu = mem = bio = None
-            pids = []
-            for _cgroup in cgroup_list:
-                subsys_name = _cgroup.subsystem.name
-                if subsys_name == 'cpuacct':
-                    cpu = _cgroup
-                elif subsys_name == 'memory':
-                    mem = _cgroup
-                elif subsys_name == 'blkio':
-                    bio = _cgroup
-                _cgroup.update()
-                pids += _cgroup.pids
-
-            n_procs = len(set(pids))
+        for name in list(self.cgroups.keys()):
+            # cgroup.procs may have duplicates
+            n_procs = len(set(self.pids.get(name, ())))
             if not self.options.show_empty and n_procs == 0:
                 continue
 
             active = False
-            stats = self._get_skelton_stats(_cgroup.fullname, n_procs)
-
-            if cpu:
-                def percent(delta):
-                    return float(delta) * 100 / self.deltas['cpu']
+            stats = self._get_skelton_stats(name, n_procs)
 
-                if self.deltas['cpu'] and cpu in self.deltas:
-                    stats['cpu.user'] = percent(self.deltas[cpu]['user'])
-                    stats['cpu.system'] = percent(self.deltas[cpu]['system'])
-                if (stats['cpu.user'] + stats['cpu.system']) > 0.0:
+            for key, value in self.metrics.get(name, {}).items():
+                stats[key] = value
+                if value != 0:
                     active = True
+            if name in self.samples:
+                # Seconds since the group was sampled
+                stats['age'] = self.last_update - self.samples[name][0]
 
-            if bio:
-                def byps(delta):
-                    return float(delta) / self.deltas['time']
-                if self.deltas['time'] and bio in self.deltas:
-                    stats['bio.read'] = byps(self.deltas[bio]['read'])
-                    stats['bio.write'] = byps(self.deltas[bio]['write'])
-                if (stats['bio.read'] + stats['bio.write']) > 0.0:
-                    active = True
-
-            if mem:
-                if mem in self.deltas:
-                    stats['mem.total'] = self.deltas[mem]['total']
-                    stats['mem.rss'] = self.deltas[mem]['rss']
-                    if 'swap' in self.deltas[mem]:
-                        stats['mem.swap'] = self.deltas[mem]['swap']
-                n = [stats['mem.total'],
-                     stats['mem.rss'],
-                     stats['mem.swap']].count(0)
-                if n != 3:
-                    active = True
             if not self.options.show_inactive and not active:
                 pass
             else:
                 cgroup_stats.append(stats)
         return cgroup_stats
 
-    def __conv_blkio_stats(stats):
-        n_reads = n_writes = long(0)
-        for k, v in stats['throttle.io_service_bytes'].items():
-            if k == 'Total':
+    def _calc_metrics(self, subsys_name, delta, intervals):
+        """
+        It computes metrics of the rows of the delta snapshot of the
+        hierarchy, column by column. Rows may be sampled at different
+        intervals, so rates are computed from the seconds and the host
+        CPU usage between the samples of each row, given as intervals.
+        It returns a dict of metric names to lists of values.
+        """
+        values = {}
+        if subsys_name == 'cpuacct':
+            factors = [100.0 / cpu if cpu else 0.0 for elapsed, cpu in intervals]
+            values['cpu.user'] = delta.tolist(delta.scale_rows(delta.column(('stat', 'user')), factors))
+            values['cpu.system'] = delta.tolist(delta.scale_rows(delta.column(('stat', 'system')), factors))
+
+        elif subsys_name == 'blkio':
+            factors = [1.0 / elapsed if elapsed else 0.0 for elapsed, cpu in intervals]
+            # Columns are ('throttle.io_service_bytes', device, type)
+            for key, type in [('bio.read', 'Read'), ('bio.write', 'Write')]:
+                names = [n for n in delta.columns if len(n) == 3 and n[2] == type]
+                values[key] = delta.tolist(delta.scale_rows(delta.total(names), factors))
+
+        elif subsys_name == 'memory':
+            total = delta.column(('usage_in_bytes',))
+            # Missing if swap accounting is disabled, then shown as 0
+            swap = delta.subtract(delta.column(('memsw.usage_in_bytes',)), total)
+            factors = self._memory_factors(intervals)
+            values['mem.total'] = delta.tolist(delta.scale_rows(total, factors))
+            values['mem.rss'] = delta.tolist(delta.scale_rows(delta.column(('stat', 'rss')), factors))
+            values['mem.swap'] = delta.tolist(delta.scale_rows(swap, factors))
+
+        elif subsys_name == 'unified':
+            usec = 1000 * 1000
+            factors = [100.0 * self.clk_tck / usec / cpu if cpu else 0.0
+                       for elapsed, cpu in intervals]
+            values['cpu.user'] = delta.tolist(delta.scale_rows(delta.column(('cpu.stat', 'user_usec')), factors))
+            values['cpu.system'] = delta.tolist(delta.scale_rows(delta.column(('cpu.stat', 'system_usec')), factors))
+            factors = [1.0 / elapsed if elapsed else 0.0 for elapsed, cpu in intervals]
+            # Columns are ('io.stat', device, type)
+            for key, type in [('bio.read', 'rbytes'), ('bio.write', 'wbytes')]:
+                names = [n for n in delta.columns if len(n) == 3 and n[2] == type]
+                values[key] = delta.tolist(delta.scale_rows(delta.total(names), factors))
+            factors = self._memory_factors(intervals)
+            values['mem.total'] = delta.tolist(delta.scale_rows(delta.column(('memory.current',)), factors))
+            values['mem.rss'] = delta.tolist(delta.scale_rows(delta.column(('memory.stat', 'anon')), factors))
+            values['mem.swap'] = delta.tolist(delta.scale_rows(delta.column(('memory.swap.current',)), factors))
+        return values
+
+    def _memory_factors(self, intervals):
+        """
+        It returns factors which turn memory deltas of rows into changes
+        per delay_seconds, so that a row sampled at a longer interval
+        isn't shown with changes accumulated over the interval.
+        """
+        delay = self.options.delay_seconds
+        return [delay / elapsed if elapsed else 0.0 for elapsed, cpu in intervals]
+
+    def _update_metrics(self, records_by_name, now, cpu_total_usage):
+        """
+        It updates metrics of the sampled groups from their previous
+        samples, hierarchy by hierarchy at once. A group sampled for
+        the first time gets metrics on its next sample.
+        """
+        rows = dict((subsys_name, ([], [], [], [])) for subsys_name in self.hierarchies)
+        for name, records in records_by_name.items():
+            prev = self.samples.get(name)
+            self.samples[name] = (now, cpu_total_usage, records)
+            if prev is None:
                 continue
-            n_reads += v['Read']
-            n_writes += v['Write']
-        return {
-            'read': n_reads,
-            'write': n_writes,
-        }
-
-    def __conv_memory_stats(stats):
-        _stats = {}
-        _stats['total'] = stats['usage_in_bytes']
-        if 'memsw.usage_in_bytes' in stats:
-            _stats['swap'] = stats['memsw.usage_in_bytes'] - _stats['total']
-        _stats['rss'] = stats['stat']['rss']
-        return _stats
-
-    def __conv_cpu_stats(stats):
-        return {
-            'user': stats['stat']['user'],
-            'system': stats['stat']['system'],
-        }
-
-    _convert = {
-        'memory': __conv_memory_stats,
-        'cpuacct': __conv_cpu_stats,
-        'blkio': __conv_blkio_stats,
-    }
-
-    def __calc_delta(current, previous):
-        delta = {}
-        for name, value in current.items():
-            if isinstance(value, long):
-                delta[name] = value - previous[name]
-        return delta
-
-    _diff = {
-        long: lambda a, b: a - b,
-        int: lambda a, b: a - b,
-        float: lambda a, b: a - b,
-        dict: __calc_delta,
-    }
-
-    def _update_delta(self, key, new):
-        if key in self.prevs:
-            self.deltas[key] = self._diff[new.__class__](new, self.prevs[key])
-        self.prevs[key] = new
+            prev_time, prev_cpu_total_usage, prev_records = prev
+            interval = (now - prev_time, cpu_total_usage - prev_cpu_total_usage)
+            for subsys_name, record in records.items():
+                if subsys_name not in prev_records:
+                    continue
+                keys, curs, prevs, intervals = rows[subsys_name]
+                keys.append(name)
+                curs.append(record)
+                prevs.append(prev_records[subsys_name])
+                intervals.append(interval)
+
+        for subsys_name, (keys, curs, prevs, intervals) in rows.items():
+            if not keys:
+                continue
+            delta = (snapshot.Snapshot.from_records(keys, curs, now) -
+                     snapshot.Snapshot.from_records(keys, prevs, now))
+            values = self._calc_metrics(subsys_name, delta, intervals)
+            for i, name in enumerate(keys):
+                metrics = self.metrics.setdefault(name, {})
+                for key, column in values.items():
+                    metrics[key] = column[i]
+                self.unsampled.discard(name)
+
+    def set_hot(self, names):
+        """
+        It makes the group names, e.g., ones shown and their neighbours
+        in the order, sampled in every update. The other groups are
+        sampled once in every tail_interval. None makes all groups hot.
+        """
+        self.hot = None if names is None else set(names)
+
+    @classmethod
+    def split_max_fds(cls, max_fds):
+        """
+        It splits max_fds descriptors into ones of the FileCache and
+        ones of watches of the PopulatedIndex, so that top keeps at
+        most max_fds descriptors open in total.
+        """
+        max_watches = int(max_fds * cls.WATCHES_SHARE)
+        return max_fds - max_watches, max_watches
+
+    def _get_budget(self):
+        max_seconds = self.options.max_collect_ms
+        if max_seconds is not None:
+            max_seconds /= 1000.0
+        return cgroup.Budget(self.options.max_reads_per_tick, max_seconds)
+
+    def _priority(self, name):
+        """
+        It returns the sort key of the group name for the budget: hot
+        groups first, then overdue ones, i.e., not sampled for the
+        tail_interval or not sampled yet, then active ones, i.e., with
+        any non-zero metric.
+        """
+        hot = self.hot is None or name in self.hot
+        sample = self.samples.get(name)
+        tail_interval = self.options.tail_interval
+        overdue = (bool(tail_interval) and sample is not None and
+                   self.last_update - sample[0] >= tail_interval)
+        overdue = overdue or name in self.unsampled
+        active = any(value != 0 for value in self.metrics.get(name, {}).values())
+        return (not hot, not overdue, not active)
+
+    def _schedule(self, now, budget):
+        """
+        It returns names of groups to be sampled in this update: hot
+        ones, ones without metrics yet and a share of the tail which
+        takes turns so that every group is sampled in every tail_interval.
+        Groups left unread by the budget of the last update are added.
+        If the budget is limited, names are in the order to be read.
+        """
+        tail_interval = self.options.tail_interval
+        if self.hot is None or not tail_interval or self.last_update is None:
+            names = set(self.cgroups.keys())
+        else:
+            names = set(self.hot)
+            names.update(self.unsampled)
+            share = len(self.tail) * (now - self.last_update) / tail_interval
+            for i in range(min(int(math.ceil(share)), len(self.tail))):
+                name, _ = self.tail.popitem(last=False)
+                self.tail[name] = None
+                names.add(name)
+        # Pending ones come first among the same priority
+        pending = [name for name in self.pending if name in self.cgroups]
+        names.difference_update(pending)
+        names = pending + [name for name in names if name in self.cgroups]
+        if budget.is_limited():
+            names.sort(key=self._priority)
+            names = self._reserve(names, budget)
+            if budget.max_reads is not None:
+                # A group larger than the whole budget is read only as
+                # the first one, so it goes first once it is left unread
+                for name in pending:
+                    if len(self.cgroups[name]) > budget.max_reads:
+                        names.remove(name)
+                        names.insert(0, name)
+                        break
+        return names
+
+    def _reserve(self, names, budget):
+        """
+        It moves overdue groups which aren't hot to the front of the
+        names, up to RESERVED_SHARE of the budget, so that they are read
+        even if the hot groups alone use up the budget and no group
+        starves. The names are sorted by _priority.
+        """
+        if budget.max_reads is not None:
+            limit = budget.max_reads
+        else:
+            limit = sum(len(self.cgroups[name]) for name in names)
+        reserved_reads = max(1, int(limit * self.RESERVED_SHARE))
+        reserved = []
+        reads = 0
+        for name in names:
+            if reads >= reserved_reads:
+                break
+            not_hot, not_overdue, _ = self._priority(name)
+            if not_hot and not not_overdue:
+                reserved.append(name)
+                reads += len(self.cgroups[name])
+        if not reserved:
+            return names
+        reserved_names = set(reserved)
+        return reserved + [name for name in names if name not in reserved_names]
+
+    def _apply_release_events(self):
+        """
+        It drops released cgroups which have been removed, so removed
+        cgroups aren't read in vain. Released ones are checked once on
+        the next update, which gives time to remove them; ones left,
+        e.g., idle long-lived groups, are found by rescans or the watcher.
+        """
+        for name in self.released:
+            for cg in list(self.cgroups.get(name, [])):
+                if not os.path.isdir(cg.fullpath):
+                    self._remove_cgroup(cg.fullpath)
+        # The path is from the mount point, e.g., '/a/b'
+        self.released = set(path.lstrip('/') for path in self.release_listener.read_events())
+
+    def _get_pids_cgroup(self, cgroup_list):
+        """
+        It returns the cgroup of the group name whose pids are read.
+        The same processes are in the group of every hierarchy, so only
+        the one of the first hierarchy, if any, is read.
+        """
+        for _cgroup in cgroup_list:
+            if _cgroup.subsystem.name == self.hierarchies[0]:
+                return _cgroup
+        return cgroup_list[0]
 
     def update(self):
-        elapsed = time.time() - self.last_update_cgroups
-        if elapsed > self.options.update_cgroups_interval:
+        # Bounds the whole update including applying events
+        budget = self._get_budget()
+        self.churn = self._new_churn()
+        if self.release_listener is not None:
+            self._apply_release_events()
+        if self.watcher is not None:
+            self._apply_cgroup_events()
+        elif time.time() - self.last_update_cgroups > self.options.update_cgroups_interval:
             # Update cgroups hierarchy to know newcomers
             self._update_cgroups()
             self.last_update_cgroups = time.time()
-
-        removed_group_names = []
-        # Read stats from cgroups and calculate deltas
-        for name, cgroup_list in self.cgroups.items():
+        self.populated.update()
+
+        def read_stats(cgroup_list):
+            # One read per cgroup; left for the next update if over budget
+            if not budget.take(len(cgroup_list)):
+                return None
+            results = []
+            vanished = []
+            pids = ()
+            bef = time.time()
+            # Read cgroup.procs once per group name
+            _cgroup = self._get_pids_cgroup(cgroup_list)
             try:
-                for _cgroup in cgroup_list:
+                if self.populated.is_populated(_cgroup) is not False:
                     _cgroup.update()
-                    stats = _cgroup.get_stats()
-                    if self.options.debug:
-                        print(stats)
-                    stats = self._convert[_cgroup.subsystem.name](stats)
-                    self._update_delta(_cgroup, stats)
-            except IOError as e:
-                if e.args and e.args[0] == errno.ENOENT:
-                    removed_group_names.append(name)
-
-        for name in removed_group_names:
-            del self.cgroups[name]
-
-        # Calculate delta of host total CPU usage
+                    pids = _cgroup.pids
+            except cgroup.VanishedCGroupError:
+                vanished.append(_cgroup)
+            mid = time.time()
+            for _cgroup in cgroup_list:
+                if vanished and _cgroup is vanished[0]:
+                    continue
+                try:
+                    record = _cgroup.get_stat_record()
+                except cgroup.VanishedCGroupError:
+                    vanished.append(_cgroup)
+                    continue
+                if self.options.debug:
+                    print(record.to_dict())
+                results.append((_cgroup, record))
+            aft = time.time()
+            return results, vanished, pids, (mid - bef, aft - mid)
+
+        # Read stats from cgroups (in parallel if --jobs is given)
+        names = self._schedule(time.time(), budget)
+        cgroup_lists = [self.cgroups[name] for name in names]
+        all_results = cgroup.map_cgroups(read_stats, cgroup_lists, self.options.jobs)
+
+        vanished_cgroups = []
+        records_by_name = {}
+        self.timings = {'pids': 0.0, 'stats': 0.0}
+        self.pending = []
+        for name, result in zip(names, all_results):
+            if result is None:
+                self.pending.append(name)
+                continue
+            results, vanished, pids, timings = result
+            vanished_cgroups.extend(vanished)
+            self.pids[name] = pids
+            # Summed up over threads if --jobs is given
+            self.timings['pids'] += timings[0]
+            self.timings['stats'] += timings[1]
+            records_by_name[name] = dict((_cgroup.subsystem.name, record)
+                                         for _cgroup, record in results)
+        self.n_sampled = len(records_by_name)
+
+        # Host CPU usage at the same time as the samples
         cpu_total_usage = self.hostcpuinfo.get_total_usage()
-        self._update_delta('cpu', cpu_total_usage)
+        now = time.time()
+        # Calculate deltas of the sampled groups in each subsystem at once
+        self._update_metrics(records_by_name, now, cpu_total_usage)
+        self.last_update = now
 
-        # Calculate delta of time
-        self._update_delta('time', time.time())
+        # Drop just the vanished subtrees; the rest of the hierarchies is intact
+        for _cgroup in vanished_cgroups:
+            self._remove_cgroup(_cgroup.fullpath)
+        self._count_vanished()
+
+        if self.options.debug:
+            for schema in cgroup.get_subsystem_status().schemas.values():
+                print('Skipped unsupported files of %s: %s' %
+                      (schema.subsystem.name, ', '.join(schema.get_unsupported())))
+
+
+def select_top(cgroup_stats, key, k=None, reverse=True):
+    """
+    It returns the k rows of cgroup_stats with the largest values of
+    the key, or the smallest if not reverse, in order. It is the same
+    as sorting all rows and taking the first k ones, but costs
+    O(n log k) instead of O(n log n).
+    """
+    def sort_key(stats):
+        return stats[key]
+    if k is None or k >= len(cgroup_stats):
+        return sorted(cgroup_stats, key=sort_key, reverse=reverse)
+    if reverse:
+        return heapq.nlargest(k, cgroup_stats, key=sort_key)
+    return heapq.nsmallest(k, cgroup_stats, key=sort_key)
+
+
+def _is_ascii(text):
+    try:
+        text.encode('ascii')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def _changed_column(old, new):
+    """
+    It returns the first column where the new line differs from the old
+    one if both are plain text lines in the same attr, otherwise 0.
+    Non-ASCII characters may be wider than a column, so they are 0 too.
+    """
+    if old is None or old[1] is not None or new[1] is not None:
+        return 0
+    if len(old[0]) != 1 or len(new[0]) != 1:
+        return 0
+    (old_text, old_attr), = old[0]
+    (new_text, new_attr), = new[0]
+    if old_attr != new_attr or not (_is_ascii(old_text) and _is_ascii(new_text)):
+        return 0
+    x = 0
+    n = min(len(old_text), len(new_text))
+    while x < n and old_text[x] == new_text[x]:
+        x += 1
+    return x
 
 
 class CGTopUI:
@@ -261,6 +716,17 @@ class CGTopUI:
         self.sorting_key = 'cpu.user'
         self.sorting_reverse = True
 
+        # Rows of the last update and the top of them shown, which are
+        # reused on key presses until the next update
+        self._cgroup_stats = None
+        self._cgroup_stats_params = None
+        self._top_stats = None
+        self._top_stats_params = None
+        # Lines on the screen, each a pair of (text, attr) segments and
+        # an attr to fill the line or None; see _draw
+        self._drawn = None
+        self.height = self.width = None
+
         self._init_display_params()
         self._init_subsys_title()
         self._init_item_titles()
@@ -318,7 +784,11 @@ class CGTopUI:
         action()
 
     def resize(self):
-        self.height, self.width = self.win.getmaxyx()
+        size = self.win.getmaxyx()
+        if size != (self.height, self.width):
+            self.height, self.width = size
+            # Redraw everything
+            self._drawn = None
 
     def run(self):
         iterations = 0
@@ -329,8 +799,16 @@ class CGTopUI:
             bef = time.time()
             self.cgstats.update()
             aft = time.time()
-
-            debug_msg = "%.1f msec to collect statistics" % ((aft - bef) * 1000)
+            self._cgroup_stats = None
+            self._top_stats = None
+
+            timings = self.cgstats.timings
+            debug_msg = "%.1f msec to collect statistics (pids %.1f msec, stats %.1f msec)" % \
+                ((aft - bef) * 1000, timings['pids'] * 1000, timings['stats'] * 1000)
+            debug_msg += (", cgroups %(created)d created, %(removed)d removed"
+                          " (%(vanished)d vanished while read)" % self.cgstats.get_churn())
+            debug_msg += ", %d of %d groups sampled (%d deferred)" % \
+                (self.cgstats.n_sampled, len(self.cgstats.cgroups), len(self.cgstats.pending))
             self.refresh_display(debug_msg)
 
             if self.options.iterations:
@@ -340,18 +818,24 @@ class CGTopUI:
             elif iterations == 0:
                 iterations = 1
 
-            try:
-                events = poll.poll(self.options.delay_seconds * 1000.0)
-            except select.error as e:
-                if e.args and e.args[0] == errno.EINTR:
-                    events = 0
-                else:
+            # Redraw on key presses with the same data until the delay passes
+            deadline = time.time() + self.options.delay_seconds
+            while True:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    events = poll.poll(timeout * 1000.0)
+                except select.error as e:
+                    if e.args and e.args[0] == errno.EINTR:
+                        continue
                     raise
-            if not self.options.batch:
+                if not events:
+                    break
                 self.resize()
-            if events:
                 key = self.win.getch()
                 self.handle_key(key)
+                self.refresh_display(debug_msg)
 
     def _init_display_params(self):
         subsys_sep_size = 2
@@ -417,6 +901,32 @@ class CGTopUI:
             'name':       'NAME',
         }
 
+    def _get_top_stats(self, k):
+        """
+        It returns the top k rows in the current order. Rows and the
+        selection are cached until the next update, so a key press which
+        changes neither the filters nor the order costs nothing. The
+        rows and as many following ones are sampled in every update.
+        """
+        params = (self.options.show_empty, self.options.show_inactive)
+        if self._cgroup_stats is None or self._cgroup_stats_params != params:
+            self._cgroup_stats = self.cgstats.get_cgroup_stats()
+            self._cgroup_stats_params = params
+            self._top_stats = None
+
+        params = (self.sorting_key, self.sorting_reverse, k)
+        if self._top_stats is None or self._top_stats_params != params:
+            n = None if k is None else k * 2
+            top_stats = select_top(self._cgroup_stats, self.sorting_key, n,
+                                   self.sorting_reverse)
+            self._top_stats = top_stats[:k]
+            self._top_stats_params = params
+            if k is None:
+                self.cgstats.set_hot(None)
+            else:
+                self.cgstats.set_hot([stats['name'] for stats in top_stats])
+        return self._top_stats
+
     def refresh_display(self, debug_msg):
         def format(stats):
             w = self.ITEM_WIDTHS
@@ -442,92 +952,93 @@ class CGTopUI:
             strs.append(sep.join([to_s('bio.read'), to_s('bio.write'), ]))
             strs.append(sep.join([to_s('mem.total'), to_s('mem.rss'),
                                   to_s('mem.swap'), ]))
+            name = stats['name']
+            if stats['age'] >= 1:
+                # Not sampled in the last update
+                name += ' (%ds ago)' % stats['age']
             strs.append(sep.join([
                 str(stats['n_procs']).rjust(w['n_procs']),
-                stats['name']]
+                name]
             ))
             return self.SUBSYS_SEP.join(strs)
 
-        cgroup_stats = self.cgstats.get_cgroup_stats()
-        cgroup_stats.sort(key=lambda st: st[self.sorting_key],
-                          reverse=self.sorting_reverse)
-        lines = [format(s) for s in cgroup_stats]
-
         if self.options.batch:
             print(debug_msg)
             print(self.SUBSYS_TITLE)
             print(self.ITEM_TITLE)
-            for l in lines:
-                print(l)
+            for stats in self._get_top_stats(self.options.limit):
+                print(format(stats))
             sys.stdout.flush()
             return
 
-        self.win.erase()
-        n_lines = 0
+        lines = []
         if self.options.debug:
-            self.win.addstr(debug_msg[:self.width])
-            n_lines += 1
+            lines.append((((debug_msg[:self.width], 0),), None))
 
-        self.win.hline(n_lines, 0, ord(' ') | curses.A_REVERSE, self.width)
-        n_lines += 1
-        attr = curses.A_REVERSE
-        self.win.addstr(self.SUBSYS_TITLE, attr)
-
-        self.win.hline(n_lines, 0, ord(' ') | curses.A_REVERSE, self.width)
-        n_lines += 1
-        status_msg = ''
+        lines.append((((self.SUBSYS_TITLE, curses.A_REVERSE),), curses.A_REVERSE))
         key_title = self.KEY2TITLE[self.sorting_key]
         pre, post = self.ITEM_TITLE.split(key_title)
-        self.win.addstr(pre, curses.A_REVERSE)
-        self.win.addstr(key_title, curses.A_BOLD | curses.A_REVERSE)
-        self.win.addstr(post, curses.A_REVERSE)
-
-        rest_lines = self.height - n_lines - int(bool(status_msg))
-        num_lines = min(len(lines), rest_lines)
-        for i in range(num_lines):
-            try:
-                self.win.insstr(i + n_lines, 0, lines[i].encode('utf-8'))
-            except curses.error:
-                exc_type, value, traceback = sys.exc_info()
-                value = '%s win:%s i:%d line:%s' % \
-                        (value, self.win.getmaxyx(), i, lines[i])
-                value = str(value).encode('string_escape')
-                raise exc_type(value).with_traceback(traceback)
-        if status_msg:
-            self.win.insstr(self.height - 1, 0, status_msg, curses.A_BOLD)
-        self.win.refresh()
+        lines.append((((pre, curses.A_REVERSE),
+                       (key_title, curses.A_BOLD | curses.A_REVERSE),
+                       (post, curses.A_REVERSE)), curses.A_REVERSE))
+
+        rest_lines = self.height - len(lines)
+        if self.options.limit is not None:
+            rest_lines = min(rest_lines, self.options.limit)
+        # Format only rows which fit to the screen
+        for stats in self._get_top_stats(max(rest_lines, 0)):
+            lines.append((((format(stats), 0),), None))
+        self._draw(lines[:self.height])
+
+    def _draw_line(self, y, line, x=0):
+        """It draws the line from the column x."""
+        segments, fill = line
+        if fill is not None:
+            self.win.hline(y, 0, ord(' ') | fill, self.width)
+        else:
+            self.win.move(y, x)
+            self.win.clrtoeol()
+        # insstr doesn't fail at the bottom right corner unlike addstr
+        pos = 0
+        for text, attr in segments:
+            if pos + len(text) > x:
+                start = max(x - pos, 0)
+                self.win.insstr(y, pos + start, text[start:], attr)
+            pos += len(text)
+
+    def _draw(self, lines):
+        """
+        It rewrites only lines which differ from the ones drawn last
+        time. A changed line of plain ASCII text is rewritten from the
+        first changed column. Nothing is sent to the terminal if the
+        screen doesn't change. Everything is redrawn after resize.
+        """
+        drawn = self._drawn
+        if drawn is None:
+            self.win.erase()
+            drawn = []
+        for y, line in enumerate(lines):
+            old = drawn[y] if y < len(drawn) else None
+            if line == old:
+                continue
+            self._draw_line(y, line, _changed_column(old, line))
+        for y in range(len(lines), len(drawn)):
+            # Clear rows which have gone
+            self.win.move(y, 0)
+            self.win.clrtoeol()
+        self._drawn = lines
+        self.win.noutrefresh()
+        curses.doupdate()
 
 
 class Command(command.Command):
-    NAME = 'top'
-    HELP = 'Show cgroup activities like top command'
-
-    @staticmethod
-    def add_subparser(subparsers):
-        parser = subparsers.add_parser(Command.NAME, help=Command.HELP)
-        parser.add_argument('-i', '--show-inactive', action='store_true',
-                            help='Show inactive groups')
-        parser.add_argument('-z', '--show-zero', action='store_true',
-                            help='Show zero numbers')
-        parser.add_argument('-e', '--show-empty', action='store_true',
-                            help='Hide empty groups')
-        parser.add_argument('-r', '--hide-root', action='store_true',
-                            help='Hide the root group')
-        parser.add_argument('-b', '--batch', action='store_true',
-                            help='non-interactive mode')
-        parser.add_argument('-n', '--iter', type=int, dest='iterations', metavar='NUM',
-                            help='Number of iterations before ending [infinite]')
-        parser.add_argument('-d', '--delay', type=float, dest='delay_seconds',
-                            help='Delay between iterations [%(default)s seconds]',
-                            metavar='SEC', default=3.0)
-        parser.add_argument('-u', '--update-cgroups-interval', type=float,
-                            help='Update cgroups in every this interval [%(default)s seconds]',
-                            metavar='SEC', default=10.0)
-
     def _run_window(self, win):
         cgstats = CGTopStats(self.args)
-        ui = CGTopUI(win, cgstats, self.args)
-        ui.run()
+        try:
+            ui = CGTopUI(win, cgstats, self.args)
+            ui.run()
+        finally:
+            cgstats.close()
 
     def run(self):
         if self.args.batch:
@@ -60,30 +60,6 @@ class TreeContainer():
 
 
 class Command(command.Command):
-    NAME = 'tree'
-    HELP = 'Show cgroups hierarchy like tree command'
-    DEFAULT_SUBSYSTEM = 'cpu'
-
-    @staticmethod
-    def add_subparser(subparsers):
-        parser = subparsers.add_parser(Command.NAME, help=Command.HELP)
-        parser.add_argument('-o', dest='target_subsystem', default=Command.DEFAULT_SUBSYSTEM,
-                            help='Specify a subsystem [%(default)s]')
-        parser.add_argument('-e', '--hide-empty', action='store_true',
-                            help='Hide empty groups [%(default)s]')
-        parser.add_argument('-k', '--show-kthread', action='store_true',
-                            help='Show kernel threads [%(default)s]')
-        parser.add_argument('-c', '--color', action='store_true',
-                            help='Coloring [%(default)s]')
-        parser.add_argument('-i', '--show-pid', action='store_true',
-                            help='Show PID [%(default)s]')
-        parser.add_argument('-n', '--show-nprocs', action='store_true',
-                            help='Show # of processes in each cgroup [%(default)s]')
-        parser.add_argument('-p', '--show-procs', action='store_true',
-                            help='Show processes in each cgroup [%(default)s]')
-        parser.add_argument('-a', '--show-autogroup', action='store_true',
-                            help='Show groups by autogroup feature [%(default)s]')
-
     _INDENT_SIZE = 4
 
     def _build_indent(self, indents):
@@ -123,9 +99,8 @@ class Command(command.Command):
         print(s)
 
     def _print_cgroup(self, cg, indents):
-        cg.update()
         if self.args.debug:
-            print(cg.pids)
+            print(list(cg.pids))
         s = self._build_indent(indents)
         if self.args.color:
             s += decorate(cg.name, 'cgroup')
@@ -228,6 +203,8 @@ class Command(command.Command):
             sys.exit(1)
 
         root_cgroup = cgroup.scan_cgroups(self.args.target_subsystem)
+        # Tell empty groups without reading pids where possible
+        populated = cgroup.PopulatedIndex()
 
         if self.args.debug:
             print(root_cgroup)
@@ -235,10 +212,8 @@ class Command(command.Command):
         def build_container_tree(container):
             _cgroup = container.this
             for child in _cgroup.childs:
-                child.update()
-                n_childs = len(child.childs)
-                n_pids = len(child.pids)
-                if self.args.hide_empty and n_childs == 0 and n_pids == 0:
+                # Read pids of the child only if required
+                if self.args.hide_empty and len(child.childs) == 0 and child.is_empty(populated):
                     continue
                 cont = TreeContainer(child)
                 container.childs.append(cont)
@@ -248,9 +223,8 @@ class Command(command.Command):
             if not self.args.show_procs:
                 return
 
-            _cgroup.update()
             if self.args.debug:
-                print(_cgroup.pids)
+                print(list(_cgroup.pids))
 
             if self.args.show_autogroup and container == root_container:
                 # Autogroup is effective only when processes don't belong
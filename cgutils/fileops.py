@@ -18,6 +18,14 @@
 
 
 import os
+import errno
+import collections
+import threading
+
+
+# Number of descriptors kept open by a FileCache by default. It lives
+# here so that the command line parser can use it without loading more.
+DEFAULT_MAX_FDS = 512
 
 
 def read(path):
@@ -25,6 +33,28 @@ def read(path):
         return f.read()
 
 
+def read_at(dir_fd, name):
+    """
+    It reads a file of the name relative to the directory descriptor.
+    The kernel looks up only the last component of the path.
+    """
+    fd = os.open(name, os.O_RDONLY | os.O_CLOEXEC, dir_fd=dir_fd)
+    try:
+        chunks = []
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks).decode('utf-8')
+    finally:
+        os.close(fd)
+
+
+def open_dir(path):
+    return os.open(path, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+
+
 def readlines(path):
     with open(path) as f:
         return [c.rstrip('\n') for c in f.readlines()]
@@ -41,3 +71,140 @@ def mkdir(path, mode=0o777):
 
 def rmdir(path):
     os.rmdir(path)
+
+
+class FileCache(object):
+    """
+    It keeps files open and reads them again with pread(2) from offset 0.
+    This saves an open and a close of every sample of a file which is
+    read repeatedly, for example control files sampled by top.
+
+    At most max_fds descriptors are kept open; the least recently read
+    one is closed first. If max_fds is 0, nothing is kept open and every
+    read opens and closes the file. A descriptor is dropped when a read
+    fails with ENODEV or ENOENT, which means the file (or the cgroup)
+    has gone.
+    """
+    DEFAULT_MAX_FDS = DEFAULT_MAX_FDS
+    DEFAULT_BUFSIZE = 4096
+
+    class _Entry(object):
+        __slots__ = ('fd', 'users', 'evicted')
+
+        def __init__(self, fd):
+            self.fd = fd
+            self.users = 0
+            self.evicted = False
+
+    def __init__(self, max_fds=DEFAULT_MAX_FDS):
+        self.max_fds = max_fds
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # A reusable buffer for each thread
+        self._local = threading.local()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def _get_buffer(self):
+        buf = getattr(self._local, 'buf', None)
+        if buf is None:
+            buf = self._local.buf = bytearray(self.DEFAULT_BUFSIZE)
+        return buf
+
+    def _acquire(self, path, dir_fd, name):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                self._entries.move_to_end(path)
+                entry.users += 1
+                return entry
+
+        if dir_fd is not None:
+            fd = os.open(name, os.O_RDONLY | os.O_CLOEXEC, dir_fd=dir_fd)
+        else:
+            fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        with self._lock:
+            if self.max_fds < 1:
+                # Not cached; closed by _release after the read
+                entry = self._Entry(fd)
+                entry.evicted = True
+            elif path in self._entries:
+                # Another thread has opened it meanwhile
+                os.close(fd)
+                entry = self._entries[path]
+                self._entries.move_to_end(path)
+            else:
+                entry = self._entries[path] = self._Entry(fd)
+                # The new entry is the last one, so it is never evicted here
+                while len(self._entries) > self.max_fds:
+                    _, old = self._entries.popitem(last=False)
+                    self._evict(old)
+            entry.users += 1
+            return entry
+
+    def _evict(self, entry):
+        # Called with the lock held. A descriptor in use by another thread
+        # is closed by the thread when it finishes reading.
+        entry.evicted = True
+        if entry.users == 0:
+            os.close(entry.fd)
+
+    def _release(self, entry):
+        with self._lock:
+            entry.users -= 1
+            if entry.evicted and entry.users == 0:
+                os.close(entry.fd)
+
+    def _pread(self, fd):
+        buf = self._get_buffer()
+        while True:
+            if hasattr(os, 'preadv'):
+                n = os.preadv(fd, [buf], 0)
+            else:
+                # Python < 3.7
+                data = os.pread(fd, len(buf), 0)
+                n = len(data)
+                buf[:n] = data
+            if n < len(buf):
+                return str(memoryview(buf)[:n], 'utf-8')
+            # The content may be truncated; retry with a larger buffer
+            buf = self._local.buf = bytearray(len(buf) * 2)
+
+    def read(self, path, dir_fd=None, name=None):
+        """
+        It reads the file of the path. If the file is not open yet and
+        dir_fd is given, the file is opened by the name relative to dir_fd.
+        """
+        entry = self._acquire(path, dir_fd, name)
+        try:
+            return self._pread(entry.fd)
+        except EnvironmentError as e:
+            if e.errno in (errno.ENODEV, errno.ENOENT):
+                self.forget(path)
+            raise
+        finally:
+            self._release(entry)
+
+    def readlines(self, path):
+        lines = self.read(path).split('\n')
+        if lines[-1] == '':
+            lines.pop()
+        return lines
+
+    def forget(self, path):
+        """It closes the descriptor of the path if it is cached."""
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._evict(entry)
+
+    def clear(self):
+        """It closes all cached descriptors."""
+        with self._lock:
+            while self._entries:
+                _, entry = self._entries.popitem()
+                self._evict(entry)
@@ -20,7 +20,6 @@
 import os
 import os.path
 import re
-import multiprocessing
 
 from . import fileops
 
@@ -33,7 +32,7 @@ class CPUInfo():
         line = fileops.readlines('/proc/stat')[0]
         line = line[5:]  # get rid of 'cpu  '
         usages = [int(x) for x in line.split(' ')]
-        return sum(usages) / multiprocessing.cpu_count()
+        return sum(usages) / os.cpu_count()
 
 
 class MemInfo(dict):
@@ -59,3 +58,26 @@ class MemInfo(dict):
     def update(self):
         self._update()
         self._calc()
+
+
+class HugePageInfo():
+    PATH = '/sys/kernel/mm/hugepages'
+
+    def get_sizes(self):
+        """
+        It returns supported sizes of huge pages in the same format as
+        hugetlb control files, e.g., ['2MB', '1GB'].
+        """
+        if not os.path.exists(self.PATH):
+            return []
+        sizes = []
+        for entry in sorted(os.listdir(self.PATH)):
+            # eg. hugepages-2048kB
+            kb = int(entry.replace('hugepages-', '').replace('kB', ''))
+            if kb >= 1024 * 1024:
+                sizes.append('%dGB' % (kb // (1024 * 1024)))
+            elif kb >= 1024:
+                sizes.append('%dMB' % (kb // 1024))
+            else:
+                sizes.append('%dKB' % kb)
+        return sizes
@@ -27,10 +27,16 @@
  *   ret = struct.unpack('Q', os.read(efd, 8))
  *   ...
  *   linux.close(efd)
+ *
+ *   ifd = linux.inotify_init1(linux.IN_NONBLOCK | linux.IN_CLOEXEC)
+ *   wd = linux.inotify_add_watch(ifd, '/sys/fs/cgroup/cpu', linux.IN_CREATE)
+ *   ...
+ *   linux.inotify_rm_watch(ifd, wd)
  */
 #include <Python.h>
 #include <unistd.h>
 #include <sys/eventfd.h>
+#include <sys/inotify.h>
 
 // For older glibc-headers
 #ifndef EFD_SEMAPHORE
@@ -77,11 +83,64 @@ linux_close(PyObject *self, PyObject *args)
         }
 }
 
+static PyObject *
+linux_inotify_init1(PyObject *self, PyObject *args)
+{
+	int ifd, flags;
+
+	if (!PyArg_ParseTuple(args, "i", &flags))
+		return NULL;
+	ifd = inotify_init1(flags);
+	if (ifd == -1) {
+		return PyErr_SetFromErrno(PyExc_OSError);
+	} else {
+		return Py_BuildValue("i", ifd);
+	}
+}
+
+static PyObject *
+linux_inotify_add_watch(PyObject *self, PyObject *args)
+{
+	int ifd, wd;
+	unsigned int mask;
+	const char *path;
+
+	if (!PyArg_ParseTuple(args, "isI", &ifd, &path, &mask))
+		return NULL;
+	wd = inotify_add_watch(ifd, path, mask);
+	if (wd == -1) {
+		return PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+	} else {
+		return Py_BuildValue("i", wd);
+	}
+}
+
+static PyObject *
+linux_inotify_rm_watch(PyObject *self, PyObject *args)
+{
+	int ret, ifd, wd;
+
+	if (!PyArg_ParseTuple(args, "ii", &ifd, &wd))
+		return NULL;
+	ret = inotify_rm_watch(ifd, wd);
+	if (ret == -1) {
+		return PyErr_SetFromErrno(PyExc_OSError);
+	} else {
+		return Py_BuildValue("i", ret);
+	}
+}
+
 static PyMethodDef LinuxSyscalls[] = {
 	{"eventfd", (PyCFunction)linux_eventfd, METH_VARARGS,
 		"Execute eventfd syscall."},
 	{"close", (PyCFunction)linux_close, METH_VARARGS,
 		"Execute close syscall."},
+	{"inotify_init1", (PyCFunction)linux_inotify_init1, METH_VARARGS,
+		"Execute inotify_init1 syscall."},
+	{"inotify_add_watch", (PyCFunction)linux_inotify_add_watch, METH_VARARGS,
+		"Execute inotify_add_watch syscall."},
+	{"inotify_rm_watch", (PyCFunction)linux_inotify_rm_watch, METH_VARARGS,
+		"Execute inotify_rm_watch syscall."},
 	{NULL, NULL, 0, NULL}
 };
 
@@ -109,12 +168,23 @@ static struct PyModuleDef moduledef = {
 };
 #endif
 
+static void
+add_int_constant(PyObject *dict, const char *name, unsigned int value)
+{
+	PyObject *val;
+
+	val = Py_BuildValue("I", value);
+	PyDict_SetItemString(dict, name, val);
+	Py_DECREF(val);
+}
+
 #if PY_MAJOR_VERSION >= 3
-PyObject *
+PyMODINIT_FUNC
+PyInit_linux(void)
 #else
 PyMODINIT_FUNC
-#endif
 initlinux(void)
+#endif
 {
 	PyObject *module, *dict;
 	PyObject *val;
@@ -125,6 +195,10 @@ initlinux(void)
 	module = Py_InitModule("cgutils.linux", LinuxSyscalls);
 #endif
 
+#if PY_MAJOR_VERSION >= 3
+	if (module == NULL)
+		return NULL;
+#endif
 	dict   = PyModule_GetDict(module);
 
 	val = Py_BuildValue("i", EFD_CLOEXEC);
@@ -137,6 +211,18 @@ initlinux(void)
 	PyDict_SetItemString(dict, "EFD_SEMAPHORE", val);
 	Py_DECREF(val);
 
+	add_int_constant(dict, "IN_CLOEXEC", IN_CLOEXEC);
+	add_int_constant(dict, "IN_NONBLOCK", IN_NONBLOCK);
+	add_int_constant(dict, "IN_CREATE", IN_CREATE);
+	add_int_constant(dict, "IN_DELETE", IN_DELETE);
+	add_int_constant(dict, "IN_DELETE_SELF", IN_DELETE_SELF);
+	add_int_constant(dict, "IN_MOVED_FROM", IN_MOVED_FROM);
+	add_int_constant(dict, "IN_MOVED_TO", IN_MOVED_TO);
+	add_int_constant(dict, "IN_ONLYDIR", IN_ONLYDIR);
+	add_int_constant(dict, "IN_ISDIR", IN_ISDIR);
+	add_int_constant(dict, "IN_IGNORED", IN_IGNORED);
+	add_int_constant(dict, "IN_Q_OVERFLOW", IN_Q_OVERFLOW);
+
 #if PY_MAJOR_VERSION >= 3
 	return module;
 #endif
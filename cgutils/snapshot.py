@@ -0,0 +1,286 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# See the COPYING file for license information.
+#
+# Copyright (c) 2013 peo3 <peo314159265@gmail.com>
+
+import array
+import time
+
+from cgutils.cgroup import StatRecord
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# A value which a cgroup doesn't have
+MISSING = StatRecord.MISSING
+
+
+class ArrayBackend(object):
+    """
+    It computes columns of array('q') in pure Python. Integer columns
+    have MISSING for missing values; float columns have none.
+    """
+    name = 'array'
+
+    @staticmethod
+    def from_rows(rows, n_columns):
+        padded = []
+        for row in rows:
+            if len(row) < n_columns:
+                row = row + array.array('q', [MISSING]) * (n_columns - len(row))
+            padded.append(row)
+        if not padded:
+            return [array.array('q') for i in range(n_columns)]
+        return [array.array('q', column) for column in zip(*padded)][:n_columns]
+
+    @staticmethod
+    def missing(n_rows):
+        return array.array('q', [MISSING]) * n_rows
+
+    @staticmethod
+    def take(column, index):
+        return array.array('q', [column[i] if i >= 0 else MISSING for i in index])
+
+    @staticmethod
+    def subtract(a, b):
+        return array.array('q', [x - y if x != MISSING and y != MISSING else MISSING
+                                 for x, y in zip(a, b)])
+
+    @staticmethod
+    def add(a, b):
+        return array.array('q', [y if x == MISSING else x if y == MISSING else x + y
+                                 for x, y in zip(a, b)])
+
+    @staticmethod
+    def scale(column, factor, default=0.0):
+        return array.array('d', [x * factor if x != MISSING else default
+                                 for x in column])
+
+    @staticmethod
+    def scale_rows(column, factors, default=0.0):
+        return array.array('d', [x * factor if x != MISSING else default
+                                 for x, factor in zip(column, factors)])
+
+    @staticmethod
+    def tolist(column, default=0):
+        return [x if x != MISSING else default for x in column]
+
+
+class NumpyBackend(object):
+    """It computes columns of numpy.int64 or numpy.float64 arrays."""
+    name = 'numpy'
+
+    @staticmethod
+    def from_rows(rows, n_columns):
+        padding = array.array('q', [MISSING])
+        rows = [row if len(row) == n_columns else
+                row[:n_columns] + padding * (n_columns - len(row))
+                for row in rows]
+        matrix = numpy.frombuffer(b''.join(rows), dtype=numpy.int64)
+        # Transpose, so each column is a contiguous array
+        matrix = numpy.ascontiguousarray(matrix.reshape(len(rows), n_columns).T)
+        return list(matrix)
+
+    @staticmethod
+    def missing(n_rows):
+        return numpy.full(n_rows, MISSING, dtype=numpy.int64)
+
+    @staticmethod
+    def take(column, index):
+        index = numpy.asarray(index, dtype=numpy.intp)
+        if len(column) == 0:
+            return numpy.full(len(index), MISSING, dtype=numpy.int64)
+        return numpy.where(index >= 0, column[index], MISSING)
+
+    @staticmethod
+    def subtract(a, b):
+        # Overflowed results of MISSING are thrown away by where
+        return numpy.where((a != MISSING) & (b != MISSING), a - b, MISSING)
+
+    @staticmethod
+    def add(a, b):
+        return numpy.where(a == MISSING, b, numpy.where(b == MISSING, a, a + b))
+
+    @staticmethod
+    def scale(column, factor, default=0.0):
+        return numpy.where(column != MISSING, column * float(factor), default)
+
+    @staticmethod
+    def scale_rows(column, factors, default=0.0):
+        factors = numpy.asarray(factors, dtype=numpy.float64)
+        return numpy.where(column != MISSING, column * factors, default)
+
+    @staticmethod
+    def tolist(column, default=0):
+        if column.dtype == numpy.int64:
+            column = numpy.where(column != MISSING, column, default)
+        return column.tolist()
+
+
+def get_backend(name=None):
+    """
+    It returns the backend of the name, 'numpy' or 'array'. NumPy is
+    used by default if available.
+    """
+    if name is None:
+        name = 'array' if numpy is None else 'numpy'
+    if name == 'numpy':
+        if numpy is None:
+            raise ImportError('numpy is not available')
+        return NumpyBackend
+    if name == 'array':
+        return ArrayBackend
+    raise ValueError('No such backend: %s' % name)
+
+
+class Snapshot(object):
+    """
+    It holds a sample of stats of cgroups in columns: a row is a cgroup
+    named by a key and a column is a field of StatRecords, e.g.,
+    ('stat', 'rss') or ('throttle.io_service_bytes', '8:0', 'Read').
+    Deltas and rates of all cgroups are computed column by column by
+    the backend instead of cgroup by cgroup.
+    """
+    def __init__(self, keys, columns, timestamp, backend=None):
+        self.keys = keys
+        self.columns = columns
+        self.time = timestamp
+        # Seconds between the samples of a delta
+        self.elapsed = None
+        self.backend = backend or get_backend()
+        self._positions = None
+
+    @classmethod
+    def from_records(cls, keys, records, timestamp=None, backend=None):
+        """
+        It makes a snapshot of the StatRecords of the keys. Records
+        may have different layouts, e.g., the root cgroup lacks some
+        files of its children; their fields are put in the columns of
+        the same names.
+        """
+        backend = backend or get_backend()
+        if timestamp is None:
+            timestamp = time.time()
+        names = list(records[0].layout.names) if records else []
+        # Positions in names of the fields of each other layout
+        positions = {}
+        for record in records:
+            layout = record.layout
+            if layout is records[0].layout or id(layout) in positions:
+                continue
+            index = dict((name, i) for i, name in enumerate(names))
+            for name in layout.names:
+                if name not in index:
+                    index[name] = len(names)
+                    names.append(name)
+            positions[id(layout)] = [index[name] for name in layout.names]
+
+        rows = []
+        for record in records:
+            if id(record.layout) in positions:
+                row = array.array('q', [MISSING]) * len(names)
+                for i, value in zip(positions[id(record.layout)], record.values):
+                    row[i] = value
+                record = row
+            else:
+                # Fields of the first layout come first in names
+                record = record.values
+            rows.append(record)
+        columns = backend.from_rows(rows, len(names))
+        return cls(keys, dict(zip(names, columns)), timestamp, backend)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def position(self, key):
+        """It returns the row of the key or None."""
+        if self._positions is None:
+            self._positions = dict((key, i) for i, key in enumerate(self.keys))
+        return self._positions.get(key)
+
+    def column(self, name):
+        """It returns the column of the name; all missing if no such column."""
+        if name in self.columns:
+            return self.columns[name]
+        return self.backend.missing(len(self.keys))
+
+    def delta(self, prev):
+        """
+        It returns a snapshot of differences from the prev snapshot.
+        Rows are matched by keys; rows and columns which prev doesn't
+        have are missing.
+        """
+        backend = self.backend
+        if self.keys == prev.keys:
+            index = None
+        else:
+            index = [prev.position(key) for key in self.keys]
+            index = [-1 if i is None else i for i in index]
+
+        columns = {}
+        for name, column in self.columns.items():
+            if name not in prev.columns:
+                columns[name] = backend.missing(len(self.keys))
+                continue
+            prev_column = prev.columns[name]
+            if index is not None:
+                prev_column = backend.take(prev_column, index)
+            columns[name] = backend.subtract(column, prev_column)
+
+        delta = Snapshot(self.keys, columns, self.time, backend)
+        delta.elapsed = self.time - prev.time
+        # Share the row positions
+        delta._positions = self._positions
+        return delta
+
+    __sub__ = delta
+
+    def total(self, names):
+        """It sums up the columns of the names; missing values count as zero."""
+        total = self.backend.missing(len(self.keys))
+        for name in names:
+            total = self.backend.add(total, self.column(name))
+        return total
+
+    def subtract(self, a, b):
+        return self.backend.subtract(a, b)
+
+    def scale(self, column, factor, default=0.0):
+        """It returns a float column of the column multiplied by the factor."""
+        return self.backend.scale(column, factor, default)
+
+    def scale_rows(self, column, factors, default=0.0):
+        """
+        It returns a float column of the column multiplied by the factor
+        of each row, e.g., for rates of rows sampled at different intervals.
+        """
+        return self.backend.scale_rows(column, factors, default)
+
+    def rate(self, name, default=0.0):
+        """It returns per-second values of the column of a delta snapshot."""
+        if not self.elapsed:
+            return self.scale(self.column(name), 0.0, default)
+        return self.scale(self.column(name), 1.0 / self.elapsed, default)
+
+    def tolist(self, column, default=0):
+        """It returns the column as a list with default for missing values."""
+        return self.backend.tolist(column, default)
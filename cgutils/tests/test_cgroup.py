@@ -1,3 +1,5 @@
+import pytest
+
 from cgutils import cgroup
 
 
@@ -20,6 +22,10 @@ def test_SimpleStat():
     input = ''
     assert cgroup.SimpleStat.parse(input) == {}
 
+    input = 'cache 10\nrss 20\nswap 30\n'
+    assert cgroup.SimpleStat.parse(input, frozenset(['rss'])) == {'rss': 20}
+    assert cgroup.SimpleStat.parse(input, frozenset(['rss', 'none'])) == {'rss': 20}
+
 
 def test_BlkioStat():
     input = """8:0 Read 72650752
@@ -73,6 +79,12 @@ Total 201482240
     }
     assert cgroup.BlkioStat.parse(input) == output
 
+    output = {
+        '8:0': {'Read': 72650752, 'Write': 28090368},
+        '9:0': {'Read': 72650752, 'Write': 28090368},
+    }
+    assert cgroup.BlkioStat.parse(input, frozenset(['Read', 'Write'])) == output
+
 
 def test_DevicesStat():
     input = """a *:* rwm
@@ -117,6 +129,10 @@ unevictable=0 N0=0
     }
     assert cgroup.NumaStat.parse(input) == output
 
+    keys = frozenset(['file', 'anon'])
+    assert cgroup.NumaStat.parse(input, keys) == \
+        dict((k, output[k]) for k in keys)
+
 
 def test_PercpuStat():
     # A line may end with a redundant space
@@ -193,3 +209,686 @@ mm_struct             18     18    896   18    4 : tunables    0    0    0 : sla
     # pprint.pprint(cgroup.SlabinfoStat.parse(input))
     # pprint.pprint(expected)
     assert cgroup.SlabinfoStat.parse(input) == expected
+
+
+def _make_hierarchy(root, dirs):
+    """Build a fake memory hierarchy under root and return its status"""
+    import os
+    mount_point = os.path.join(root, 'memory')
+    with open(os.path.join(root, 'cgroups'), 'w') as f:
+        f.write('#subsys_name\thierarchy\tnum_cgroups\tenabled\n')
+        f.write('memory\t1\t%d\t1\n' % (len(dirs) + 1))
+    with open(os.path.join(root, 'mounts'), 'w') as f:
+        f.write('cgroup %s cgroup rw,relatime,memory 0 0\n' % mount_point)
+    for d in [''] + dirs:
+        path = os.path.join(mount_point, d)
+        if d:
+            os.mkdir(path)
+        else:
+            os.mkdir(mount_point)
+        for name in ['cgroup.procs', 'tasks']:
+            open(os.path.join(path, name), 'w').close()
+        with open(os.path.join(path, 'memory.usage_in_bytes'), 'w') as f:
+            f.write('4096\n')
+    return cgroup.SubsystemStatus(os.path.join(root, 'cgroups'),
+                                  os.path.join(root, 'mounts'))
+
+
+def test_SubsystemStatus_shared():
+    assert cgroup.get_subsystem_status() is cgroup.get_subsystem_status()
+
+
+def test_scan_cgroups():
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        status = _make_hierarchy(root, ['a', 'a/b', 'c'])
+        assert status.get_enabled() == ['memory']
+
+        root_cgroup = cgroup.scan_cgroups('memory', status=status)
+        names = []
+        cgroup.walk_cgroups(root_cgroup, lambda cg, store: store.append(cg.fullname), names)
+        assert sorted(names) == ['/', 'a', 'a/b', 'c']
+        for child in root_cgroup.childs:
+            assert child.parent is root_cgroup
+            assert child.status is status
+    finally:
+        shutil.rmtree(root)
+
+
+def test_CGroup_lazy_pids():
+    import os
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        status = _make_hierarchy(root, ['a'])
+        procs = os.path.join(root, 'memory', 'a', 'cgroup.procs')
+        os.remove(procs)
+
+        # Scanning must not touch cgroup.procs
+        root_cgroup = cgroup.scan_cgroups('memory', status=status)
+        child = root_cgroup.childs[0]
+
+        with open(procs, 'w') as f:
+            f.write('1\n2\n')
+        assert list(child.pids) == [1, 2]
+        assert child.n_procs == 2
+
+        with open(procs, 'w') as f:
+            f.write('3\n')
+        assert list(child.pids) == [1, 2]
+        child.update()
+        assert list(child.pids) == [3]
+
+        # update() reads immediately, so a removed group is noticed
+        os.remove(procs)
+        try:
+            child.update()
+        except IOError:
+            pass
+        else:
+            assert False
+    finally:
+        shutil.rmtree(root)
+
+
+def test_iter_cgroups():
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        dirs = ['a', 'a/b', 'a/b/c', 'd']
+        status = _make_hierarchy(root, dirs)
+
+        names = [cg.fullname for cg in cgroup.iter_cgroups('memory', status=status)]
+        walked = []
+        root_cgroup = cgroup.scan_cgroups('memory', status=status)
+        cgroup.walk_cgroups(root_cgroup, lambda cg, store: store.append(cg.fullname), walked)
+        assert names == walked
+        assert sorted(names) == ['/'] + dirs
+        assert names.index('a') < names.index('a/b') < names.index('a/b/c')
+    finally:
+        shutil.rmtree(root)
+
+
+def test_scan_cgroups_deep():
+    import os
+    import sys
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        status = _make_hierarchy(root, [])
+        # Deeper than the recursion limit we set below
+        path = os.path.join(root, 'memory')
+        for i in range(150):
+            path = os.path.join(path, 'd')
+            os.mkdir(path)
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(100)
+        try:
+            n = len(list(cgroup.iter_cgroups('memory', status=status)))
+        finally:
+            sys.setrecursionlimit(limit)
+        assert n == 151
+    finally:
+        shutil.rmtree(root)
+
+
+def test_scan_cgroups_workers():
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        dirs = ['a', 'b', 'c']
+        for d in ['a', 'b', 'c']:
+            dirs.extend(['%s/%d' % (d, i) for i in range(10)])
+        status = _make_hierarchy(root, dirs)
+
+        def names(root_cgroup):
+            ret = []
+            cgroup.walk_cgroups(root_cgroup, lambda cg, store: store.append(cg.fullname), ret)
+            return ret
+
+        expected = names(cgroup.scan_cgroups('memory', status=status))
+        assert names(cgroup.scan_cgroups('memory', status=status, workers=4)) == expected
+    finally:
+        shutil.rmtree(root)
+
+
+def test_map_cgroups():
+    items = list(range(100))
+    assert cgroup.map_cgroups(lambda x: x * 2, items, workers=8) == [x * 2 for x in items]
+    assert cgroup.map_cgroups(lambda x: x * 2, items) == [x * 2 for x in items]
+
+
+def test_CGroup_read_many():
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        status = _make_hierarchy(root, ['a'])
+        child = cgroup.scan_cgroups('memory', status=status).childs[0]
+        contents = child.read_many(['usage_in_bytes', 'cgroup.procs', 'stat'])
+        assert contents == {'usage_in_bytes': '4096\n', 'cgroup.procs': ''}
+        assert child.get_stats() == {'usage_in_bytes': 4096, 'cgroup.procs': [], 'tasks': []}
+    finally:
+        shutil.rmtree(root)
+
+
+def test_HierarchySchema():
+    import os
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        status = _make_hierarchy(root, ['a', 'b'])
+        # A file which doesn't appear in the root
+        for d in ['a', 'b']:
+            with open(os.path.join(root, 'memory', d, 'memory.stat'), 'w') as f:
+                f.write('rss 1\n')
+
+        root_cgroup = cgroup.scan_cgroups('memory', status=status)
+        schema = status.get_schema(root_cgroup.subsystem)
+        assert 'memsw.usage_in_bytes' not in schema.stats
+        assert sorted(schema.stats) == ['cgroup.procs', 'stat', 'tasks', 'usage_in_bytes']
+        a, b = root_cgroup.childs
+        assert a.stats is b.stats
+        assert a.get_stats()['stat'] == {'rss': 1}
+
+        a.apply_filters(['usage_in_bytes', 'memsw.usage_in_bytes'])
+        b.apply_filters(['usage_in_bytes', 'memsw.usage_in_bytes'])
+        assert a.stats is b.stats
+        assert a.get_stats() == {'usage_in_bytes': 4096}
+        try:
+            a.apply_filters(['no_such_file'])
+        except cgroup.NoSuchControlFileError:
+            pass
+        else:
+            assert False
+    finally:
+        shutil.rmtree(root)
+
+
+def test_HierarchySchema_unsupported():
+    import errno
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        status = _make_hierarchy(root, ['a'])
+        child = cgroup.scan_cgroups('memory', status=status).childs[0]
+        schema = child.schema
+
+        schema.mark_unsupported('usage_in_bytes', errno.EOPNOTSUPP)
+        assert schema.get_unsupported() == ['memory.usage_in_bytes']
+        assert 'usage_in_bytes' not in child.get_stats()
+
+        # Retry after the interval
+        schema.retry_interval = 0
+        assert child.get_stats()['usage_in_bytes'] == 4096
+        assert schema.get_unsupported() == []
+
+        schema.retry_interval = None
+        schema.mark_unsupported('usage_in_bytes', errno.EOPNOTSUPP)
+        assert 'usage_in_bytes' not in child.get_stats()
+        schema.reset_unsupported()
+        assert 'usage_in_bytes' in child.get_stats()
+    finally:
+        shutil.rmtree(root)
+
+
+def test_HierarchySchema_eio_per_cgroup():
+    import errno
+    import os
+    import shutil
+    import tempfile
+    from cgutils import fileops
+    root = tempfile.mkdtemp()
+    read_at = fileops.read_at
+    try:
+        status = _make_hierarchy(root, ['a', 'b'])
+        root_cgroup = cgroup.scan_cgroups('memory', status=status)
+        a, b = root_cgroup.childs
+        if a.fullname != 'a':
+            a, b = b, a
+
+        # e.g., memory.kmem.slabinfo of a cgroup without kmem limit
+        def fail_in_a(dir_fd, name):
+            if os.path.basename(os.readlink('/proc/self/fd/%d' % dir_fd)) == 'a':
+                raise IOError(errno.EIO, os.strerror(errno.EIO))
+            return read_at(dir_fd, name)
+        fileops.read_at = fail_in_a
+        assert 'usage_in_bytes' not in a.get_stats()
+        assert a.schema.get_unsupported() == []
+        assert b.get_stats()['usage_in_bytes'] == 4096
+    finally:
+        fileops.read_at = read_at
+        shutil.rmtree(root)
+
+
+def test_CGroupRegistry():
+    import os
+    import shutil
+    import tempfile
+    root = os.path.realpath(tempfile.mkdtemp())
+    try:
+        _make_hierarchy(root, ['a', 'a/b', 'a/b/c'])
+        # A hierarchy whose mount point has memory's one as a prefix
+        os.mkdir(os.path.join(root, 'memory2'))
+        with open(os.path.join(root, 'mounts'), 'a') as f:
+            f.write('cgroup %s/memory2 cgroup rw,name=foo 0 0\n' % root)
+        status = cgroup.SubsystemStatus(os.path.join(root, 'cgroups'),
+                                        os.path.join(root, 'mounts'))
+        registry = status.get_registry()
+        assert registry.lookup(root + '/memory2') == ('name=foo', root + '/memory2')
+        assert registry.lookup(root + '/memory/a/b') == ('memory', root + '/memory')
+        try:
+            registry.lookup(root + '/mem')
+        except Exception:
+            pass
+        else:
+            assert False
+
+        c = cgroup.get_cgroup(root + '/memory/a/b/c', status)
+        assert c.fullname == 'a/b/c'
+        b = cgroup.get_cgroup(root + '/memory/a/b/', status)
+        assert c.parent is b
+        assert b.parent.parent is cgroup.get_cgroup(root + '/memory', status)
+        assert b.parent.parent.depth == 0
+
+        registry.forget(root + '/memory/a/b')
+        assert cgroup.get_cgroup(root + '/memory/a/b', status) is not b
+        assert cgroup.get_cgroup(root + '/memory/a', status) is b.parent
+
+        # Processes are read again on a later lookup
+        procs = root + '/memory/a/cgroup.procs'
+        with open(procs, 'w') as f:
+            f.write('1\n')
+        assert list(cgroup.get_cgroup(root + '/memory/a', status).pids) == [1]
+        with open(procs, 'w') as f:
+            f.write('2\n')
+        assert list(cgroup.get_cgroup(root + '/memory/a', status).pids) == [2]
+
+        # The least recently resolved ones are dropped
+        registry.forget(root + '/memory')
+        registry.max_cgroups = 2
+        a = cgroup.get_cgroup(root + '/memory/a', status)
+        cgroup.get_cgroup(root + '/memory/a/b/c', status)
+        assert len(registry._cgroups) == 2
+        assert cgroup.get_cgroup(root + '/memory/a', status) is not a
+
+        status.update()
+        assert status.get_registry() is not registry
+    finally:
+        shutil.rmtree(root)
+
+
+def test_CGroup_compact():
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        status = _make_hierarchy(root, ['a', 'a/b'])
+        root_cgroup = cgroup.scan_cgroups('memory', status=status)
+        a = root_cgroup.childs[0]
+        b = a.childs[0]
+        assert not hasattr(b, '__dict__')
+        assert b.childs == ()
+        assert (b.path, b.fullname, b.name, b.depth) == ('/a/b', 'a/b', 'b', 2)
+        assert (root_cgroup.path, root_cgroup.fullname) == ('/', '/')
+        assert b.pids.typecode == 'i'
+        assert b.stats is a.stats
+    finally:
+        shutil.rmtree(root)
+
+
+def test_StatRecord():
+    layout = cgroup.StatLayout()
+    prev = layout.make_record({'usage_in_bytes': 10, 'stat': {'rss': 5, 'cache': 3},
+                               'tasks': [1, 2]})
+    cur = layout.make_record({'usage_in_bytes': 15, 'stat': {'rss': 9},
+                              'throttle.io_service_bytes': {'8:0': {'Read': 1}}})
+    assert layout.names == [('usage_in_bytes',), ('stat', 'rss'), ('stat', 'cache'),
+                            ('throttle.io_service_bytes', '8:0', 'Read')]
+    assert cur.layout is prev.layout
+    assert cur['stat', 'rss'] == 9
+    assert cur['usage_in_bytes'] == 15
+    assert ('stat', 'cache') not in cur
+    assert cur.get(('stat', 'cache'), 0) == 0
+    assert prev.others == {('tasks',): [1, 2]}
+    assert prev.to_dict() == {'usage_in_bytes': 10, 'stat': {'rss': 5, 'cache': 3},
+                              'tasks': [1, 2]}
+
+    delta = cur - prev
+    assert delta.items() == [(('usage_in_bytes',), 5), (('stat', 'rss'), 4)]
+    assert delta.values.typecode == 'q'
+
+
+def test_IoStat():
+    input = """8:16 rbytes=1459200 wbytes=314773504 rios=192 wios=353 dbytes=0 dios=0
+8:0 rbytes=90430464 wbytes=299008000 rios=8950 wios=1252 dbytes=50331648 dios=3021
+"""
+    assert cgroup.IoStat.parse(input) == {
+        '8:16': {'rbytes': 1459200, 'wbytes': 314773504, 'rios': 192, 'wios': 353,
+                 'dbytes': 0, 'dios': 0},
+        '8:0': {'rbytes': 90430464, 'wbytes': 299008000, 'rios': 8950, 'wios': 1252,
+                'dbytes': 50331648, 'dios': 3021},
+    }
+    assert cgroup.IoStat.parse(input, frozenset(['rbytes'])) == \
+        {'8:16': {'rbytes': 1459200}, '8:0': {'rbytes': 90430464}}
+    assert cgroup.IoStat.parse('') == {}
+
+
+def test_scan_cgroups_unified():
+    import os
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        mount_point = os.path.join(root, 'unified')
+        # No /proc/cgroups on kernels without cgroup v1
+        with open(os.path.join(root, 'mounts'), 'w') as f:
+            f.write('cgroup2 %s cgroup2 rw,nosuid,nodev,noexec,relatime 0 0\n' % mount_point)
+        files = {
+            'cgroup.procs': '1\n',
+            'cgroup.events': 'populated 1\nfrozen 0\n',
+            'cpu.stat': 'usage_usec 300\nuser_usec 100\nsystem_usec 200\n',
+            'memory.current': '8192\n',
+            'memory.stat': 'anon 4096\nfile 4096\n',
+            'io.stat': '8:0 rbytes=512 wbytes=1024 rios=1 wios=2 dbytes=0 dios=0\n',
+            'pids.current': '1\n',
+            'memory.min': '0\n',
+            'memory.low': 'max\n',
+        }
+        for d in ['', 'a.slice']:
+            os.mkdir(os.path.join(mount_point, d))
+            for name, content in files.items():
+                with open(os.path.join(mount_point, d, name), 'w') as f:
+                    f.write(content)
+        status = cgroup.SubsystemStatus(os.path.join(root, 'cgroups'),
+                                        os.path.join(root, 'mounts'))
+        assert status.get_enabled() == ['unified']
+
+        root_cgroup = cgroup.scan_cgroups('unified', ['cpu.stat:user_usec', 'io.stat:rbytes',
+                                                      'memory.current'], status=status)
+        child = root_cgroup.childs[0]
+        assert child.fullname == 'a.slice'
+        assert child.get_stats() == {
+            'cpu.stat': {'user_usec': 100},
+            'io.stat': {'8:0': {'rbytes': 512}},
+            'memory.current': 8192,
+        }
+        assert cgroup.get_cgroup(os.path.join(mount_point, 'a.slice'), status).n_procs == 1
+
+        full = cgroup.scan_cgroups('unified', status=status).childs[0].get_stats()
+        assert full['cgroup.events'] == {'populated': 1, 'frozen': 0}
+        assert full['pids.current'] == 1
+        assert full['memory.stat'] == {'anon': 4096, 'file': 4096}
+
+        configs = cgroup.scan_cgroups('unified', status=status).childs[0].get_configs()
+        assert configs['memory.min'] == '0'
+        assert configs['memory.low'] == 'max'
+    finally:
+        shutil.rmtree(root)
+
+
+def test_PopulatedIndex():
+    import os
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        mount_point = os.path.join(root, 'unified')
+        with open(os.path.join(root, 'mounts'), 'w') as f:
+            f.write('cgroup2 %s cgroup2 rw 0 0\n' % mount_point)
+        os.mkdir(mount_point)
+        open(os.path.join(mount_point, 'cgroup.procs'), 'w').close()
+        for d, populated in [('a', 0), ('b', 1)]:
+            os.mkdir(os.path.join(mount_point, d))
+            with open(os.path.join(mount_point, d, 'cgroup.events'), 'w') as f:
+                f.write('populated %d\nfrozen 0\n' % populated)
+            open(os.path.join(mount_point, d, 'cgroup.procs'), 'w').close()
+        status = cgroup.SubsystemStatus(os.path.join(root, 'cgroups'),
+                                        os.path.join(root, 'mounts'))
+        root_cgroup = cgroup.scan_cgroups('unified', status=status)
+        a, b = sorted(root_cgroup.childs, key=lambda cg: cg.name)
+
+        # The root of cgroup2 has no cgroup.events
+        index = cgroup.PopulatedIndex()
+        assert index.is_populated(root_cgroup) is None
+        assert index.is_populated(a) is False
+        assert index.is_populated(b) is True
+        assert len(index) == 0
+
+        # pids of an unpopulated group are never read
+        os.remove(os.path.join(a.fullpath, 'cgroup.procs'))
+        assert a.is_empty(index)
+        assert b.is_empty(index)
+
+        index = cgroup.PopulatedIndex(watch=True, max_watches=1)
+        assert index.is_populated(a) is False
+        assert index.is_populated(b) is True
+        assert len(index) == 1
+        index.prune(set([b.fullpath]))
+        assert len(index) == 0
+        index.close()
+
+        # cgroup v1 has no cgroup.events
+        os.mkdir(os.path.join(root, 'v1'))
+        status = _make_hierarchy(os.path.join(root, 'v1'), ['a'])
+        child = cgroup.scan_cgroups('memory', status=status).childs[0]
+        assert cgroup.PopulatedIndex().is_populated(child) is None
+        assert child.is_empty(cgroup.PopulatedIndex())
+    finally:
+        shutil.rmtree(root)
+
+
+def test_HierarchyWatcher():
+    import os
+    import shutil
+    import tempfile
+    try:
+        watcher = cgroup.HierarchyWatcher()
+    except ImportError:
+        pytest.skip('The extension cgutils.linux is not built')
+    root = tempfile.mkdtemp()
+    try:
+        status = _make_hierarchy(root, ['a'])
+        mount_point = status.get_path('memory')
+        root_cgroup = cgroup.scan_cgroups('memory', status=status,
+                                          visit=lambda cg: watcher.watch(cg.fullpath))
+        assert len(watcher) == 2
+        assert watcher.read_events() == []
+
+        # Control files are ignored
+        os.mkdir(os.path.join(mount_point, 'a', 'b'))
+        open(os.path.join(mount_point, 'a', 'b', 'tasks'), 'w').close()
+        os.rename(os.path.join(mount_point, 'a'), os.path.join(mount_point, 'c'))
+        assert watcher.read_events() == [
+            (watcher.CREATED, os.path.join(mount_point, 'a', 'b')),
+            (watcher.REMOVED, os.path.join(mount_point, 'a')),
+            (watcher.CREATED, os.path.join(mount_point, 'c')),
+        ]
+        watcher.unwatch(os.path.join(mount_point, 'a'))
+        assert len(watcher) == 1
+
+        c = cgroup.scan_subtree(root_cgroup, os.path.join(mount_point, 'c'),
+                                visit=lambda cg: watcher.watch(cg.fullpath))
+        assert [cg.name for cg in c.childs] == ['b']
+        assert c in root_cgroup.childs
+        assert len(watcher) == 3
+
+        shutil.rmtree(os.path.join(mount_point, 'c', 'b'))
+        assert watcher.read_events() == [
+            (watcher.REMOVED, os.path.join(mount_point, 'c', 'b')),
+        ]
+        # The kernel drops the watch of a removed directory
+        assert len(watcher) == 2
+    finally:
+        watcher.close()
+        shutil.rmtree(root)
+
+
+def test_ReleaseListener():
+    import os
+    import shutil
+    import socket
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(root, 'mounts'), 'w') as f:
+            f.write('cgroup /cgroup/cpu cgroup rw,cpuacct,cpu,'
+                    'release_agent=/usr/bin/cgutil-release-agent 0 0\n')
+            f.write('cgroup /cgroup/memory cgroup rw,memory 0 0\n')
+        with open(os.path.join(root, 'cgroups'), 'w') as f:
+            for name in ['cpu', 'cpuacct', 'memory']:
+                f.write('%s\t1\t1\t1\n' % name)
+        status = cgroup.SubsystemStatus(os.path.join(root, 'cgroups'),
+                                        os.path.join(root, 'mounts'))
+        # Shared by subsystems mounted together
+        assert status.get_release_agent('cpu') == '/usr/bin/cgutil-release-agent'
+        assert status.get_release_agent('cpuacct') == '/usr/bin/cgutil-release-agent'
+        assert status.get_release_agent('memory') is None
+
+        socket_dir = os.path.join(root, 'release')
+        # Nobody listens
+        cgroup.notify_release('/a', socket_dir)
+
+        listener = cgroup.ReleaseListener(socket_dir)
+        assert listener.read_events() == []
+        # A socket of a dead listener
+        stale = os.path.join(socket_dir, '0.sock')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(stale)
+        sock.close()
+
+        cgroup.notify_release('/a/b', socket_dir)
+        cgroup.notify_release('/c', socket_dir)
+        assert listener.read_events() == ['/a/b', '/c']
+        assert not os.path.exists(stale)
+        listener.close()
+        assert os.listdir(socket_dir) == []
+    finally:
+        shutil.rmtree(root)
+
+
+def test_scan_cgroups_vanished():
+    import errno
+    import os
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        status = _make_hierarchy(root, ['a', 'a/b', 'a/b/c', 'd'])
+
+        def remove_b(cg):
+            if cg.name == 'b':
+                shutil.rmtree(cg.fullpath)
+        root_cgroup = cgroup.scan_cgroups('memory', status=status, visit=remove_b)
+        # Only the subtree of b is dropped
+        names = []
+        cgroup.walk_cgroups(root_cgroup, lambda cg, store: store.append(cg.fullname), names)
+        assert names == ['/', 'a', 'd']
+        assert root_cgroup.schema.vanished == 1
+
+        d = root_cgroup.childs[1]
+        shutil.rmtree(d.fullpath)
+        for read in [d.get_stats, d.update]:
+            try:
+                read()
+                assert False
+            except cgroup.VanishedCGroupError as e:
+                # Still an IOError of the errno
+                assert isinstance(e, IOError)
+                assert e.errno == errno.ENOENT
+        assert root_cgroup.schema.vanished == 3
+
+        assert cgroup.scan_subtree(root_cgroup, os.path.join(root, 'memory', 'd')) is None
+
+        # Removed in the middle of a batch of reads
+        from cgutils import fileops
+        read_at = fileops.read_at
+        a = root_cgroup.childs[0]
+
+        def remove_a(dir_fd, name):
+            shutil.rmtree(a.fullpath)
+            fileops.read_at = read_at
+            return read_at(dir_fd, name)
+        fileops.read_at = remove_a
+        try:
+            a.get_stats()
+            assert False
+        except cgroup.VanishedCGroupError as e:
+            assert e.errno == errno.ENOENT
+        finally:
+            fileops.read_at = read_at
+    finally:
+        shutil.rmtree(root)
+
+
+def test_scan_cgroups_churn():
+    import os
+    import random
+    import shutil
+    import tempfile
+    import threading
+    root = tempfile.mkdtemp()
+    try:
+        dirs = []
+        for i in range(50):
+            dirs.append('p%d' % i)
+            for j in range(10):
+                dirs.append('p%d/c%d' % (i, j))
+        status = _make_hierarchy(root, dirs)
+        mount_point = status.get_path('memory')
+        victims = ['p%d' % i for i in range(0, 50, 2)]
+        random.shuffle(victims)
+
+        # Remove subtrees while scanning them
+        def churn():
+            for victim in victims:
+                shutil.rmtree(os.path.join(mount_point, victim))
+        thread = threading.Thread(target=churn)
+        thread.start()
+        try:
+            for workers in [None, 4, None, 4]:
+                names = set()
+                root_cgroup = cgroup.scan_cgroups('memory', status=status, workers=workers)
+                cgroup.walk_cgroups(root_cgroup, lambda cg, store: store.add(cg.fullname), names)
+                # Untouched subtrees are all found
+                for i in range(1, 50, 2):
+                    assert 'p%d/c9' % i in names
+        finally:
+            thread.join()
+        names = set()
+        cgroup.walk_cgroups(cgroup.scan_cgroups('memory', status=status),
+                            lambda cg, store: store.add(cg.fullname), names)
+        assert len(names) == 1 + 25 * 11
+    finally:
+        shutil.rmtree(root)
+
+
+def test_Budget():
+    budget = cgroup.Budget()
+    assert not budget.is_limited()
+    assert all(budget.take() for i in range(100))
+
+    budget = cgroup.Budget(max_reads=5)
+    assert budget.is_limited()
+    assert budget.take(3)
+    # Smaller ones may fit in the rest
+    assert not budget.take(3)
+    assert budget.take(2)
+    assert not budget.take()
+    assert budget.exhausted
+
+    # Too large for the whole budget, but the first one
+    budget = cgroup.Budget(max_reads=2)
+    assert budget.take(3)
+    assert not budget.take()
+
+    budget = cgroup.Budget(max_seconds=0.0)
+    assert not budget.take()
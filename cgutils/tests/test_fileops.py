@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+
+from cgutils import fileops
+
+
+def _write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def test_FileCache_read():
+    root = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root, 'memory.stat')
+        _write(path, 'rss 1\n')
+        cache = fileops.FileCache()
+        assert cache.read(path) == 'rss 1\n'
+        assert path in cache
+
+        # Re-read from the same descriptor
+        _write(path, 'rss 22\n')
+        assert cache.read(path) == 'rss 22\n'
+        assert cache.readlines(path) == ['rss 22']
+
+        # Larger than the initial buffer
+        content = 'x' * (fileops.FileCache.DEFAULT_BUFSIZE * 3) + '\n'
+        _write(path, content)
+        assert cache.read(path) == content
+        cache.clear()
+        assert len(cache) == 0
+    finally:
+        shutil.rmtree(root)
+
+
+def test_FileCache_lru():
+    root = tempfile.mkdtemp()
+    try:
+        paths = [os.path.join(root, str(i)) for i in range(3)]
+        for path in paths:
+            _write(path, path)
+        cache = fileops.FileCache(max_fds=2)
+        cache.read(paths[0])
+        cache.read(paths[1])
+        cache.read(paths[0])
+        cache.read(paths[2])
+        assert len(cache) == 2
+        assert paths[0] in cache
+        assert paths[1] not in cache
+        assert paths[2] in cache
+        cache.forget(paths[0])
+        assert paths[0] not in cache
+    finally:
+        shutil.rmtree(root)
+
+
+def test_FileCache_no_caching():
+    root = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root, 'memory.stat')
+        _write(path, 'rss 1\n')
+        cache = fileops.FileCache(max_fds=0)
+        n_fds = len(os.listdir('/proc/self/fd'))
+        assert cache.read(path) == 'rss 1\n'
+        _write(path, 'rss 22\n')
+        assert cache.read(path) == 'rss 22\n'
+        assert len(cache) == 0
+        assert len(os.listdir('/proc/self/fd')) == n_fds
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,77 @@
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+# Generous enough for slow CI machines; importing used to take
+# much longer when subsystem defaults were read at import time.
+IMPORT_TIME_BUDGET_USEC = 100 * 1000
+
+
+def _run(code, *options):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT
+    return subprocess.run([sys.executable] + list(options) + ['-c', code],
+                          env=env, check=True, universal_newlines=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def test_import_cgroup_time():
+    # Import once to write bytecode caches if allowed
+    _run('import cgutils.cgroup')
+    output = _run('import cgutils.cgroup', '-X', 'importtime').stderr
+    for line in output.split('\n'):
+        # import time: self [us] | cumulative | imported package
+        m = re.match(r'import time:\s+\d+ \|\s+(\d+) \| cgutils\.cgroup$', line)
+        if m:
+            assert int(m.group(1)) < IMPORT_TIME_BUDGET_USEC, line
+            break
+    else:
+        assert False, output
+
+
+def test_import_cgroup_no_file_access():
+    if sys.version_info < (3, 8):
+        pytest.skip('sys.addaudithook is not available')
+    code = """
+import sys
+opened = []
+def hook(event, args):
+    if event == 'open' and isinstance(args[0], str):
+        if args[0].startswith('/proc') or args[0].startswith('/sys'):
+            opened.append(args[0])
+    elif event == 'os.listdir' and str(args[0]).startswith('/sys'):
+        opened.append(args[0])
+sys.addaudithook(hook)
+import cgutils.cgroup
+print(opened)
+"""
+    assert _run(code).stdout.strip() == '[]'
+
+
+def test_command_specs():
+    import cgutils.commands
+    assert sorted(cgutils.commands.SPECS) == sorted(cgutils.commands.__all__)
+
+
+def test_import_only_chosen_command():
+    code = """
+import sys
+import argparse
+import cgutils.commands
+parser = argparse.ArgumentParser()
+subparsers = parser.add_subparsers(dest='subcmd_name')
+for spec in cgutils.commands.SPECS.values():
+    spec.add_subparser(subparsers)
+args = parser.parse_args(['mkdir', '-p', '/foo'])
+assert args.parents and args.target_dir == '/foo'
+cgutils.commands.SPECS['mkdir'].load()
+print(sorted(m for m in sys.modules
+             if m.startswith('cgutils.commands.') or m == 'curses'))
+"""
+    assert _run(code).stdout.strip() == "['cgutils.commands.mkdir']"
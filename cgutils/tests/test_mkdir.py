@@ -0,0 +1,77 @@
+import argparse
+import os
+import shutil
+import tempfile
+
+from cgutils import cgroup
+from cgutils import fileops
+from cgutils.commands import mkdir
+from cgutils.commands import rmdir
+
+
+class _MountWatcher(object):
+    def changed(self):
+        return False
+
+
+def _make_hybrid(root):
+    """Build fake memory and cpu hierarchies of v1 and a cgroup2 mount"""
+    names = ['memory', 'cpu']
+    with open(os.path.join(root, 'cgroups'), 'w') as f:
+        f.write('#subsys_name\thierarchy\tnum_cgroups\tenabled\n')
+        for i, name in enumerate(names):
+            f.write('%s\t%d\t1\t1\n' % (name, i + 1))
+    with open(os.path.join(root, 'mounts'), 'w') as f:
+        for name in names:
+            f.write('cgroup %s/%s cgroup rw,%s 0 0\n' % (root, name, name))
+        f.write('cgroup2 %s/unified cgroup2 rw 0 0\n' % root)
+    for name in names + ['unified']:
+        os.mkdir(os.path.join(root, name))
+        open(os.path.join(root, name, 'cgroup.procs'), 'w').close()
+    return cgroup.SubsystemStatus(os.path.join(root, 'cgroups'),
+                                  os.path.join(root, 'mounts'))
+
+
+def _mkdir(path, mode=0o777):
+    # The kernel creates control files of a new cgroup
+    os.mkdir(path, mode)
+    open(os.path.join(path, 'cgroup.procs'), 'w').close()
+
+
+def _run(module, **args):
+    command = module.Command.__new__(module.Command)
+    command.args = argparse.Namespace(debug=False, **args)
+    command.run()
+
+
+def test_mkdir_rmdir_apply_all():
+    root = os.path.realpath(tempfile.mkdtemp())
+    saved = cgroup._subsystem_status, cgroup._mount_watcher
+    saved_ops = fileops.mkdir, fileops.rmdir
+    fileops.mkdir, fileops.rmdir = _mkdir, shutil.rmtree
+    try:
+        cgroup._subsystem_status = _make_hybrid(root)
+        cgroup._mount_watcher = _MountWatcher()
+
+        _run(mkdir, target_dir=os.path.join(root, 'memory', 'foo'),
+             parents=False, apply_all=True)
+        # Only in the v1 hierarchies
+        assert os.path.isdir(os.path.join(root, 'memory', 'foo'))
+        assert os.path.isdir(os.path.join(root, 'cpu', 'foo'))
+        assert not os.path.exists(os.path.join(root, 'unified', 'foo'))
+
+        _run(rmdir, target_dir=os.path.join(root, 'cpu', 'foo'), apply_all=True)
+        assert not os.path.exists(os.path.join(root, 'memory', 'foo'))
+        assert not os.path.exists(os.path.join(root, 'cpu', 'foo'))
+
+        # A cgroup of cgroup2 is the only one of its hierarchy
+        _run(mkdir, target_dir=os.path.join(root, 'unified', 'bar'),
+             parents=False, apply_all=True)
+        assert os.path.isdir(os.path.join(root, 'unified', 'bar'))
+        assert not os.path.exists(os.path.join(root, 'memory', 'bar'))
+        _run(rmdir, target_dir=os.path.join(root, 'unified', 'bar'), apply_all=True)
+        assert not os.path.exists(os.path.join(root, 'unified', 'bar'))
+    finally:
+        cgroup._subsystem_status, cgroup._mount_watcher = saved
+        fileops.mkdir, fileops.rmdir = saved_ops
+        shutil.rmtree(root)
@@ -0,0 +1,69 @@
+from cgutils import cgroup
+from cgutils import snapshot
+
+
+def _backends():
+    backends = [snapshot.get_backend('array')]
+    if snapshot.numpy is not None:
+        backends.append(snapshot.get_backend('numpy'))
+    return backends
+
+
+def _make_snapshots(backend):
+    layout = cgroup.StatLayout()
+    prev = snapshot.Snapshot.from_records(['a', 'b'], [
+        layout.make_record({'usage': 10, 'io': {'8:0': {'Read': 1}}}),
+        layout.make_record({'usage': 20}),
+    ], 100.0, backend)
+    cur = snapshot.Snapshot.from_records(['c', 'b', 'a'], [
+        layout.make_record({'usage': 5}),
+        layout.make_record({'usage': 26, 'io': {'8:0': {'Read': 3}, '8:16': {'Read': 4}}}),
+        layout.make_record({'usage': 30, 'io': {'8:0': {'Read': 7}}}),
+    ], 102.0, backend)
+    return prev, cur
+
+
+def test_Snapshot_delta():
+    for backend in _backends():
+        prev, cur = _make_snapshots(backend)
+        delta = cur - prev
+        assert delta.elapsed == 2.0
+        assert delta.position('a') == 2
+        assert delta.tolist(delta.column(('usage',))) == [0, 6, 20]
+        assert delta.tolist(delta.column(('usage',)), None) == [None, 6, 20]
+        assert delta.tolist(delta.column(('io', '8:0', 'Read'))) == [0, 0, 6]
+        # A column which prev doesn't have
+        assert delta.tolist(delta.column(('io', '8:16', 'Read')), None) == [None] * 3
+        assert delta.tolist(delta.column(('none',)), None) == [None] * 3
+
+
+def test_Snapshot_total_rate():
+    for backend in _backends():
+        prev, cur = _make_snapshots(backend)
+        names = [n for n in cur.columns if n[0] == 'io']
+        assert cur.tolist(cur.total(names)) == [0, 7, 7]
+        delta = cur - prev
+        assert delta.tolist(delta.rate(('usage',))) == [0.0, 3.0, 10.0]
+        # Rows sampled at different intervals
+        column = delta.scale_rows(delta.column(('usage',)), [1.0, 0.5, 0.1])
+        assert delta.tolist(column) == [0.0, 3.0, 2.0]
+
+
+def test_Snapshot_mixed_layouts():
+    for backend in _backends():
+        # The root lacks some files of its children
+        root = cgroup.StatLayout()
+        child = cgroup.StatLayout()
+        records = [
+            root.make_record({'stat': {'anon': 600}}),
+            child.make_record({'current': 100, 'stat': {'anon': 50}}),
+            child.make_record({'current': 200, 'stat': {'anon': 70}}),
+        ]
+        cur = snapshot.Snapshot.from_records(['/', 'a', 'b'], records, 100.0, backend)
+        assert cur.tolist(cur.column(('stat', 'anon'))) == [600, 50, 70]
+        assert cur.tolist(cur.column(('current',)), None) == [None, 100, 200]
+        # The other layout comes first
+        cur = snapshot.Snapshot.from_records(['b', '/'], [records[2], records[0]],
+                                             100.0, backend)
+        assert cur.tolist(cur.column(('stat', 'anon'))) == [70, 600]
+        assert cur.tolist(cur.column(('current',)), None) == [200, None]
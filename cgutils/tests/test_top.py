@@ -0,0 +1,255 @@
+import argparse
+import collections
+
+from cgutils import cgroup
+from cgutils.commands import top
+
+
+def _make_cgtopstats(names, hierarchies):
+    # Without scanning hierarchies of the host
+    stats = top.CGTopStats.__new__(top.CGTopStats)
+    stats.options = argparse.Namespace(tail_interval=4.0, max_reads_per_tick=None,
+                                       max_collect_ms=None, delay_seconds=1.0)
+    stats.hierarchies = hierarchies
+    stats.cgroups = dict((name, []) for name in names)
+    stats.samples = {}
+    stats.metrics = {}
+    stats.hot = None
+    stats.tail = collections.OrderedDict((name, None) for name in names)
+    stats.unsampled = set(names)
+    stats.pending = []
+    stats.last_update = None
+    return stats
+
+
+def test_select_top():
+    rows = [{'name': 'g%d' % i, 'cpu.user': float(i % 7)} for i in range(50)]
+    for key in ['cpu.user', 'name']:
+        for reverse in [True, False]:
+            expected = sorted(rows, key=lambda st: st[key], reverse=reverse)
+            # Ties keep the order of rows as sort does
+            assert top.select_top(rows, key, 5, reverse) == expected[:5]
+            assert top.select_top(rows, key, None, reverse) == expected
+            assert top.select_top(rows, key, 100, reverse) == expected
+    assert top.select_top(rows, 'name', 0) == []
+    assert top.select_top([], 'name', 5) == []
+
+
+def test_changed_column():
+    def line(text, attr=0, fill=None):
+        return (((text, attr),), fill)
+    assert top._changed_column(None, line('abc')) == 0
+    assert top._changed_column(line('abcd'), line('abxd')) == 2
+    assert top._changed_column(line('abc'), line('abcdef')) == 3
+    # Headers and other attrs are redrawn as a whole
+    assert top._changed_column(line('abcd', 1), line('abxd')) == 0
+    assert top._changed_column(line('abcd', fill=1), line('abxd', fill=1)) == 0
+    # Characters may be wider than a column
+    assert top._changed_column(line(u'あbcd'), line(u'あbxd')) == 0
+
+
+def test_CGTopStats_split_max_fds():
+    assert top.CGTopStats.split_max_fds(512) == (384, 128)
+    assert top.CGTopStats.split_max_fds(1) == (1, 0)
+    assert top.CGTopStats.split_max_fds(0) == (0, 0)
+
+
+def test_CGTopStats_schedule():
+    names = ['g%d' % i for i in range(10)]
+    stats = _make_cgtopstats(names, ['blkio'])
+    assert sorted(stats._schedule(100.0, cgroup.Budget())) == sorted(names)
+    stats.last_update = 100.0
+    stats.set_hot(['g9', 'gone'])
+    assert sorted(stats._schedule(101.0, cgroup.Budget())) == sorted(names)
+    stats.unsampled = set()
+    # A quarter of the tail per second besides the hot ones
+    sampled = set()
+    for i in range(4):
+        names_ = stats._schedule(101.0, cgroup.Budget())
+        assert 'g9' in names_ and len(names_) <= 4
+        sampled.update(names_)
+    assert sampled == set(names)
+    stats.set_hot(None)
+    assert len(stats._schedule(101.0, cgroup.Budget())) == 10
+
+
+def test_CGTopStats_schedule_budget():
+    names = ['g%d' % i for i in range(10)]
+    stats = _make_cgtopstats(names, ['blkio'])
+    stats.last_update = 100.0
+    stats.unsampled = set()
+    stats.set_hot(['g9'])
+    stats.metrics = {'g1': {'cpu.user': 1.0}, 'g0': {'cpu.user': 0.0}}
+    stats.pending = ['g2', 'gone']
+    # Hot, active, then ones left unread last time
+    names_ = stats._schedule(101.0, cgroup.Budget(max_reads=1))
+    assert names_ == ['g9', 'g1', 'g2', 'g0']
+    # Overdue ones don't starve behind hot and active ones
+    stats.samples = {'g4': (96.0, 0, {})}
+    stats.pending = ['g4']
+    names_ = stats._schedule(101.0, cgroup.Budget(max_reads=1))
+    assert names_[:2] == ['g4', 'g9']
+
+
+def test_CGTopStats_schedule_small_budget():
+    names = ['g%d' % i for i in range(20)]
+    stats = _make_cgtopstats(names, ['cpuacct', 'blkio', 'memory'])
+    # Three reads per group name
+    for name in names:
+        stats.cgroups[name] = [None] * 3
+    stats.set_hot(names[:10])
+
+    def read(now):
+        # As update does
+        budget = cgroup.Budget(max_reads=12)
+        names_ = stats._schedule(now, budget)
+        read = [name for name in names_ if budget.take(len(stats.cgroups[name]))]
+        stats.pending = [name for name in names_ if name not in read]
+        for name in read:
+            stats.samples[name] = (now, 0, {})
+            stats.unsampled.discard(name)
+        stats.last_update = now
+        return read
+    stats.last_update = 0.0
+    sampled = set()
+    for i in range(40):
+        sampled.update(read(i + 1.0))
+    # The budget is smaller than the hot groups, but the tail is read
+    assert sampled == set(names)
+
+    # Larger than the whole budget, but read as the first one in turns
+    stats.cgroups['g0'] = [None] * 20
+    stats.set_hot(['g0'])
+    stats.pending = []
+    sampled = set()
+    for i in range(10):
+        read_ = read(100.0 + i)
+        assert 'g0' not in read_ or read_ == ['g0']
+        sampled.update(read_)
+    assert sampled == set(names)
+
+
+def test_CGTopStats_update_metrics():
+    stats = _make_cgtopstats(['a', 'b'], ['blkio'])
+    layout = cgroup.StatLayout()
+
+    def records(read):
+        io = {'throttle.io_service_bytes': {'8:0': {'Read': read, 'Write': 0}}}
+        return {'blkio': layout.make_record(io)}
+    stats._update_metrics({'a': records(0), 'b': records(0)}, 100.0, 0)
+    assert stats.metrics == {}
+    stats._update_metrics({'a': records(10)}, 101.0, 0)
+    assert stats.metrics['a']['bio.read'] == 10.0
+    assert 'b' not in stats.metrics and stats.unsampled == set(['b'])
+    # Rates are per second of the interval of each group
+    stats._update_metrics({'a': records(30), 'b': records(40)}, 104.0, 0)
+    assert abs(stats.metrics['a']['bio.read'] - 20 / 3.0) < 1e-9
+    assert stats.metrics['b']['bio.read'] == 10.0
+    assert stats.unsampled == set()
+
+
+def test_CGTopStats_update_metrics_memory():
+    stats = _make_cgtopstats(['hot', 'tail'], ['memory'])
+    stats.options.delay_seconds = 2.0
+    layout = cgroup.StatLayout()
+
+    def records(usage, rss):
+        return {'memory': layout.make_record({'usage_in_bytes': usage, 'stat': {'rss': rss}})}
+    stats._update_metrics({'hot': records(0, 0), 'tail': records(0, 0)}, 100.0, 0)
+    stats._update_metrics({'hot': records(400, 200)}, 102.0, 0)
+    # The tail is sampled at four times the interval of the hot one
+    stats._update_metrics({'tail': records(1600, 800)}, 108.0, 0)
+    for name in ['hot', 'tail']:
+        # Changes per delay_seconds
+        assert stats.metrics[name]['mem.total'] == 400
+        assert stats.metrics[name]['mem.rss'] == 200
+        assert stats.metrics[name]['mem.swap'] == 0
+
+
+def test_CGTopStats_update_metrics_unified():
+    import os
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        mount_point = os.path.join(root, 'unified')
+        with open(os.path.join(root, 'mounts'), 'w') as f:
+            f.write('cgroup2 %s cgroup2 rw 0 0\n' % mount_point)
+
+        def write(d, anon, current):
+            files = {
+                'cgroup.procs': '',
+                'cpu.stat': 'user_usec 0\nsystem_usec 0\n',
+                'memory.stat': 'anon %d\nfile 0\n' % anon,
+                'io.stat': '',
+            }
+            # The root of cgroup2 has no memory.current nor memory.swap.current
+            if d:
+                files['memory.current'] = '%d\n' % current
+                files['memory.swap.current'] = '0\n'
+            for name, content in files.items():
+                with open(os.path.join(mount_point, d, name), 'w') as f:
+                    f.write(content)
+        os.mkdir(mount_point)
+        os.mkdir(os.path.join(mount_point, 'a.slice'))
+        write('', 1000, None)
+        write('a.slice', 100, 200)
+        status = cgroup.SubsystemStatus(os.path.join(root, 'cgroups'),
+                                        os.path.join(root, 'mounts'))
+
+        stats = _make_cgtopstats(['', 'a.slice'], ['unified'])
+        stats.clk_tck = 100
+        root_cgroup = cgroup.scan_cgroups('unified', top.CGTopStats.FILTERS['unified'],
+                                          status=status)
+        cgroups = [root_cgroup, root_cgroup.childs[0]]
+        assert root_cgroup.get_stat_record().layout is not cgroups[1].get_stat_record().layout
+
+        def sample(now):
+            # The root comes first
+            records = collections.OrderedDict()
+            for cg in cgroups:
+                records[cg.fullname] = {'unified': cg.get_stat_record()}
+            stats._update_metrics(records, now, 100)
+        sample(100.0)
+        write('', 1600, None)
+        write('a.slice', 150, 300)
+        sample(101.0)
+        root_name = root_cgroup.fullname
+        assert stats.metrics[root_name]['mem.rss'] == 600
+        assert stats.metrics[root_name]['mem.total'] == 0
+        assert stats.metrics['a.slice']['mem.rss'] == 50
+        assert stats.metrics['a.slice']['mem.total'] == 100
+    finally:
+        shutil.rmtree(root)
+
+
+def test_CGTopStats_apply_release_events():
+    import os
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        stats = _make_cgtopstats(['a', 'b'], ['memory'])
+        cgroups = {}
+        for name in ['a', 'b']:
+            fullpath = os.path.join(root, name)
+            os.mkdir(fullpath)
+            cgroups[name] = argparse.Namespace(fullpath=fullpath)
+            stats.cgroups[name] = [cgroups[name]]
+        removed = []
+        stats._remove_cgroup = lambda fullpath: removed.append(fullpath)
+
+        events = [['/a', '/b'], [], []]
+        stats.release_listener = argparse.Namespace(read_events=lambda: events.pop(0))
+        stats.released = set()
+        stats._apply_release_events()
+        os.rmdir(cgroups['a'].fullpath)
+        # Checked once on the next update
+        stats._apply_release_events()
+        assert removed == [cgroups['a'].fullpath]
+        # b is still there, e.g., an idle group, and is forgotten
+        assert stats.released == set()
+        stats._apply_release_events()
+        assert removed == [cgroups['a'].fullpath]
+    finally:
+        shutil.rmtree(root)
@@ -14,7 +14,6 @@ classifiers = [
     'Programming Language :: C',
     'Programming Language :: Python',
     'Programming Language :: Python :: 3',
-    'Programming Language :: Python :: 3.4',
     'Programming Language :: Python :: 3.5',
     'Programming Language :: Python :: 3.6',
     'Programming Language :: Python :: 3.7',
@@ -31,7 +30,7 @@ setup(name='cgroup-utils',
       version=VERSION,
       description='Utility tools for control groups of Linux',
       long_description=long_description,
-      scripts=['bin/cgutil'],
+      scripts=['bin/cgutil', 'bin/cgutil-release-agent'],
       packages=['cgutils', 'cgutils.commands'],
       ext_package='cgutils',
       ext_modules=[mod_linux],
@@ -40,6 +39,7 @@ setup(name='cgroup-utils',
       url='https://github.com/peo3/cgroup-utils',
       license='GPLv2',
       classifiers=classifiers,
+      python_requires='>=3.5',
       install_requires=['argparse'],
       tests_require=['nose', 'pep8'],
       test_suite='nose.collector',
@@ -47,5 +47,8 @@ setup(name='cgroup-utils',
           test=[
               'nose',
               'pep8',
-          ]
+          ],
+          numpy=[
+              'numpy',
+          ],
       ),)